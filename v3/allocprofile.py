@@ -0,0 +1,174 @@
+# PYTHON RAYCASTER
+# Inspired by https://www.youtube.com/watch?v=gYRrGTC7GtA
+# Copyright (C) 2023 Daniele Verducci
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Allocation profiling
+# Measures, for every stage of every frame (input, draw, present...), the memory allocated
+# and the garbage collector pauses:
+#   ./raycaster.py --alloc-profile alloc.csv
+#   ./replay.py rec.txt --headless --alloc-profile alloc.csv
+# The game loop calls beginFrame(), then stage(name) when every stage starts, and endFrame().
+# For every stage it logs:
+#   net bytes      memory still allocated at the end of the stage (caches, growing lists)
+#   peak bytes     highest memory above the start of the stage: objects created and freed
+#                  within the stage (floats, tuples, rects...) only show up here
+#   gc pauses      collections run during the stage, and how long they stopped the game
+# Every ALLOC_SNAPSHOT_INTERVAL frames, tracemalloc snapshots taken around every stage
+# attribute the net allocations to the source lines making them.
+# The report (printed by report()) lists the stages and the top lines, and how many frames
+# spent more than ALLOC_GC_BUDGET_MS in collections. With a file name, the per frame and
+# stage values are also written as CSV.
+# Everything runs slower while profiling (tracemalloc hooks every allocation): compare
+# allocations, not frame times.
+
+import gc
+import csv
+import time
+import tracemalloc
+from replay import percentile
+
+ALLOC_TRACE_FRAMES = 1	# Stack frames kept for every allocation (1: the line allocating)
+ALLOC_SNAPSHOT_INTERVAL = 30	# Frames between snapshots attributing allocations to source lines
+ALLOC_TOP_LINES = 5	# Source lines listed for every stage in the report
+ALLOC_GC_BUDGET_MS = 1.0	# Collection time per frame above which a frame is counted as over budget
+
+class StageStats:
+
+	def __init__(self, name):
+		self.name = name
+		self.frames = 0
+		self.netBytes = 0
+		self.peakBytes = 0	# Highest of all frames
+		self.peakBytesTotal = 0
+		self.gcCollections = 0
+		self.gcPause = 0.0
+		self.gcMaxPause = 0.0	# Longest in a single frame
+		self.lines = {}	# (file, line) -> [net bytes, net blocks], from snapshots
+
+class AllocationProfiler:
+
+	def __init__(self, csvFilePath=None, snapshotInterval=ALLOC_SNAPSHOT_INTERVAL, topLines=ALLOC_TOP_LINES):
+		self.csvFilePath = csvFilePath
+		self.snapshotInterval = snapshotInterval
+		self.topLines = topLines
+		self.stages = {}	# Name -> StageStats, in the order they first ran
+		self.rows = []	# (frame, stage, net bytes, peak bytes, collections, pause ms)
+		self.frameGcPauses = []	# Collection time of every frame, in seconds
+		self.frame = 0
+		self.stageName = None
+		self.snapshotting = False
+		# Not traced: the profiler itself
+		self.filters = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, "<unknown>"))
+		self.gcStartTime = 0.0
+		self.gcCollections = 0	# During the current stage
+		self.gcPause = 0.0
+		self.frameGcPause = 0.0
+
+	def start(self):
+		tracemalloc.start(ALLOC_TRACE_FRAMES)
+		gc.callbacks.append(self.onGc)
+
+	def stop(self):
+		gc.callbacks.remove(self.onGc)
+		tracemalloc.stop()
+
+	def onGc(self, phase, info):
+		# Called by the garbage collector before and after every collection
+		if phase == "start":
+			self.gcStartTime = time.perf_counter()
+		else:
+			pause = time.perf_counter() - self.gcStartTime
+			self.gcCollections = self.gcCollections + 1
+			self.gcPause = self.gcPause + pause
+
+	def beginFrame(self):
+		self.frame = self.frame + 1
+		self.frameGcPause = 0.0
+		self.snapshotting = self.snapshotInterval > 0 and self.frame % self.snapshotInterval == 0
+
+	def stage(self, name):
+		# Ends the current stage (if any) and starts the next one
+		self.endStage()
+		self.stageName = name
+		self.stageSnapshot = tracemalloc.take_snapshot() if self.snapshotting else None
+		# Measured after the snapshot, which stays allocated until the end of the stage
+		self.stageMemory = tracemalloc.get_traced_memory()[0]
+		tracemalloc.reset_peak()
+		self.gcCollections = 0
+		self.gcPause = 0.0
+
+	def endStage(self):
+		if self.stageName is None:
+			return
+		memory, peak = tracemalloc.get_traced_memory()
+		gcCollections = self.gcCollections
+		gcPause = self.gcPause
+		stats = self.stages.get(self.stageName)
+		if stats is None:
+			stats = StageStats(self.stageName)
+			self.stages[self.stageName] = stats
+		netBytes = memory - self.stageMemory
+		peakBytes = peak - self.stageMemory
+		stats.frames = stats.frames + 1
+		stats.netBytes = stats.netBytes + netBytes
+		stats.peakBytes = max(stats.peakBytes, peakBytes)
+		stats.peakBytesTotal = stats.peakBytesTotal + peakBytes
+		stats.gcCollections = stats.gcCollections + gcCollections
+		stats.gcPause = stats.gcPause + gcPause
+		stats.gcMaxPause = max(stats.gcMaxPause, gcPause)
+		self.frameGcPause = self.frameGcPause + gcPause
+		self.rows.append((self.frame, self.stageName, netBytes, peakBytes, gcCollections, "{:.3f}".format(1000 * gcPause)))
+
+		if self.stageSnapshot is not None:
+			# Filtered only now, as filtering allocates (and caches) too
+			snapshot = tracemalloc.take_snapshot().filter_traces(self.filters)
+			for difference in snapshot.compare_to(self.stageSnapshot.filter_traces(self.filters), "lineno"):
+				if difference.size_diff == 0 and difference.count_diff == 0:
+					continue
+				frame = difference.traceback[0]
+				line = stats.lines.setdefault((frame.filename, frame.lineno), [0, 0])
+				line[0] = line[0] + difference.size_diff
+				line[1] = line[1] + difference.count_diff
+			self.stageSnapshot = None
+		self.stageName = None
+
+	def endFrame(self):
+		self.endStage()
+		self.frameGcPauses.append(self.frameGcPause)
+
+	def report(self):
+		# Prints the report, and writes the CSV file if requested
+		if not self.frameGcPauses:
+			return
+		print("Allocations over {} frames (top lines from a snapshot every {} frames):".format(len(self.frameGcPauses), self.snapshotInterval))
+		print("{:<12} {:>14} {:>14} {:>14} {:>12} {:>12} {:>12}".format("stage", "net B/frame", "peak B/frame", "max peak B", "gc/frame", "gc ms/frame", "max gc ms"))
+		for stats in self.stages.values():
+			print("{:<12} {:>14.0f} {:>14.0f} {:>14} {:>12.2f} {:>12.3f} {:>12.3f}".format(
+				stats.name, stats.netBytes / stats.frames, stats.peakBytesTotal / stats.frames, stats.peakBytes,
+				stats.gcCollections / stats.frames, 1000 * stats.gcPause / stats.frames, 1000 * stats.gcMaxPause))
+			lines = sorted(stats.lines.items(), key=lambda item: abs(item[1][0]), reverse=True)[:self.topLines]
+			for (fileName, lineNumber), (size, count) in lines:
+				print("    {}:{}: {:+} B in {:+} blocks".format(fileName, lineNumber, size, count))
+		sortedPauses = sorted(self.frameGcPauses)
+		overBudget = sum(1 for pause in sortedPauses if pause * 1000 > ALLOC_GC_BUDGET_MS)
+		print("GC pause per frame: median {:.3f} ms, p95 {:.3f} ms, max {:.3f} ms, {} frames over {} ms".format(
+			1000 * percentile(sortedPauses, 0.5), 1000 * percentile(sortedPauses, 0.95), 1000 * sortedPauses[-1], overBudget, ALLOC_GC_BUDGET_MS))
+
+		if self.csvFilePath:
+			with open(self.csvFilePath, "w", newline="") as csvFile:
+				writer = csv.writer(csvFile)
+				writer.writerow(("frame", "stage", "net_bytes", "peak_bytes", "gc_collections", "gc_pause_ms"))
+				writer.writerows(self.rows)
@@ -0,0 +1,173 @@
+# PYTHON RAYCASTER
+# Inspired by https://www.youtube.com/watch?v=gYRrGTC7GtA
+# Copyright (C) 2023 Daniele Verducci
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Batched multi-camera renderer
+# Renders many views at once (e.g. one per agent) using NumPy: the rays of all the cameras
+# are cast together, stepping the same horizontal / vertical grid lines as castRay(), against
+# a shared texture store. Cameras may look at the same map or at different copies of it
+# (e.g. one per environment, when every environment has its own doors).
+# Frames are the same, to the last pixel, as SoftRenderer casting every column (spanColumns 1,
+# no doors registry or lighting): rays and rows are computed in float64, with the same
+# operations as castRay() and SoftRenderer.drawColumn().
+#
+# Requires NumPy:
+# pip install numpy
+
+import math
+import numpy as np
+from raycaster import TileMap, MAP_SCALE, TEXTURE_SIZE, RAYCAST_RENDER_WIDTH, RAYCAST_RENDER_HEIGHT, CEILING_COLOR, FLOOR_COLOR
+from softrender import packColor
+
+BATCH_CAMERAS_PER_CHUNK = 32	# Cameras textured together: bounds the temporary N x H x W arrays
+
+def toRGBArray(frames):
+	# Converts packed 0x00RRGGBB frames (... x H x W, uint32) to RGB24 (... x H x W x 3, uint8)
+	rgb = np.empty(frames.shape + (3,), dtype=np.uint8)
+	rgb[..., 0] = frames >> 16
+	rgb[..., 1] = frames >> 8
+	rgb[..., 2] = frames
+	return rgb
+
+class BatchRenderer:
+
+	def __init__(self, textures, tileMap=None, width=RAYCAST_RENDER_WIDTH, height=RAYCAST_RENDER_HEIGHT, mapsCount=1):
+		# textures is a TextureStore, tileMap defaults to the built-in map
+		if tileMap is None:
+			tileMap = TileMap()
+		self.mapSize = tileMap.size
+		self.width = width
+		self.height = height
+
+		# One row per map copy, cameras choose their map with mapIds
+		self.maps = np.tile(np.asarray(tileMap.cells, dtype=np.int32), (mapsCount, 1))
+
+		# All the textures one after another, followed by their shaded version
+		self.texturesCount = textures.count
+		self.texels = np.concatenate([np.asarray(textures.texels, dtype=np.uint32), np.asarray(textures.shadedTexels, dtype=np.uint32)])
+
+		self.rowsY = np.arange(height, dtype=np.float64).reshape(1, height, 1)	# float64, to round like SoftRenderer
+		self.background = np.where(np.arange(height) < height // 2, packColor(CEILING_COLOR), packColor(FLOOR_COLOR)).astype(np.uint32).reshape(1, height, 1)
+
+	def setCell(self, mapId, mapArrayPosition, value):
+		# Updates a cell of a map copy (e.g. after a door has been opened)
+		self.maps[mapId, mapArrayPosition] = value
+
+	def castRays(self, poses, mapIds=None):
+		# Casts one ray per column for every camera.
+		# poses is a N x 3 array of (x, y, r), in map pixels and radiants (like a Camera)
+		# Returns (distance, hitTile, texColumn, shading), each N x W
+		poses = np.asarray(poses, dtype=np.float64).reshape(-1, 3)
+		if mapIds is None:
+			mapIds = np.zeros(len(poses), dtype=np.intp)
+		playerX = poses[:, 0:1]
+		playerY = poses[:, 1:2]
+
+		# Cast one ray for every column, from -0,5 rads to +0,5 rads (about 60° viewing angle)
+		rayAngle = poses[:, 2:3] + np.arange(self.width) / self.width - 0.5
+		rayAngle = np.where(rayAngle < 0, rayAngle + math.pi * 2, rayAngle)
+		rayAngle = np.where(rayAngle > math.pi * 2, rayAngle - math.pi * 2, rayAngle)
+
+		with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+			# math.tan(), as castRay(): np.tan() differs from it in the last bit for some angles
+			tan = np.frompyfunc(math.tan, 1, 1)(rayAngle).astype(np.float64)
+
+			# Check horizontal lines
+			aTan = -1 / tan
+			lookingUp = rayAngle > math.pi
+			rowY = np.floor(playerY / MAP_SCALE) * MAP_SCALE
+			horizY = np.where(lookingUp, rowY - 0.00001, rowY + MAP_SCALE)
+			horizX = (playerY - horizY) * aTan + playerX
+			yOffset = np.where(lookingUp, -MAP_SCALE, MAP_SCALE)
+			xOffset = -yOffset * aTan
+			parallel = (rayAngle == 0) | (rayAngle == math.pi)	# Ray will never intersect horizontal lines
+			horizY = np.where(parallel, playerY, horizY)
+			horizX = np.where(parallel, playerX + 2 * self.mapSize * MAP_SCALE, horizX)
+			horizX, horizY, horizTile = self.march(mapIds, horizX, horizY, xOffset, yOffset, parallel)
+
+			# Check vertical lines
+			nTan = -tan
+			lookingLeft = (rayAngle > math.pi * 0.5) & (rayAngle < math.pi * 1.5)
+			columnX = np.floor(playerX / MAP_SCALE) * MAP_SCALE
+			vertX = np.where(lookingLeft, columnX - 0.00001, columnX + MAP_SCALE)
+			vertY = (playerX - vertX) * nTan + playerY
+			xOffset = np.where(lookingLeft, -MAP_SCALE, MAP_SCALE)
+			yOffset = -xOffset * nTan
+			parallel = (rayAngle == math.pi * 0.5) | (rayAngle == math.pi * 1.5)	# Ray will never intersect vertical lines
+			vertX = np.where(parallel, playerX, vertX)
+			vertY = np.where(parallel, playerY + 2 * self.mapSize * MAP_SCALE, vertY)
+			vertX, vertY, vertTile = self.march(mapIds, vertX, vertY, xOffset, yOffset, parallel)
+
+		# Not np.hypot(): distances are computed as castRay() does, to the last bit
+		horizDist = np.sqrt((horizX - playerX) * (horizX - playerX) + (horizY - playerY) * (horizY - playerY))
+		vertDist = np.sqrt((vertX - playerX) * (vertX - playerX) + (vertY - playerY) * (vertY - playerY))
+		shading = vertDist > horizDist	# Horizontal wall is nearer
+		distance = np.where(shading, horizDist, vertDist)
+		hitTile = np.where(shading, horizTile, vertTile)
+		texCoord = np.where(shading, horizX, vertY)
+		texColumn = np.mod(texCoord / (MAP_SCALE / TEXTURE_SIZE), TEXTURE_SIZE).astype(np.intp)
+		return distance, hitTile, texColumn, shading
+
+	def march(self, mapIds, rayX, rayY, xOffset, yOffset, done):
+		# Advances all the rays along their grid lines until they reach a wall or the depth of field
+		mapSize = self.mapSize
+		done = done.copy()
+		hitTile = np.zeros(rayX.shape, dtype=np.int32)
+		mapRows = np.broadcast_to(mapIds.reshape(-1, 1), rayX.shape)
+		for dof in range(2 * mapSize):
+			if done.all():
+				break
+			mapX = np.trunc(rayX / MAP_SCALE)
+			mapY = np.trunc(rayY / MAP_SCALE)
+			inside = (mapX >= 0) & (mapX < mapSize) & (mapY >= 0) & (mapY < mapSize) & ~done
+			mapArrayPosition = np.where(inside, mapY * mapSize + mapX, 0).astype(np.intp)
+			tile = np.where(inside, self.maps[mapRows, mapArrayPosition], 0)
+			hit = tile != 0
+			hitTile = np.where(hit, tile, hitTile)
+			done = done | hit
+			# Didn't hit the wall: check successive line
+			rayX = np.where(done, rayX, rayX + xOffset)
+			rayY = np.where(done, rayY, rayY + yOffset)
+		return rayX, rayY, hitTile
+
+	def render(self, poses, mapIds=None, depth=False):
+		# Renders N views. Returns a N x H x W uint32 array of packed 0x00RRGGBB frames,
+		# and also the N x W wall distances if depth is True
+		distance, hitTile, texColumn, shading = self.castRays(poses, mapIds)
+		frames = np.empty((len(distance), self.height, self.width), dtype=np.uint32)
+		for start in range(0, len(distance), BATCH_CAMERAS_PER_CHUNK):
+			end = start + BATCH_CAMERAS_PER_CHUNK
+			frames[start:end] = self.drawColumns(distance[start:end], hitTile[start:end], texColumn[start:end], shading[start:end])
+		if depth:
+			return frames, distance
+		return frames
+
+	def drawColumns(self, distance, hitTile, texColumn, shading):
+		# Textures the wall slices of a chunk of cameras
+		height = self.height
+		lineHeight = (MAP_SCALE * height / distance)[:, np.newaxis, :]
+		lineOffset = height / 2 - lineHeight / 2
+		lineStart = np.maximum(np.floor(lineOffset), 0)
+		lineEnd = np.minimum(np.floor(lineOffset + lineHeight), height)
+		isWall = (self.rowsY >= lineStart) & (self.rowsY < lineEnd)
+
+		texRow = ((self.rowsY - lineOffset) * (TEXTURE_SIZE / lineHeight)).astype(np.intp)
+		np.clip(texRow, 0, TEXTURE_SIZE - 1, out=texRow)
+		# Tile 0 (no wall reached) uses the last texture, like Main.drawRays()
+		texIndex = np.mod(hitTile - 1, self.texturesCount) + shading * self.texturesCount
+		texelBase = (texIndex * (TEXTURE_SIZE * TEXTURE_SIZE) + texColumn)[:, np.newaxis, :]
+		colors = self.texels[texelBase + texRow * TEXTURE_SIZE]
+		return np.where(isWall, colors, self.background)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+# PYTHON RAYCASTER
+# Inspired by https://www.youtube.com/watch?v=gYRrGTC7GtA
+# Copyright (C) 2023 Daniele Verducci
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# BATCH RENDERER
+# Renders a camera path without opening any window, as a PNG sequence:
+#   ./batchrender.py path.txt -o frames/
+# or as a raw RGB24 stream, to be piped into an encoder:
+#   ./batchrender.py path.txt --raw | ffmpeg -f rawvideo -pix_fmt rgb24 -s 250x250 -r 30 -i - out.mp4
+#
+# The camera path file contains one pose per line: "x y r", with x and y in map cells
+# (like PLAYER_SPAWN_POSITION) and r in radiants. Lines starting with "#" are comments.
+# Frames are rendered by a pool of worker processes and written by a background thread, with
+# the doors (closed), visibility and lighting of the game. If writing fails (e.g. the encoder
+# reading the raw stream exits), rendering stops and the exit status is 1.
+
+import os
+import math
+import sys
+import time
+import queue
+import argparse
+import threading
+import multiprocessing
+import png
+from raycaster import Camera, TileMap, MAP_SCALE, MAP_DOOR_CELL_TYPE, PVS_FILE, RAYCAST_RENDER_WIDTH, RAYCAST_RENDER_HEIGHT, LIGHTING, LIGHTS
+from doors import DoorRegistry
+from visibility import loadOrComputeVisibility
+from lighting import LightMaps
+from softrender import SoftRenderer, loadTextures, toRGB, ASSETS_BASE_DIR
+from level import loadLevel
+
+WRITE_QUEUE_FRAMES_PER_WORKER = 4	# Max frames waiting to be written, per worker
+WRITE_QUEUE_TIMEOUT = 0.1	# Seconds between checks that the writer thread is still running
+
+workerRenderer = None	# Every worker process has its own renderer
+
+def loadCameraPath(cameraPathFilePath):
+	# Loads a camera path file. Returns a list of Cameras
+	poses = []
+	with open(cameraPathFilePath) as cameraPathFile:
+		for lineNumber, line in enumerate(cameraPathFile, 1):
+			line = line.strip()
+			if not line or line.startswith("#"):
+				continue
+			values = line.replace(",", " ").split()
+			if len(values) != 3:
+				raise ValueError("Camera path {}, line {}: expected \"x y r\", found \"{}\"".format(cameraPathFilePath, lineNumber, line))
+			poses.append(Camera(float(values[0]) * MAP_SCALE, float(values[1]) * MAP_SCALE, float(values[2]) % (2 * math.pi)))
+	return poses
+
+def initWorker(tileMap, pvs):
+	# Renders like the game (and replay.py --headless): pvs is computed once, by the main process
+	global workerRenderer
+	doors = DoorRegistry(tileMap.cells, tileMap.size, MAP_DOOR_CELL_TYPE)
+	lightMaps = None
+	if LIGHTING:
+		lightMaps = LightMaps(tileMap, LIGHTS, doors)
+	workerRenderer = SoftRenderer(loadTextures(), tileMap, doors=doors, pvs=pvs, lightMaps=lightMaps)
+
+def renderPose(pose):
+	return toRGB(workerRenderer.renderFrame(pose))
+
+def writeFrames(frameQueue, outputDir, errors):
+	# Writer thread: writes frames in order, until it receives None. Stops at the first error,
+	# appended to errors
+	pngWriter = png.Writer(RAYCAST_RENDER_WIDTH, RAYCAST_RENDER_HEIGHT, greyscale=False)
+	try:
+		while True:
+			item = frameQueue.get()
+			if item is None:
+				return
+			frameNumber, rgb = item
+			if outputDir is None:
+				sys.stdout.buffer.write(rgb)
+			else:
+				with open(os.path.join(outputDir, "frame_{:06d}.png".format(frameNumber)), "wb") as pngFile:
+					pngWriter.write_array(pngFile, rgb)
+	except Exception as e:
+		errors.append(e)
+
+def putFrame(frameQueue, item, writer):
+	# Queues item for the writer thread. Returns False if the writer has stopped
+	while writer.is_alive():
+		try:
+			frameQueue.put(item, timeout=WRITE_QUEUE_TIMEOUT)
+			return True
+		except queue.Full:
+			pass
+	return False
+
+def main():
+	parser = argparse.ArgumentParser(description="Renders a camera path to a PNG sequence or a raw RGB24 stream, without opening any window")
+	parser.add_argument("camera_path", help="camera path file, one \"x y r\" pose per line")
+	parser.add_argument("-l", "--level", help="level file (default: the built-in map)")
+	output = parser.add_mutually_exclusive_group(required=True)
+	output.add_argument("-o", "--output-dir", help="write frame_NNNNNN.png files into this directory")
+	output.add_argument("--raw", action="store_true", help="write raw RGB24 frames to stdout")
+	parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="render processes (default: number of CPUs)")
+	args = parser.parse_args()
+
+	poses = loadCameraPath(args.camera_path)
+	if args.level:
+		tileMap = loadLevel(args.level)
+	else:
+		tileMap = TileMap()
+	pvs = loadOrComputeVisibility(tileMap.cells, tileMap.size, MAP_DOOR_CELL_TYPE, None if args.level else os.path.join(ASSETS_BASE_DIR, PVS_FILE))
+	if args.output_dir:
+		os.makedirs(args.output_dir, exist_ok=True)
+
+	frameQueue = queue.Queue(maxsize=WRITE_QUEUE_FRAMES_PER_WORKER * args.workers)
+	writeErrors = []
+	writer = threading.Thread(target=writeFrames, args=(frameQueue, args.output_dir, writeErrors))
+	writer.start()
+
+	startTime = time.time()
+	try:
+		with multiprocessing.Pool(args.workers, initializer=initWorker, initargs=(tileMap, pvs)) as pool:
+			chunkSize = max(1, len(poses) // (args.workers * 8))
+			for frameNumber, rgb in enumerate(pool.imap(renderPose, poses, chunkSize)):
+				if not putFrame(frameQueue, (frameNumber, rgb), writer):
+					break	# Leaving the with block stops the workers
+	finally:
+		putFrame(frameQueue, None, writer)
+		writer.join()
+	elapsed = time.time() - startTime
+
+	if writeErrors:
+		print("Writing frames failed: {}".format(writeErrors[0]), file=sys.stderr)
+		if isinstance(writeErrors[0], BrokenPipeError):
+			# Nobody reads stdout anymore: don't fail again flushing it at exit
+			os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+		return 1
+
+	# Stats go to stderr, as stdout may be carrying the video stream
+	print("Rendered {} frames in {:.2f}s ({:.1f} FPS, {} workers)".format(len(poses), elapsed, len(poses) / max(elapsed, 0.000001), args.workers), file=sys.stderr)
+	return 0
+
+if __name__ == '__main__':
+	try:
+		sys.exit(main())
+	except KeyboardInterrupt:
+		exit(0)
@@ -0,0 +1,112 @@
+# PYTHON RAYCASTER
+# Inspired by https://www.youtube.com/watch?v=gYRrGTC7GtA
+# Copyright (C) 2023 Daniele Verducci
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Vectorized collision
+# Moves many actors at once against the tile grid, with the same rules used for the player
+# by Player.moveRelative(): every actor is a square collision box (center +- radius), each axis is
+# swept separately (so actors slide along walls) and stops right before the first solid cell.
+# The number of NumPy operations per tick depends on how many cells an actor crosses, not on
+# the number of actors.
+# With a DoorRegistry, doors are solid unless completely open, like for the player.
+#
+# Requires NumPy:
+# pip install numpy
+
+import numpy as np
+from raycaster import TileMap, MAP_SCALE, PLAYER_RADIUS, COLLISION_EPSILON
+
+class ActorCollider:
+
+	def __init__(self, tileMap=None, doors=None):
+		# doors is the DoorRegistry, if any
+		if tileMap is None:
+			tileMap = TileMap()
+		mapSize = tileMap.size
+		self.mapSize = mapSize
+		# Solid cells, with a solid border: cells outside the map are clipped onto it
+		self.solid = np.ones((mapSize + 2, mapSize + 2), dtype=bool)
+		self.solid[1:-1, 1:-1] = np.asarray(tileMap.cells).reshape(mapSize, mapSize) != 0
+		self.doors = doors
+		self.doorsVersion = 0
+		if doors is not None:
+			for mapArrayPosition, door in doors.doors.items():
+				self.setCell(mapArrayPosition, not door.isPassable())
+			self.doorsVersion = doors.version
+
+	def updateDoors(self):
+		# Opens (or closes) the door cells whose door moved since the last call
+		if self.doors is None or self.doors.version == self.doorsVersion:
+			return
+		for mapArrayPosition in self.doors.changedCells(self.doorsVersion):
+			self.setCell(mapArrayPosition, not self.doors.get(mapArrayPosition).isPassable())
+		self.doorsVersion = self.doors.version
+
+	def setCell(self, mapArrayPosition, value):
+		# Updates a cell (e.g. after a door has been opened)
+		mapY, mapX = divmod(mapArrayPosition, self.mapSize)
+		self.solid[mapY + 1, mapX + 1] = value != 0
+
+	def isSolid(self, mapX, mapY):
+		mapX = np.clip(mapX, -1, self.mapSize) + 1
+		mapY = np.clip(mapY, -1, self.mapSize) + 1
+		return self.solid[mapY, mapX]
+
+	def move(self, positions, deltas, radius=PLAYER_RADIUS):
+		# Moves N actors. positions and deltas are N x 2 arrays of (x, y) in map pixels, radius
+		# is a scalar or a N array. Returns the new positions and a N x 2 array telling which
+		# actors have been stopped by a wall on each axis
+		self.updateDoors()
+		positions = np.array(positions, dtype=np.float64).reshape(-1, 2)
+		deltas = np.asarray(deltas, dtype=np.float64).reshape(-1, 2)
+		radius = np.broadcast_to(np.asarray(radius, dtype=np.float64), positions[:, 0].shape)
+		blocked = np.zeros(positions.shape, dtype=bool)
+		positions[:, 0], blocked[:, 0] = self.sweepAxis(positions[:, 0], deltas[:, 0], positions[:, 1], radius, False)
+		positions[:, 1], blocked[:, 1] = self.sweepAxis(positions[:, 1], deltas[:, 1], positions[:, 0], radius, True)
+		return positions, blocked
+
+	def sweepAxis(self, center, delta, sideCenter, radius, alongY):
+		# Vectorized TileMap.sweepAxis()
+		direction = np.where(delta < 0, -1, 1)
+		lead = center + direction * radius	# Box side facing the movement
+		firstSideCell = np.floor((sideCenter - radius) / MAP_SCALE).astype(np.intp)
+		lastSideCell = np.floor((sideCenter + radius) / MAP_SCALE).astype(np.intp)
+		startCell = np.floor(lead / MAP_SCALE).astype(np.intp)
+		crossings = np.abs(np.floor((lead + delta) / MAP_SCALE).astype(np.intp) - startCell)
+
+		newCenter = center + delta
+		blocked = np.zeros(center.shape, dtype=bool)
+		sideCells = int((lastSideCell - firstSideCell).max(initial=0)) + 1
+		for crossing in range(1, int(crossings.max(initial=0)) + 1):
+			# Check the crossing-th row (or column) of cells entered by every box still moving
+			moving = (crossing <= crossings) & ~blocked
+			if not moving.any():
+				break
+			cell = startCell + direction * crossing
+			hit = np.zeros(center.shape, dtype=bool)
+			for sideOffset in range(sideCells):
+				sideCell = firstSideCell + sideOffset
+				if alongY:
+					solid = self.isSolid(sideCell, cell)
+				else:
+					solid = self.isSolid(cell, sideCell)
+				hit = hit | (solid & (sideCell <= lastSideCell))
+			hit = hit & moving
+			# Stop touching the wall
+			stop = np.where(direction > 0, cell * MAP_SCALE - radius - COLLISION_EPSILON, (cell + 1) * MAP_SCALE + radius + COLLISION_EPSILON)
+			newCenter = np.where(hit, stop, newCenter)
+			blocked = blocked | hit
+		return newCenter, blocked
@@ -0,0 +1,133 @@
+# PYTHON RAYCASTER
+# Inspired by https://www.youtube.com/watch?v=gYRrGTC7GtA
+# Copyright (C) 2023 Daniele Verducci
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Sliding doors
+# Doors are thin walls in the middle of their cell, sliding sideways when opened and closing
+# by themselves after a while. Their state lives here, not in the map: door cells keep their
+# map value, so the map is never modified.
+# A door is "vertical" when its plane is parallel to the Y axis (it is passed through moving
+# along X, so the cells on its left and right are empty), "horizontal" otherwise.
+
+# Doors cfg
+DOOR_SLIDE_TIME = 1.0	# Seconds to open or close completely
+DOOR_STAY_OPEN_TIME = 3.0	# Seconds an open door waits before closing
+
+# Door states
+DOOR_CLOSED = 0
+DOOR_OPENING = 1
+DOOR_OPEN = 2
+DOOR_CLOSING = 3
+
+class Door:
+
+	def __init__(self, mapArrayPosition, vertical):
+		self.mapArrayPosition = mapArrayPosition
+		self.vertical = vertical
+		self.state = DOOR_CLOSED
+		self.openFraction = 0.0	# 0 is closed, 1 is completely open
+		self.openTimer = 0.0	# Seconds spent completely open
+		self.version = 0	# DoorRegistry version of its last move
+
+	def isPassable(self):
+		return self.state == DOOR_OPEN
+
+class DoorRegistry:
+
+	def __init__(self, mapCells, mapSize, doorCellType):
+		self.mapSize = mapSize
+		# mapArrayPosition -> Door, for O(1) lookup while casting
+		self.doors = {}
+		for mapArrayPosition, cell in enumerate(mapCells):
+			if cell == doorCellType:
+				mapY, mapX = divmod(mapArrayPosition, mapSize)
+				leftEmpty = mapX > 0 and mapCells[mapArrayPosition - 1] == 0
+				rightEmpty = mapX < mapSize - 1 and mapCells[mapArrayPosition + 1] == 0
+				self.doors[mapArrayPosition] = Door(mapArrayPosition, leftEmpty or rightEmpty)
+		self.moving = set()	# Doors currently opening, closing or waiting to close
+		# Incremented every time a door moves. Each cache keeps the version it last saw, and asks
+		# changedCells() for what moved since: caches don't take changes away from each other
+		self.version = 0
+
+	def get(self, mapArrayPosition):
+		return self.doors.get(mapArrayPosition)
+
+	def open(self, mapArrayPosition):
+		# Starts opening a door. Returns False if there is no door in the cell
+		door = self.doors.get(mapArrayPosition)
+		if door is None:
+			return False
+		if door.state == DOOR_OPEN:
+			door.openTimer = 0.0	# Keep it open a little longer
+		elif door.state != DOOR_OPENING:
+			door.state = DOOR_OPENING
+			self.moving.add(door)
+		return True
+
+	def update(self, elapsedTime, occupiedCells=()):
+		# Advances the animations by elapsedTime seconds. Doors in occupiedCells don't close
+		step = elapsedTime / DOOR_SLIDE_TIME
+		for door in list(self.moving):
+			if door.state == DOOR_OPENING:
+				door.openFraction = min(1.0, door.openFraction + step)
+				self.moved(door)
+				if door.openFraction >= 1.0:
+					door.state = DOOR_OPEN
+					door.openTimer = 0.0
+			elif door.state == DOOR_OPEN:
+				door.openTimer = door.openTimer + elapsedTime
+				if door.openTimer >= DOOR_STAY_OPEN_TIME and door.mapArrayPosition not in occupiedCells:
+					door.state = DOOR_CLOSING
+					self.moved(door)	# Not passable anymore
+			elif door.state == DOOR_CLOSING:
+				if door.mapArrayPosition in occupiedCells:
+					# Someone got in the way: open again
+					door.state = DOOR_OPENING
+					continue
+				door.openFraction = max(0.0, door.openFraction - step)
+				self.moved(door)
+				if door.openFraction <= 0.0:
+					door.state = DOOR_CLOSED
+					self.moving.discard(door)
+
+	def setOpenFraction(self, mapArrayPosition, openFraction):
+		# Moves a door to the given position, without animation (e.g. to follow a remote world).
+		# A door set completely open or closed is open or closed, otherwise it is opening: either
+		# way update() goes on from there, so a door set open closes after DOOR_STAY_OPEN_TIME
+		door = self.doors[mapArrayPosition]
+		if door.openFraction == openFraction:
+			return
+		door.openFraction = openFraction
+		if openFraction >= 1.0:
+			door.state = DOOR_OPEN
+			door.openTimer = 0.0
+			self.moving.add(door)
+		elif openFraction <= 0.0:
+			door.state = DOOR_CLOSED
+			self.moving.discard(door)
+		else:
+			door.state = DOOR_OPENING
+			self.moving.add(door)
+		self.moved(door)
+
+	def moved(self, door):
+		# Records that the door moved (or stopped being passable)
+		self.version = self.version + 1
+		door.version = self.version
+
+	def changedCells(self, sinceVersion):
+		# Cells whose door moved after version sinceVersion (the version a cache last saw)
+		return [mapArrayPosition for mapArrayPosition, door in self.doors.items() if door.version > sinceVersion]
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+# PYTHON RAYCASTER
+# Inspired by https://www.youtube.com/watch?v=gYRrGTC7GtA
+# Copyright (C) 2023 Daniele Verducci
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Shared memory frame export
+# Finished frames are published into a ring of slots in a shared memory block, where other
+# local processes (recorders, encoders, analysis tools) can read them without copies or sockets:
+#   ./raycaster.py --export raycaster
+#   ./frameexport.py raycaster          example reader: prints frame rate and dropped frames
+#
+# The block starts with EXPORT_HEADER, followed by slotsCount slots. Every slot has a
+# SLOT_HEADER (sequence, frame number, timestamp, pose) followed by the pixels (width x height
+# packed 0x00RRGGBB uint32, native byte order, high byte undefined) and, if EXPORT_FLAG_COLUMNS
+# is set, one float64 depth and one uint8 hit tile per raycast column (columns in the header: one
+# per pixel column in the frames of raycaster.py and replay.py).
+# Frames are numbered from 1 and frame n goes in slot n % slotsCount.
+#
+# The writer never waits for readers: a slow reader just finds its frames overwritten. Slots
+# are guarded by their sequence number (a seqlock): it is odd while the slot is being written,
+# and even once the frame is complete. Readers check it didn't change while they read.
+# Readers publish the last frame they read (consumedFrame), and the writer counts the frames
+# overwritten before being read (droppedFrames). With several readers, the last to read wins.
+
+import sys
+import time
+import struct
+import argparse
+from multiprocessing import shared_memory
+
+EXPORT_MAGIC = b"RCSM"
+EXPORT_VERSION = 1
+EXPORT_HEADER = struct.Struct("<4sHHIIIIQQQ")	# Magic, version, flags, width, height, columns, slots count, latest frame, consumed frame, dropped frames
+EXPORT_LATEST_OFFSET = 24	# Offsets of the header fields updated while running
+EXPORT_CONSUMED_OFFSET = 32
+EXPORT_DROPPED_OFFSET = 40
+EXPORT_FLAG_COLUMNS = 1	# Slots also hold depth and hit tile of every column
+EXPORT_SLOTS = 4
+SLOT_HEADER = struct.Struct("<QQdddd")	# Sequence, frame number, timestamp, pose x, y, r (map pixels)
+U64 = struct.Struct("<Q")
+
+def slotLayout(width, height, columns, withColumns):
+	# Returns (pixels size, columns size, slot size) in bytes. Slots are 8 bytes aligned
+	pixelsSize = width * height * 4
+	columnsSize = columns * 9 if withColumns else 0
+	slotSize = (SLOT_HEADER.size + pixelsSize + columnsSize + 7) // 8 * 8
+	return pixelsSize, columnsSize, slotSize
+
+def attachSharedMemory(name):
+	# Attaches to an existing block without registering it with the resource tracker,
+	# that would destroy it when this process exits (Python < 3.13 has no track=False)
+	try:
+		return shared_memory.SharedMemory(name, track=False)
+	except TypeError:
+		from multiprocessing import resource_tracker
+		sharedMemory = shared_memory.SharedMemory(name)
+		resource_tracker.unregister(sharedMemory._name, "shared_memory")
+		return sharedMemory
+
+class FrameExporter:
+
+	def __init__(self, name, width, height, columns=None, slotsCount=EXPORT_SLOTS, withColumns=True):
+		# columns is the number of raycast columns, by default one per pixel
+		self.width = width
+		self.height = height
+		self.columns = columns if columns is not None else width
+		self.slotsCount = slotsCount
+		self.withColumns = withColumns
+		self.pixelsSize, self.columnsSize, self.slotSize = slotLayout(width, height, self.columns, withColumns)
+		size = EXPORT_HEADER.size + slotsCount * self.slotSize
+		try:
+			self.sharedMemory = shared_memory.SharedMemory(name, create=True, size=size)
+		except FileExistsError:
+			# Left behind by a writer that crashed: replace it (readers still attached to it keep
+			# their mapping, and find no new frames)
+			print("Replacing the stale shared memory block {}".format(name), file=sys.stderr)
+			stale = shared_memory.SharedMemory(name)
+			stale.close()
+			stale.unlink()
+			self.sharedMemory = shared_memory.SharedMemory(name, create=True, size=size)
+		self.buffer = self.sharedMemory.buf
+		flags = EXPORT_FLAG_COLUMNS if withColumns else 0
+		EXPORT_HEADER.pack_into(self.buffer, 0, EXPORT_MAGIC, EXPORT_VERSION, flags, width, height, self.columns, slotsCount, 0, 0, 0)
+		self.frameNumber = 0
+		self.droppedFrames = 0
+
+	def slotOffset(self, frameNumber):
+		return EXPORT_HEADER.size + (frameNumber % self.slotsCount) * self.slotSize
+
+	def beginFrame(self):
+		# Claims the slot of the next frame and returns its pixels, as a writable memoryview of
+		# bytes, to be filled in place (e.g. by SDL_RenderReadPixels). Call endFrame() when done
+		frameNumber = self.frameNumber + 1
+		offset = self.slotOffset(frameNumber)
+		overwritten = frameNumber - self.slotsCount
+		consumed = U64.unpack_from(self.buffer, EXPORT_CONSUMED_OFFSET)[0]
+		if overwritten > 0 and consumed > 0 and overwritten > consumed:
+			# A reader is attached, but didn't get to this frame
+			self.droppedFrames = self.droppedFrames + 1
+			U64.pack_into(self.buffer, EXPORT_DROPPED_OFFSET, self.droppedFrames)
+		U64.pack_into(self.buffer, offset, 2 * frameNumber - 1)	# Odd: being written
+		pixelsOffset = offset + SLOT_HEADER.size
+		return self.buffer[pixelsOffset:pixelsOffset + self.pixelsSize]
+
+	def endFrame(self, camera, depth=None, hitTiles=None):
+		# Completes the frame started by beginFrame(). depth and hitTiles are sequences of one
+		# value per column, written only if the exporter was created withColumns
+		frameNumber = self.frameNumber + 1
+		offset = self.slotOffset(frameNumber)
+		if self.withColumns and depth is not None:
+			columnsOffset = offset + SLOT_HEADER.size + self.pixelsSize
+			struct.pack_into("<{}d".format(self.columns), self.buffer, columnsOffset, *depth)
+			self.buffer[columnsOffset + self.columns * 8:columnsOffset + self.columns * 9] = bytes(hitTiles)
+		SLOT_HEADER.pack_into(self.buffer, offset, 2 * frameNumber - 1, frameNumber, time.time(), camera.x, camera.y, camera.r)
+		U64.pack_into(self.buffer, offset, 2 * frameNumber)	# Even: complete
+		U64.pack_into(self.buffer, EXPORT_LATEST_OFFSET, frameNumber)
+		self.frameNumber = frameNumber
+
+	def publish(self, camera, frame, depth=None, hitTiles=None):
+		# Publishes a packed framebuffer (e.g. SoftRenderer.renderFrame()), of width x height pixels
+		self.beginFrame()[:] = memoryview(frame).cast("B")
+		self.endFrame(camera, depth, hitTiles)
+
+	def close(self):
+		# Removes the block: attached readers keep their mapping until they close it
+		self.buffer = None
+		self.sharedMemory.close()
+		self.sharedMemory.unlink()
+
+class FrameReader:
+
+	def __init__(self, name):
+		self.sharedMemory = attachSharedMemory(name)
+		self.buffer = self.sharedMemory.buf
+		magic, version, flags, width, height, columns, slotsCount, latest, consumed, dropped = EXPORT_HEADER.unpack_from(self.buffer)
+		if magic != EXPORT_MAGIC:
+			raise ValueError("Shared memory {} is not a frame export".format(name))
+		if version != EXPORT_VERSION:
+			raise ValueError("Frame export {} has version {}, but should be {}".format(name, version, EXPORT_VERSION))
+		self.width = width
+		self.height = height
+		self.columns = columns
+		self.slotsCount = slotsCount
+		self.withColumns = bool(flags & EXPORT_FLAG_COLUMNS)
+		self.pixelsSize, self.columnsSize, self.slotSize = slotLayout(width, height, columns, self.withColumns)
+		self.lastFrame = latest	# Only frames published from now on are read
+		self.droppedFrames = 0	# Frames this reader missed
+
+	def latestFrame(self):
+		return U64.unpack_from(self.buffer, EXPORT_LATEST_OFFSET)[0]
+
+	def writerDroppedFrames(self):
+		return U64.unpack_from(self.buffer, EXPORT_DROPPED_OFFSET)[0]
+
+	def readNext(self):
+		# Returns the next unread frame, as (frameNumber, timestamp, (x, y, r), pixels, depth, hitTiles),
+		# or None if there is none yet. Frames already overwritten are skipped and counted as dropped.
+		# pixels, depth and hitTiles are memoryviews on the shared memory (depth and hitTiles are None
+		# without columns): they can be overwritten by the writer at any time, so check isIntact()
+		# after using them, or copy them first
+		while True:
+			latest = self.latestFrame()
+			if latest <= self.lastFrame:
+				return None
+			frameNumber = max(self.lastFrame + 1, latest - self.slotsCount + 2)	# Not the slot being written next
+			offset = EXPORT_HEADER.size + (frameNumber % self.slotsCount) * self.slotSize
+			sequence, slotFrame, timestamp, x, y, r = SLOT_HEADER.unpack_from(self.buffer, offset)
+			self.droppedFrames = self.droppedFrames + frameNumber - self.lastFrame - 1
+			self.lastFrame = frameNumber
+			if sequence != 2 * frameNumber or slotFrame != frameNumber:
+				# Overwritten (or being overwritten) while we looked: retry with newer frames
+				self.droppedFrames = self.droppedFrames + 1
+				continue
+			U64.pack_into(self.buffer, EXPORT_CONSUMED_OFFSET, frameNumber)
+
+			pixelsOffset = offset + SLOT_HEADER.size
+			pixels = self.buffer[pixelsOffset:pixelsOffset + self.pixelsSize]
+			depth = None
+			hitTiles = None
+			if self.withColumns:
+				columnsOffset = pixelsOffset + self.pixelsSize
+				depth = self.buffer[columnsOffset:columnsOffset + self.columns * 8].cast("d")
+				hitTiles = self.buffer[columnsOffset + self.columns * 8:columnsOffset + self.columns * 9]
+			return frameNumber, timestamp, (x, y, r), pixels, depth, hitTiles
+
+	def isIntact(self, frameNumber):
+		# True if the frame wasn't overwritten since readNext() returned it
+		offset = EXPORT_HEADER.size + (frameNumber % self.slotsCount) * self.slotSize
+		return U64.unpack_from(self.buffer, offset)[0] == 2 * frameNumber
+
+	def close(self):
+		self.buffer = None
+		self.sharedMemory.close()
+
+def main():
+	parser = argparse.ArgumentParser(description="Example frame export reader: prints the frame rate and the dropped frames")
+	parser.add_argument("name", help="shared memory name (raycaster.py --export NAME)")
+	parser.add_argument("--delay", type=float, default=0.0, help="seconds spent on every frame, to simulate a slow reader")
+	args = parser.parse_args()
+
+	reader = FrameReader(args.name)
+	print("{}: {}x{} pixels, {} slots{}".format(args.name, reader.width, reader.height, reader.slotsCount, ", with depth and hit tiles of {} columns".format(reader.columns) if reader.withColumns else ""))
+	frames = 0
+	torn = 0
+	lastPrintTime = time.time()
+	try:
+		while True:
+			frame = reader.readNext()
+			if frame is None:
+				time.sleep(0.001)
+			else:
+				time.sleep(args.delay)
+				if not reader.isIntact(frame[0]):
+					torn = torn + 1
+				frames = frames + 1
+			if time.time() - lastPrintTime > 1:
+				print("{} FPS, frame {}, dropped by this reader {}, overwritten unread {}, overwritten while reading {}".format(
+					int(frames / (time.time() - lastPrintTime)), reader.lastFrame, reader.droppedFrames, reader.writerDroppedFrames(), torn))
+				frames = 0
+				lastPrintTime = time.time()
+	finally:
+		reader.close()
+	return 0
+
+if __name__ == '__main__':
+	try:
+		sys.exit(main())
+	except KeyboardInterrupt:
+		exit(0)
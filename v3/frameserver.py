@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+# PYTHON RAYCASTER
+# Inspired by https://www.youtube.com/watch?v=gYRrGTC7GtA
+# Copyright (C) 2023 Daniele Verducci
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# FRAME SERVER
+# Renders views of a single shared world (map, doors, textures) for many clients
+# (spectators, bots, test harnesses) connected over a local TCP or Unix socket:
+#   ./frameserver.py --tcp 127.0.0.1:5000
+#   ./frameserver.py --unix /tmp/raycaster.sock
+#
+# Requests are text lines:
+#   POSE x y r          set the view pose (x, y in map cells, r in radiants) and request a frame
+#   INPUT keys          apply one tick of input and request a frame. keys is any combination of
+#                       u, d, l, r (arrows) and s (space: open door), or "-" for no keys
+#   ENCODING raw|zlib   select the frames encoding (default: zlib)
+#   QUIT                close the connection
+# Responses are binary: a FRAME_HEADER followed by the payload. For frames the payload is
+# an RGB24 image, zlib-compressed if requested; for errors it is an utf-8 message.
+#
+# Requests are collected and served once per tick: inputs are applied first (so a door opened
+# by a client is seen by every view of the same tick), then every requested view is rendered.
+# Clients sharing the same pose in a tick share the same rendered frame.
+
+import sys
+import math
+import zlib
+import socket
+import struct
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from raycaster import Player, TileMap, MAP_SCALE, MAP_DOOR_CELL_TYPE
+from doors import DoorRegistry
+from softrender import SoftRenderer, loadTextures, toRGB
+from level import loadLevel
+
+SERVER_TICK_RATE = 30	# Ticks per second
+SERVER_DEFAULT_TCP_ADDRESS = "127.0.0.1:5000"
+FRAME_HEADER = struct.Struct("<4sIHHBI")	# magic, tick, width, height, encoding, payload length
+FRAME_MAGIC = b"RCFR"
+ERROR_MAGIC = b"RCER"
+ENCODINGS = {"raw": 0, "zlib": 1}
+INPUT_KEYS = "udlrs"
+
+class Session:
+
+	def __init__(self, writer):
+		self.writer = writer
+		self.player = Player.spawn()
+		self.encoding = "zlib"
+		self.inputs = []	# Input ticks received since the last served tick
+		self.frameRequested = False
+
+class FrameServer:
+
+	def __init__(self, tileMap=None, tickRate=SERVER_TICK_RATE):
+		# The world is shared by all the sessions: a door opened by a client is open for everyone
+		self.tileMap = tileMap.copy() if tileMap is not None else TileMap()
+		self.doors = DoorRegistry(self.tileMap.cells, self.tileMap.size, MAP_DOOR_CELL_TYPE)
+		self.tickRate = tickRate
+		self.renderer = SoftRenderer(loadTextures(), self.tileMap, doors=self.doors)
+		self.sessions = set()
+		self.tick = 0
+		# Rendering runs out of the event loop, so clients can still be served while casting
+		self.renderExecutor = ThreadPoolExecutor(max_workers=1)
+
+	async def handleClient(self, reader, writer):
+		session = Session(writer)
+		self.sessions.add(session)
+		try:
+			while True:
+				line = await reader.readline()
+				if not line:
+					break
+				request = line.decode("utf-8", "replace").split()
+				if not request:
+					continue
+				command = request[0].upper()
+				if command == "QUIT":
+					break
+				try:
+					self.handleRequest(session, command, request[1:])
+				except ValueError as e:
+					writer.write(self.encodeError(str(e)))
+					await writer.drain()
+		except ConnectionError:
+			pass
+		finally:
+			self.sessions.discard(session)
+			writer.close()
+
+	def handleRequest(self, session, command, args):
+		if command == "POSE":
+			if len(args) != 3:
+				raise ValueError("POSE needs 3 values: x y r")
+			x, y, r = (float(value) for value in args)
+			if not all(math.isfinite(value) for value in (x, y, r)):
+				raise ValueError("POSE values must be finite numbers")
+			session.player.x = x * MAP_SCALE
+			session.player.y = y * MAP_SCALE
+			session.player.r = r % (2 * math.pi)
+			session.frameRequested = True
+		elif command == "INPUT":
+			keys = args[0].lower() if args else "-"
+			if keys != "-" and any(key not in INPUT_KEYS for key in keys):
+				raise ValueError("INPUT keys must be a combination of \"{}\", or \"-\"".format(INPUT_KEYS))
+			session.inputs.append(keys)
+			session.frameRequested = True
+		elif command == "ENCODING":
+			if len(args) != 1 or args[0].lower() not in ENCODINGS:
+				raise ValueError("ENCODING must be one of {}".format(", ".join(ENCODINGS)))
+			session.encoding = args[0].lower()
+		else:
+			raise ValueError("Unknown command {}".format(command))
+
+	def applyInput(self, session, keys):
+		session.player.step(self.tileMap, "u" in keys, "d" in keys, "l" in keys, "r" in keys, self.doors)
+		if "s" in keys:
+			session.player.openDoor(self.tileMap, self.doors)
+
+	def renderTick(self, tick, views):
+		# Renders and encodes the (camera, encoding) views requested in this tick. A view failing
+		# to render gets the exception instead of its frame
+		renderedFrames = {}
+		encodedFrames = []
+		for camera, encoding in views:
+			pose = (camera.x, camera.y, camera.r)
+			rgb = renderedFrames.get(pose)
+			if rgb is None:
+				try:
+					rgb = toRGB(self.renderer.renderFrame(camera))
+				except Exception as e:
+					encodedFrames.append(e)
+					continue
+				renderedFrames[pose] = rgb
+			if encoding == "zlib":
+				rgb = zlib.compress(rgb, 1)
+			header = FRAME_HEADER.pack(FRAME_MAGIC, tick, self.renderer.width, self.renderer.height, ENCODINGS[encoding], len(rgb))
+			encodedFrames.append(header + rgb)
+		return encodedFrames
+
+	def encodeError(self, message):
+		payload = message.encode("utf-8")
+		return FRAME_HEADER.pack(ERROR_MAGIC, self.tick, 0, 0, 0, len(payload)) + payload
+
+	def dropSession(self, session, error):
+		# A session broke the tick (e.g. with a pose out of the map): it is closed, the others go on
+		print("Dropping a client: {}".format(error), file=sys.stderr)
+		self.sessions.discard(session)
+		session.writer.write(self.encodeError("Session closed: {}".format(error)))
+		session.writer.close()
+
+	async def serveTick(self, tickDuration):
+		# Doors move for everyone, and don't close on anybody
+		occupiedCells = set()
+		for session in list(self.sessions):
+			try:
+				occupiedCells.update(self.tileMap.cellsUnderBox(session.player.x, session.player.y, session.player.radius))
+			except Exception as e:
+				self.dropSession(session, e)
+		self.doors.update(tickDuration, occupiedCells)
+
+		pending = []
+		for session in [session for session in self.sessions if session.frameRequested]:
+			# Inputs first: they may change the shared world
+			try:
+				for keys in session.inputs:
+					self.applyInput(session, keys)
+			except Exception as e:
+				self.dropSession(session, e)
+				continue
+			session.inputs.clear()
+			session.frameRequested = False
+			pending.append(session)
+		if pending:
+			views = [(session.player.copy(), session.encoding) for session in pending]
+			frames = await asyncio.get_running_loop().run_in_executor(self.renderExecutor, self.renderTick, self.tick, views)
+			for session, frame in zip(pending, frames):
+				if isinstance(frame, Exception):
+					self.dropSession(session, frame)
+				else:
+					session.writer.write(frame)
+			await asyncio.gather(*(session.writer.drain() for session in pending), return_exceptions=True)
+		self.tick = self.tick + 1
+
+	async def runTicks(self):
+		loop = asyncio.get_running_loop()
+		tickDuration = 1 / self.tickRate
+		nextTickTime = loop.time()
+		while True:
+			await self.serveTick(tickDuration)
+			nextTickTime = max(nextTickTime + tickDuration, loop.time())	# Don't try to catch up if late
+			await asyncio.sleep(nextTickTime - loop.time())
+
+	async def serve(self, tcpAddress=None, unixPath=None):
+		if unixPath:
+			server = await asyncio.start_unix_server(self.handleClient, path=unixPath)
+		else:
+			host, port = tcpAddress.rsplit(":", 1)
+			server = await asyncio.start_server(self.handleClient, host, int(port))
+		print("Frame server listening on {}".format(unixPath or tcpAddress))
+		async with server:
+			await asyncio.gather(server.serve_forever(), self.runTicks())
+
+class FrameClient:
+	# Minimal blocking client, for bots and test harnesses
+
+	def __init__(self, tcpAddress=None, unixPath=None):
+		if unixPath:
+			self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			self.socket.connect(unixPath)
+		else:
+			host, port = (tcpAddress or SERVER_DEFAULT_TCP_ADDRESS).rsplit(":", 1)
+			self.socket = socket.create_connection((host, int(port)))
+		self.stream = self.socket.makefile("rwb")
+
+	def send(self, request):
+		self.stream.write((request + "\n").encode("utf-8"))
+		self.stream.flush()
+
+	def readFrame(self):
+		# Returns (tick, width, height, rgb)
+		magic, tick, width, height, encoding, length = FRAME_HEADER.unpack(self.stream.read(FRAME_HEADER.size))
+		payload = self.stream.read(length)
+		if magic == ERROR_MAGIC:
+			raise ValueError(payload.decode("utf-8"))
+		if encoding == ENCODINGS["zlib"]:
+			payload = zlib.decompress(payload)
+		return tick, width, height, payload
+
+	def requestPose(self, x, y, r):
+		self.send("POSE {} {} {}".format(x, y, r))
+		return self.readFrame()
+
+	def requestInput(self, keys):
+		self.send("INPUT {}".format(keys or "-"))
+		return self.readFrame()
+
+	def close(self):
+		self.send("QUIT")
+		self.stream.close()
+		self.socket.close()
+
+def main():
+	parser = argparse.ArgumentParser(description="Renders views of a shared world for many clients over a local socket")
+	address = parser.add_mutually_exclusive_group()
+	address.add_argument("--tcp", default=SERVER_DEFAULT_TCP_ADDRESS, help="listen on HOST:PORT (default: {})".format(SERVER_DEFAULT_TCP_ADDRESS))
+	address.add_argument("--unix", help="listen on this Unix socket path")
+	parser.add_argument("-l", "--level", help="level file (default: the built-in map)")
+	parser.add_argument("--tick-rate", type=int, default=SERVER_TICK_RATE, help="ticks per second (default: {})".format(SERVER_TICK_RATE))
+	args = parser.parse_args()
+
+	if args.level:
+		tileMap = loadLevel(args.level)
+	else:
+		tileMap = TileMap()
+	server = FrameServer(tileMap, args.tick_rate)
+	asyncio.run(server.serve(args.tcp, args.unix))
+	return 0
+
+if __name__ == '__main__':
+	try:
+		sys.exit(main())
+	except KeyboardInterrupt:
+		exit(0)
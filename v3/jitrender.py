@@ -0,0 +1,309 @@
+# PYTHON RAYCASTER
+# Inspired by https://www.youtube.com/watch?v=gYRrGTC7GtA
+# Copyright (C) 2023 Daniele Verducci
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# JIT compiled renderer
+# The same rendering as SoftRenderer, but the whole frame (the castRay() traversal of every
+# column and the texture column walk) is a single kernel compiled by Numba to machine code,
+# over NumPy arrays holding the map, the doors, the textures and the framebuffer.
+# Rays are cast for every column: casting is cheap enough here that span casting (see
+# TileMap.castColumns()) isn't needed.
+# Compiled kernels are cached on disk (in __pycache__, or in NUMBA_CACHE_DIR), so only the
+# first launch pays the compilation.
+#
+# Optional, requires Numba:
+# pip install numba
+# Without it, JIT_AVAILABLE is False and createRenderer() returns a SoftRenderer.
+
+import math
+from raycaster import Camera, TileMap, MAP_SCALE, TEXTURE_SIZE, LIGHTMAP_SIZE, RAYCAST_RENDER_WIDTH, RAYCAST_RENDER_HEIGHT, CEILING_COLOR, FLOOR_COLOR
+from palette import IndexedTextureStore, packColor
+
+try:
+	import numba
+	import numpy as np
+	JIT_AVAILABLE = True
+except ImportError:
+	JIT_AVAILABLE = False
+
+JIT_NO_DOOR = -1.0	# Open fraction of the cells without a door
+JIT_NO_LIGHTMAP = 255	# Light level of the faces without lightmap
+
+def castRayKernel(cells, mapSize, mapScale, textureSize, doorFractions, doorVertical, playerX, playerY, rayAngle, dofMax):
+	# TileMap.castRay(), with doors as arrays: doorFractions is the open fraction of the door in
+	# every cell (JIT_NO_DOOR if none), doorVertical is 1 for vertical doors
+	cellsCount = mapSize * mapSize
+	mapBlockHitX = 0
+	mapBlockHitY = 0
+	texShiftX = 0.0
+	texShiftY = 0.0
+	xOffset = 0.0
+	yOffset = 0.0
+
+	# Check horizontal lines
+	dof = 0
+	if rayAngle == 0 or rayAngle == math.pi:
+		rayY = playerY
+		rayX = playerX + dofMax * mapScale
+		dof = dofMax
+	elif rayAngle > math.pi:
+		aTan = -1 / math.tan(rayAngle)
+		rayY = (int(playerY / mapScale) * mapScale) - 0.00001
+		rayX = (playerY - rayY) * aTan + playerX
+		yOffset = -mapScale
+		xOffset = -yOffset * aTan
+	else:
+		aTan = -1 / math.tan(rayAngle)
+		rayY = (int(playerY / mapScale) * mapScale) + mapScale
+		rayX = (playerY - rayY) * aTan + playerX
+		yOffset = mapScale
+		xOffset = -yOffset * aTan
+
+	while dof < dofMax:
+		mapX = int(rayX / mapScale)
+		mapY = int(rayY / mapScale)
+		mapArrayPosition = mapY * mapSize + mapX
+		if mapArrayPosition >= 0 and mapArrayPosition < cellsCount and cells[mapArrayPosition] != 0:
+			doorFraction = doorFractions[mapArrayPosition]
+			if doorFraction == JIT_NO_DOOR:
+				dof = dofMax
+				mapBlockHitY = cells[mapArrayPosition]
+				continue
+			if doorVertical[mapArrayPosition] == 0:
+				doorX = rayX + xOffset / 2
+				doorShift = doorFraction * mapScale
+				if int(doorX / mapScale) == mapX and doorX % mapScale >= doorShift:
+					rayX = doorX
+					rayY = rayY + yOffset / 2
+					texShiftY = doorShift
+					dof = dofMax
+					mapBlockHitY = cells[mapArrayPosition]
+					continue
+		rayX = rayX + xOffset
+		rayY = rayY + yOffset
+		dof = dof + 1
+
+	horizRayX = rayX
+	horizRayY = rayY
+
+	# Check vertical lines
+	dof = 0
+	nTan = -math.tan(rayAngle)
+	xOffset = 0.0
+	yOffset = 0.0
+	if rayAngle == math.pi * 0.5 or rayAngle == math.pi * 1.5:
+		rayX = playerX
+		rayY = playerY + dofMax * mapScale
+		dof = dofMax
+	elif rayAngle > math.pi * 0.5 and rayAngle < math.pi * 1.5:
+		rayX = (int(playerX / mapScale) * mapScale) - 0.00001
+		rayY = (playerX - rayX) * nTan + playerY
+		xOffset = -mapScale
+		yOffset = -xOffset * nTan
+	else:
+		rayX = (int(playerX / mapScale) * mapScale) + mapScale
+		rayY = (playerX - rayX) * nTan + playerY
+		xOffset = mapScale
+		yOffset = -xOffset * nTan
+
+	while dof < dofMax:
+		mapX = int(rayX / mapScale)
+		mapY = int(rayY / mapScale)
+		mapArrayPosition = mapY * mapSize + mapX
+		if mapArrayPosition >= 0 and mapArrayPosition < cellsCount - 1 and cells[mapArrayPosition] != 0:
+			doorFraction = doorFractions[mapArrayPosition]
+			if doorFraction == JIT_NO_DOOR:
+				dof = dofMax
+				mapBlockHitX = cells[mapArrayPosition]
+				continue
+			if doorVertical[mapArrayPosition] != 0:
+				doorY = rayY + yOffset / 2
+				doorShift = doorFraction * mapScale
+				if int(doorY / mapScale) == mapY and doorY % mapScale >= doorShift:
+					rayX = rayX + xOffset / 2
+					rayY = doorY
+					texShiftX = doorShift
+					dof = dofMax
+					mapBlockHitX = cells[mapArrayPosition]
+					continue
+		rayX = rayX + xOffset
+		rayY = rayY + yOffset
+		dof = dof + 1
+
+	horizDist = math.sqrt((horizRayX-playerX)*(horizRayX-playerX) + (horizRayY-playerY)*(horizRayY-playerY))
+	vertDist = math.sqrt((rayX-playerX)*(rayX-playerX) + (rayY-playerY)*(rayY-playerY))
+	if vertDist > horizDist:
+		texColumn = int((horizRayX - texShiftY) / (mapScale / textureSize) % textureSize)
+		return horizDist, horizRayX, horizRayY, mapBlockHitY, texColumn, True
+	texColumn = int((rayY - texShiftX) / (mapScale / textureSize) % textureSize)
+	return vertDist, rayX, rayY, mapBlockHitX, texColumn, False
+
+def renderKernel(cells, mapSize, mapScale, textureSize, doorFractions, doorVertical, texels, shadedTexels, texturesCount,
+		faceLevels, litTexels, ambientLevel, background, frame, depth, hitXs, hitYs, hitTiles, width, height, playerX, playerY, playerAngle, dofMax):
+	# Renders a frame like SoftRenderer.renderFrame(). If faceLevels has rows (one per map cell
+	# side, see lighting.py), walls are lit with litTexels (one row per light level) instead of shaded
+	frame[:] = background
+	lit = faceLevels.shape[0] > 0
+	lightmapSize = faceLevels.shape[1]
+	cellsCount = mapSize * mapSize
+	lastTexRow = textureSize - 1
+	for i in range(width):
+		rayAngle = playerAngle + (i / width) - 0.5
+		if rayAngle < 0:
+			rayAngle = math.pi * 2 + rayAngle
+		if rayAngle > math.pi * 2:
+			rayAngle = rayAngle - math.pi * 2
+		shortestDist, hitX, hitY, hitTile, texColumn, shading = castRayKernel(cells, mapSize, mapScale, textureSize, doorFractions, doorVertical, playerX, playerY, rayAngle, dofMax)
+		if hitTile == 0 and dofMax < 2 * mapSize:
+			# Like TileMap.castRay(): no wall within the sampled maxDof, cast again without limit
+			shortestDist, hitX, hitY, hitTile, texColumn, shading = castRayKernel(cells, mapSize, mapScale, textureSize, doorFractions, doorVertical, playerX, playerY, rayAngle, 2 * mapSize)
+		depth[i] = shortestDist
+		hitXs[i] = hitX
+		hitYs[i] = hitY
+		hitTiles[i] = hitTile
+		texBase = ((hitTile - 1) % texturesCount) * textureSize * textureSize + texColumn
+
+		# LightMaps.level()
+		level = -1
+		if lit:
+			level = ambientLevel
+			mapArrayPosition = int(hitY / mapScale) * mapSize + int(hitX / mapScale)
+			if mapArrayPosition >= 0 and mapArrayPosition < cellsCount:
+				if shading:
+					side = 0 if playerY < hitY else 1
+				else:
+					side = 2 if playerX < hitX else 3
+				faceLevel = faceLevels[mapArrayPosition * 4 + side, texColumn * lightmapSize // textureSize]
+				if faceLevel != JIT_NO_LIGHTMAP:
+					level = faceLevel
+
+		# SoftRenderer.drawColumn()
+		lineHeight = mapScale * height / shortestDist
+		lineOffset = height / 2 - lineHeight / 2
+		lineStart = max(0, int(lineOffset))
+		lineEnd = min(height, int(lineOffset + lineHeight))
+		texStep = textureSize / lineHeight
+		pixelIndex = lineStart * width + i
+		for y in range(lineStart, lineEnd):
+			texRow = int((y - lineOffset) * texStep)
+			if texRow > lastTexRow:
+				texRow = lastTexRow
+			elif texRow < 0:
+				texRow = 0	# The first row starts above the wall (lineStart is rounded down)
+			if level >= 0:
+				frame[pixelIndex] = litTexels[level, texBase + texRow * textureSize]
+			elif shading:
+				frame[pixelIndex] = shadedTexels[texBase + texRow * textureSize]
+			else:
+				frame[pixelIndex] = texels[texBase + texRow * textureSize]
+			pixelIndex = pixelIndex + width
+
+if JIT_AVAILABLE:
+	castRayKernel = numba.njit(cache=True)(castRayKernel)
+	renderKernel = numba.njit(cache=True)(renderKernel)
+
+class JitRenderer:
+	# Drop-in replacement of SoftRenderer (32 bit textures only): renderFrame() returns a NumPy
+	# uint32 framebuffer, and the depth, hit point and hit tile of every column are kept as arrays
+
+	def __init__(self, textures, tileMap=None, width=RAYCAST_RENDER_WIDTH, height=RAYCAST_RENDER_HEIGHT, doors=None, pvs=None, lightMaps=None):
+		# Same arguments as SoftRenderer (spanColumns excluded)
+		if not JIT_AVAILABLE:
+			raise ImportError("The JIT renderer requires Numba (pip install numba)")
+		if isinstance(textures, IndexedTextureStore):
+			raise ValueError("The JIT renderer can't use indexed textures")
+		self.tileMap = tileMap if tileMap is not None else TileMap()
+		self.doors = doors
+		self.pvs = pvs
+		self.lightMaps = lightMaps
+		self.width = width
+		self.height = height
+		self.palette = None
+
+		mapCellsCount = self.tileMap.size * self.tileMap.size
+		self.cells = np.frombuffer(self.tileMap.cells, dtype=np.uint8).copy()
+		self.mapVersion = self.tileMap.version
+		self.doorFractions = np.full(mapCellsCount, JIT_NO_DOOR)
+		self.doorVertical = np.zeros(mapCellsCount, dtype=np.uint8)
+		if doors is not None:
+			for mapArrayPosition, door in doors.doors.items():
+				self.doorFractions[mapArrayPosition] = door.openFraction
+				self.doorVertical[mapArrayPosition] = door.vertical
+		self.doorsVersion = doors.version if doors is not None else 0
+
+		self.texturesCount = textures.count
+		self.texels = np.frombuffer(textures.texels, dtype=np.uint32).copy()
+		self.shadedTexels = np.frombuffer(textures.shadedTexels, dtype=np.uint32).copy()
+		if lightMaps is not None:
+			from lighting import litTexels
+			self.litTexels = np.array([np.frombuffer(texels, dtype=np.uint32) for texels in litTexels(textures, lightMaps.levels)])
+			self.faceLevels = np.full((mapCellsCount * 4, LIGHTMAP_SIZE), JIT_NO_LIGHTMAP, dtype=np.uint8)
+			self.bakedFaces = None
+		else:
+			self.litTexels = np.zeros((0, 0), dtype=np.uint32)
+			self.faceLevels = np.zeros((0, LIGHTMAP_SIZE), dtype=np.uint8)
+
+		ceilingPixels = width * (height // 2)
+		self.background = np.full(width * height, packColor(FLOOR_COLOR), dtype=np.uint32)
+		self.background[:ceilingPixels] = packColor(CEILING_COLOR)
+		self.frame = self.background.copy()
+		self.depth = np.zeros(width)
+		self.hitXs = np.zeros(width)
+		self.hitYs = np.zeros(width)
+		self.hitTiles = np.zeros(width, dtype=np.uint8)
+
+		# Loads the kernel from the cache (or compiles it) now, instead of in the first frame
+		self.renderFrame(Camera(MAP_SCALE / 2, MAP_SCALE / 2, 0.0))
+
+	def syncState(self):
+		# Copies map, door and lightmap changes into the kernel arrays
+		if self.tileMap.version != self.mapVersion:
+			self.cells[:] = np.frombuffer(self.tileMap.cells, dtype=np.uint8)
+			self.mapVersion = self.tileMap.version
+		if self.doors is not None and self.doors.version != self.doorsVersion:
+			for mapArrayPosition in self.doors.changedCells(self.doorsVersion):
+				self.doorFractions[mapArrayPosition] = self.doors.get(mapArrayPosition).openFraction
+			self.doorsVersion = self.doors.version
+		lightMaps = self.lightMaps
+		if lightMaps is not None:
+			lightMaps.update()
+			if lightMaps.bakedFaces != self.bakedFaces:
+				self.faceLevels[:] = JIT_NO_LIGHTMAP
+				for (mapArrayPosition, side), lightmap in lightMaps.faces.items():
+					self.faceLevels[mapArrayPosition * 4 + side] = np.frombuffer(lightmap, dtype=np.uint8)
+				self.bakedFaces = lightMaps.bakedFaces
+
+	def renderFrame(self, camera):
+		# Renders the view from camera (a Camera or Player) and returns the framebuffer.
+		# The returned array is reused by the next call.
+		self.syncState()
+		tileMap = self.tileMap
+		maxDof = 2 * tileMap.size
+		if self.pvs is not None:
+			maxDof = self.pvs.maxDof(camera.mapArrayPosition(tileMap.size))
+		ambientLevel = self.lightMaps.ambientLevel if self.lightMaps is not None else 0
+		renderKernel(self.cells, tileMap.size, MAP_SCALE, TEXTURE_SIZE, self.doorFractions, self.doorVertical, self.texels, self.shadedTexels, self.texturesCount,
+			self.faceLevels, self.litTexels, ambientLevel, self.background, self.frame, self.depth, self.hitXs, self.hitYs, self.hitTiles,
+			self.width, self.height, float(camera.x), float(camera.y), float(camera.r), maxDof)
+		return self.frame
+
+def createRenderer(textures, tileMap=None, width=RAYCAST_RENDER_WIDTH, height=RAYCAST_RENDER_HEIGHT, doors=None, pvs=None, lightMaps=None, jit=True):
+	# A JitRenderer if Numba is installed (and jit is True) and the textures are not indexed,
+	# otherwise a SoftRenderer
+	if jit and JIT_AVAILABLE and not isinstance(textures, IndexedTextureStore):
+		return JitRenderer(textures, tileMap, width, height, doors, pvs, lightMaps)
+	from softrender import SoftRenderer
+	return SoftRenderer(textures, tileMap, width, height, doors, pvs, lightMaps=lightMaps)
@@ -0,0 +1,175 @@
+# PYTHON RAYCASTER
+# Inspired by https://www.youtube.com/watch?v=gYRrGTC7GtA
+# Copyright (C) 2023 Daniele Verducci
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Input latency
+# Measures how old the input shown by a frame is when the frame reaches the screen:
+#   ./raycaster.py --latency [FILE]              while playing
+#   ./raycaster.py --latency-probe 100           with synthetic input, exits after 100 presses
+# Every frame, the time the keyboard is sampled is carried through the frame stages (tick,
+# rays, present): the report gives the distribution of the time from the sample to the end
+# of every stage. Present ends when SDL_RenderPresent() returns, so with vsync it includes
+# the wait for the display. Key presses are also measured from their SDL event, which tells
+# how long they waited for the next sample (with millisecond resolution).
+# The probe (LatencyProbe) doesn't trust the pose: it presses the rotate key at a random
+# moment, and looks for the first presented frame that differs from the one before the
+# press, reading it back from the render target. The time from the press to that frame is
+# the latency a player would see, whatever the frames pipeline in between. The probe only
+# rotates the player, so doors don't move by themselves while probing.
+# Reading back waits for the GPU to finish the frame, so frames are read back only around a
+# press: the frame before it, and the following ones until one changes, at most
+# LATENCY_PROBE_MAX_FRAMES. Those waits still slow down the frames right after a press, and
+# drain any frame the driver would queue: the probe can't see latency added by queued frames.
+# The report gives how many frames were read back and how long it took.
+# Playing on a server (--connect), the sample is sent and the pose comes back later: only
+# the probe sees that round trip.
+# With a file name, the latencies of every frame are also written as CSV.
+
+import csv
+import time
+import random
+import sdl2
+from replay import percentile
+
+LATENCY_STAGES = ("tick", "rays", "present")
+LATENCY_PROBE_IDLE_FRAMES = (5, 15)	# Frames the probe waits between presses (random in this range)
+LATENCY_PROBE_TIMEOUT = 1.0	# Seconds after which a press with no visible change is counted as missed
+LATENCY_PROBE_MAX_FRAMES = 30	# Frames read back after a press, before counting it as missed
+
+class LatencyTracker:
+
+	def __init__(self, csvFilePath=None):
+		self.csvFilePath = csvFilePath
+		self.latencies = dict((stage, []) for stage in LATENCY_STAGES)	# Stage -> seconds from the input sample, every frame
+		self.eventLatencies = []	# Seconds from key press event to present
+		self.rows = []
+		self.sampleTime = None
+		self.stageTimes = {}
+		self.keyEventTimestamps = []
+
+	def inputSampled(self, events):
+		# The keyboard has just been sampled, after handling these SDL events
+		self.sampleTime = time.perf_counter()
+		self.stageTimes = {}
+		self.keyEventTimestamps = [event.key.timestamp for event in events if event.type == sdl2.SDL_KEYDOWN and not event.key.repeat]
+
+	def stageDone(self, stage):
+		# A stage of the frame, one of LATENCY_STAGES, is done
+		if self.sampleTime is not None:
+			self.stageTimes[stage] = time.perf_counter() - self.sampleTime
+
+	def presented(self):
+		# The frame has been presented: records the latencies it carried
+		if self.sampleTime is None:
+			return
+		self.stageDone("present")
+		sdlTicks = sdl2.SDL_GetTicks()
+		for timestamp in self.keyEventTimestamps:
+			self.eventLatencies.append((sdlTicks - timestamp) / 1000)
+		for stage in LATENCY_STAGES:
+			if stage in self.stageTimes:
+				self.latencies[stage].append(self.stageTimes[stage])
+		self.rows.append([len(self.rows) + 1] + ["{:.3f}".format(1000 * self.stageTimes[stage]) if stage in self.stageTimes else "" for stage in LATENCY_STAGES])
+		self.sampleTime = None
+
+	def report(self, probe=None):
+		# Prints the latency distributions, and writes the CSV file if requested
+		print("Input latency over {} frames (ms):".format(len(self.rows)))
+		print("{:<24} {:>8} {:>8} {:>8} {:>8} {:>8}".format("", "mean", "median", "p95", "p99", "max"))
+		for stage in LATENCY_STAGES:
+			printDistribution("sample -> {}".format(stage), self.latencies[stage])
+		printDistribution("key event -> present", self.eventLatencies)
+		if probe is not None:
+			printDistribution("probe press -> visible", probe.latencies)
+			if probe.missed:
+				print("{} probe presses never became visible".format(probe.missed))
+			if probe.readbacks:
+				print("{} frames read back by the probe, {:.2f} ms each".format(probe.readbacks, 1000 * probe.readbackTime / probe.readbacks))
+
+		if self.csvFilePath:
+			with open(self.csvFilePath, "w", newline="") as csvFile:
+				writer = csv.writer(csvFile)
+				writer.writerow(["frame"] + ["{}_ms".format(stage) for stage in LATENCY_STAGES])
+				writer.writerows(self.rows)
+
+def printDistribution(name, values):
+	if not values:
+		return
+	sortedValues = sorted(values)
+	print("{:<24} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f}".format(name, 1000 * sum(values) / len(values),
+		1000 * percentile(sortedValues, 0.5), 1000 * percentile(sortedValues, 0.95), 1000 * percentile(sortedValues, 0.99), 1000 * sortedValues[-1]))
+
+class LatencyProbe:
+	# Synthetic input: presses a key at random moments, and waits for it to become visible
+
+	def __init__(self, presses, seed=0):
+		self.remaining = presses	# Presses still to do
+		self.rng = random.Random(seed)
+		self.idleFrames = self.rng.randint(*LATENCY_PROBE_IDLE_FRAMES)
+		self.pressTime = None	# When the key is (or will be) pressed
+		self.pressFrames = 0	# Frames presented since the press
+		self.baseFrameHash = None	# Last frame before the press
+		self.readbacks = 0
+		self.readbackTime = 0.0
+		self.lastPresentTime = None
+		self.frameInterval = 0.0
+		self.latencies = []
+		self.missed = 0
+
+	def keyDown(self):
+		# State of the probe key, sampled with the keyboard
+		return self.pressTime is not None and time.perf_counter() >= self.pressTime
+
+	def done(self):
+		return self.remaining <= 0
+
+	def framePresented(self, readFrameHash, now):
+		# A frame has been presented at time now (perf_counter()): checks whether it shows the
+		# press. readFrameHash() reads it back, only when needed
+		if self.lastPresentTime is not None:
+			self.frameInterval = now - self.lastPresentTime
+		self.lastPresentTime = now
+
+		if self.pressTime is None:
+			self.idleFrames = self.idleFrames - 1
+			if self.idleFrames <= 0 and not self.done():
+				# Pressed at any moment of the next frame, as a player would
+				self.pressTime = now + self.rng.uniform(0, self.frameInterval)
+				self.pressFrames = 0
+				self.baseFrameHash = self.readBack(readFrameHash)
+		elif now < self.pressTime:
+			# Not pressed yet
+			self.baseFrameHash = self.readBack(readFrameHash)
+		else:
+			self.pressFrames = self.pressFrames + 1
+			if self.readBack(readFrameHash) != self.baseFrameHash:
+				self.latencies.append(now - self.pressTime)
+				self.release()
+			elif self.pressFrames >= LATENCY_PROBE_MAX_FRAMES or now - self.pressTime > LATENCY_PROBE_TIMEOUT:
+				self.missed = self.missed + 1
+				self.release()
+
+	def readBack(self, readFrameHash):
+		start = time.perf_counter()
+		frameHash = readFrameHash()
+		self.readbacks = self.readbacks + 1
+		self.readbackTime = self.readbackTime + time.perf_counter() - start
+		return frameHash
+
+	def release(self):
+		self.pressTime = None
+		self.remaining = self.remaining - 1
+		self.idleFrames = self.rng.randint(*LATENCY_PROBE_IDLE_FRAMES)
@@ -0,0 +1,53 @@
+# PYTHON RAYCASTER
+# Inspired by https://www.youtube.com/watch?v=gYRrGTC7GtA
+# Copyright (C) 2023 Daniele Verducci
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Level files
+# A level is a plain text file with one map row per line. Cells are separated by commas
+# and/or spaces and use the same values as MAP in raycaster.py (0 is empty, n is the
+# wall with texture TEXTURES[n-1]). Lines starting with "#" are comments.
+# The map must be square, like the built-in one.
+
+from raycaster import TileMap
+
+def loadLevel(levelFilePath):
+	# Loads a level file into a TileMap
+	mapCells = []
+	rows = 0
+	with open(levelFilePath) as levelFile:
+		for line in levelFile:
+			line = line.strip()
+			if not line or line.startswith("#"):
+				continue
+			row = [int(cell) for cell in line.replace(",", " ").split()]
+			if rows > 0 and len(row) != len(mapCells) // rows:
+				raise ValueError("Level {}: row {} has {} cells, but previous rows have {}".format(levelFilePath, rows + 1, len(row), len(mapCells) // rows))
+			mapCells.extend(row)
+			rows = rows + 1
+
+	if rows == 0 or len(mapCells) != rows * rows:
+		raise ValueError("Level {} is not square: {} rows of {} cells".format(levelFilePath, rows, len(mapCells) // max(rows, 1)))
+	return TileMap(mapCells, rows)
+
+def saveLevel(levelFilePath, tileMap, comments=()):
+	# Writes a TileMap to a level file, in the format read by loadLevel(), after the given comment lines
+	mapSize = tileMap.size
+	with open(levelFilePath, "w") as levelFile:
+		for comment in comments:
+			levelFile.write("# {}\n".format(comment))
+		for y in range(mapSize):
+			row = tileMap.cells[y * mapSize:(y + 1) * mapSize]
+			levelFile.write(", ".join(str(cell) for cell in row) + "\n")
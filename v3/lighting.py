@@ -0,0 +1,250 @@
+# PYTHON RAYCASTER
+# Inspired by https://www.youtube.com/watch?v=gYRrGTC7GtA
+# Copyright (C) 2023 Daniele Verducci
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Baked lighting
+# Every wall face seen from an empty cell gets a small lightmap: LIGHTMAP_SIZE light levels
+# along the face, baked once from the LIGHTS (soft falloff, occluded by walls and closed
+# doors) plus an ambient light. While drawing, a column just looks up its light level, and
+# takes its texels from a copy of the textures lit at that level (see litTexels()).
+# Horizontal faces get half the ambient light, like the shading they had before.
+# Faces are identified by (map array position, side): when cells change (a door opens or
+# closes, or the map is modified) only the faces within the radius of the lights reaching
+# those cells are baked again.
+
+import math
+from array import array
+from raycaster import MAP_SCALE, MAP_DOOR_CELL_TYPE, TEXTURE_SIZE, LIGHTS, LIGHT_AMBIENT, LIGHT_LEVELS, LIGHTMAP_SIZE
+
+# Face sides, by the direction the face looks at
+FACE_NORTH = 0	# Horizontal face, looking towards negative y
+FACE_SOUTH = 1
+FACE_WEST = 2	# Vertical face, looking towards negative x
+FACE_EAST = 3
+FACE_NORMALS = ((0, -1), (0, 1), (-1, 0), (1, 0))
+FACE_EPSILON = 0.01	# Samples are taken this far in front of the face, in map pixels
+DOOR_LIGHT_FRACTION = 0.5	# Doors let light through when open at least this much
+
+def litTexels(textures, levels=LIGHT_LEVELS):
+	# Copies of the texels of a TextureStore lit at every light level, from black (level 0)
+	# to full brightness (levels - 1). Channels are scaled one byte at a time
+	raw = textures.texels.tobytes()
+	lit = []
+	for level in range(levels):
+		table = bytes(value * level // (levels - 1) for value in range(256))
+		lit.append(array('I', raw.translate(table)))
+	return lit
+
+class LightMaps:
+
+	def __init__(self, tileMap, lights=LIGHTS, doors=None, ambient=LIGHT_AMBIENT, levels=LIGHT_LEVELS):
+		# lights is a list of {"x", "y", "radius", "intensity"}, position and radius in map cells.
+		# doors is the DoorRegistry, if any
+		self.tileMap = tileMap
+		self.doors = doors
+		self.ambient = ambient
+		self.levels = levels
+		self.ambientLevel = int(ambient * (levels - 1) + 0.5)	# Level of the faces without lightmap
+		# (x, y, radius, intensity), in map pixels
+		self.lights = [(light["x"] * MAP_SCALE, light["y"] * MAP_SCALE, light["radius"] * MAP_SCALE, light["intensity"]) for light in lights]
+		# (map array position, side) -> bytes of LIGHTMAP_SIZE light levels
+		self.faces = {}
+		self.bakedFaces = 0	# Faces baked so far, initial bake included
+		# What the lightmaps were baked with, to find the changed cells
+		self.cells = array('B', tileMap.cells)
+		self.mapVersion = tileMap.version
+		self.doorsVersion = doors.version if doors is not None else 0
+		self.openDoors = self.findOpenDoors()
+
+		for mapArrayPosition in range(len(self.cells)):
+			for side in self.exposedSides(mapArrayPosition):
+				self.bakeFace(mapArrayPosition, side)
+
+	def findOpenDoors(self):
+		# Cells of the doors open enough to let light through
+		if self.doors is None:
+			return set()
+		return set(mapArrayPosition for mapArrayPosition, door in self.doors.doors.items() if self.isOpenDoor(door))
+
+	def isOpenDoor(self, door):
+		return door.openFraction >= DOOR_LIGHT_FRACTION
+
+	def isOpaque(self, mapArrayPosition):
+		cell = self.cells[mapArrayPosition]
+		return cell != 0 and not (cell == MAP_DOOR_CELL_TYPE and mapArrayPosition in self.openDoors)
+
+	def exposedSides(self, mapArrayPosition):
+		# Sides of a cell that can be seen: the wall ones next to an empty cell or a door
+		cells = self.cells
+		if cells[mapArrayPosition] == 0:
+			return ()
+		size = self.tileMap.size
+		mapY, mapX = divmod(mapArrayPosition, size)
+		sides = []
+		if mapY > 0 and cells[mapArrayPosition - size] in (0, MAP_DOOR_CELL_TYPE):
+			sides.append(FACE_NORTH)
+		if mapY < size - 1 and cells[mapArrayPosition + size] in (0, MAP_DOOR_CELL_TYPE):
+			sides.append(FACE_SOUTH)
+		if mapX > 0 and cells[mapArrayPosition - 1] in (0, MAP_DOOR_CELL_TYPE):
+			sides.append(FACE_WEST)
+		if mapX < size - 1 and cells[mapArrayPosition + 1] in (0, MAP_DOOR_CELL_TYPE):
+			sides.append(FACE_EAST)
+		return sides
+
+	def isLit(self, lightX, lightY, x, y):
+		# True if no opaque cell lies on the segment from the light to (x, y), in map pixels
+		# (the cells of both ends excluded). Walks the grid one cell at a time (DDA)
+		size = self.tileMap.size
+		mapX = int(lightX // MAP_SCALE)
+		mapY = int(lightY // MAP_SCALE)
+		endX = int(x // MAP_SCALE)
+		endY = int(y // MAP_SCALE)
+		dx = x - lightX
+		dy = y - lightY
+		stepX = 1 if dx > 0 else -1
+		stepY = 1 if dy > 0 else -1
+		# Position along the segment (0 to 1) of the next vertical and horizontal grid line
+		if dx != 0:
+			nextX = ((mapX + (1 if dx > 0 else 0)) * MAP_SCALE - lightX) / dx
+			deltaX = MAP_SCALE / abs(dx)
+		else:
+			nextX = deltaX = math.inf
+		if dy != 0:
+			nextY = ((mapY + (1 if dy > 0 else 0)) * MAP_SCALE - lightY) / dy
+			deltaY = MAP_SCALE / abs(dy)
+		else:
+			nextY = deltaY = math.inf
+
+		while True:
+			if mapX == endX and mapY == endY:
+				return True
+			if nextX < nextY:
+				if nextX >= 1:
+					return True
+				mapX = mapX + stepX
+				nextX = nextX + deltaX
+			else:
+				if nextY >= 1:
+					return True
+				mapY = mapY + stepY
+				nextY = nextY + deltaY
+			if mapX == endX and mapY == endY:
+				return True
+			if mapX < 0 or mapY < 0 or mapX >= size or mapY >= size or self.isOpaque(mapY * size + mapX):
+				return False
+
+	def bakeFace(self, mapArrayPosition, side):
+		mapY, mapX = divmod(mapArrayPosition, self.tileMap.size)
+		normalX, normalY = FACE_NORMALS[side]
+		# Where the face starts and the direction it runs along (like texture columns: x or y increasing)
+		if side == FACE_NORTH:
+			originX, originY, alongX, alongY = mapX * MAP_SCALE, mapY * MAP_SCALE - FACE_EPSILON, 1, 0
+		elif side == FACE_SOUTH:
+			originX, originY, alongX, alongY = mapX * MAP_SCALE, (mapY + 1) * MAP_SCALE + FACE_EPSILON, 1, 0
+		elif side == FACE_WEST:
+			originX, originY, alongX, alongY = mapX * MAP_SCALE - FACE_EPSILON, mapY * MAP_SCALE, 0, 1
+		else:
+			originX, originY, alongX, alongY = (mapX + 1) * MAP_SCALE + FACE_EPSILON, mapY * MAP_SCALE, 0, 1
+		ambient = self.ambient / 2 if normalY != 0 else self.ambient
+
+		lastLevel = self.levels - 1
+		lightmap = bytearray(LIGHTMAP_SIZE)
+		for sample in range(LIGHTMAP_SIZE):
+			along = (sample + 0.5) * MAP_SCALE / LIGHTMAP_SIZE
+			x = originX + alongX * along
+			y = originY + alongY * along
+			light = ambient
+			for lightX, lightY, radius, intensity in self.lights:
+				dx = lightX - x
+				dy = lightY - y
+				distSq = dx * dx + dy * dy
+				facing = dx * normalX + dy * normalY
+				if distSq >= radius * radius or facing <= 0 or not self.isLit(lightX, lightY, x, y):
+					continue
+				# Smooth falloff, reaching 0 at the radius, times the cosine of the incidence angle
+				falloff = 1 - distSq / (radius * radius)
+				light = light + intensity * falloff * falloff * facing / max(math.sqrt(distSq), 1)
+			lightmap[sample] = min(lastLevel, int(light * lastLevel + 0.5))
+		self.faces[(mapArrayPosition, side)] = bytes(lightmap)
+		self.bakedFaces = self.bakedFaces + 1
+
+	def update(self):
+		# Bakes again the faces affected by map or door changes since the last call.
+		# Returns the number of faces baked
+		changedCells = set()
+		if self.tileMap.version != self.mapVersion:
+			cells = self.tileMap.cells
+			changedCells.update(i for i in range(len(cells)) if cells[i] != self.cells[i])
+			self.cells = array('B', cells)
+			self.mapVersion = self.tileMap.version
+		if self.doors is not None and self.doors.version != self.doorsVersion:
+			# Doors move a little every tick: only crossing DOOR_LIGHT_FRACTION changes the light
+			for mapArrayPosition in self.doors.changedCells(self.doorsVersion):
+				if self.isOpenDoor(self.doors.get(mapArrayPosition)) != (mapArrayPosition in self.openDoors):
+					self.openDoors ^= {mapArrayPosition}
+					changedCells.add(mapArrayPosition)
+			self.doorsVersion = self.doors.version
+		if not changedCells:
+			return 0
+		return self.rebake(changedCells)
+
+	def rebake(self, changedCells):
+		size = self.tileMap.size
+		faces = set()
+		for mapArrayPosition in changedCells:
+			# The faces of the cell and of its neighbours may have appeared or disappeared
+			mapY, mapX = divmod(mapArrayPosition, size)
+			for neighbourX, neighbourY in ((mapX, mapY), (mapX - 1, mapY), (mapX + 1, mapY), (mapX, mapY - 1), (mapX, mapY + 1)):
+				if neighbourX < 0 or neighbourY < 0 or neighbourX >= size or neighbourY >= size:
+					continue
+				neighbour = neighbourY * size + neighbourX
+				for side in (FACE_NORTH, FACE_SOUTH, FACE_WEST, FACE_EAST):
+					self.faces.pop((neighbour, side), None)
+				faces.update((neighbour, side) for side in self.exposedSides(neighbour))
+
+			# Light passing through the cell may now reach (or not) all the faces around its lights
+			centerX = (mapX + 0.5) * MAP_SCALE
+			centerY = (mapY + 0.5) * MAP_SCALE
+			for lightX, lightY, radius, intensity in self.lights:
+				if math.hypot(centerX - lightX, centerY - lightY) <= radius + MAP_SCALE:
+					faces.update(self.facesNear(lightX, lightY, radius))
+
+		for mapArrayPosition, side in faces:
+			self.bakeFace(mapArrayPosition, side)
+		return len(faces)
+
+	def facesNear(self, lightX, lightY, radius):
+		# Faces of the cells (partially) within radius map pixels of (lightX, lightY)
+		size = self.tileMap.size
+		faces = []
+		for mapY in range(max(0, int((lightY - radius) // MAP_SCALE)), min(size, int((lightY + radius) // MAP_SCALE) + 1)):
+			for mapX in range(max(0, int((lightX - radius) // MAP_SCALE)), min(size, int((lightX + radius) // MAP_SCALE) + 1)):
+				mapArrayPosition = mapY * size + mapX
+				faces.extend((mapArrayPosition, side) for side in self.exposedSides(mapArrayPosition))
+		return faces
+
+	def level(self, hitX, hitY, texColumn, shading, cameraX, cameraY):
+		# Light level of a castRay() hit (hitX, hitY, texColumn, shading), seen from the camera
+		mapArrayPosition = int(hitY / MAP_SCALE) * self.tileMap.size + int(hitX / MAP_SCALE)
+		if shading:
+			side = FACE_NORTH if cameraY < hitY else FACE_SOUTH
+		else:
+			side = FACE_WEST if cameraX < hitX else FACE_EAST
+		lightmap = self.faces.get((mapArrayPosition, side))
+		if lightmap is None:
+			# Not an exposed face (e.g. the map border seen from outside)
+			return self.ambientLevel
+		return lightmap[texColumn * LIGHTMAP_SIZE // TEXTURE_SIZE]
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+
+# PYTHON RAYCASTER
+# Inspired by https://www.youtube.com/watch?v=gYRrGTC7GtA
+# Copyright (C) 2023 Daniele Verducci
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Navigation
+# Pathfinding for NPCs on the tile grid, with flow fields: instead of searching a path for
+# every NPC, a breadth first search from a goal cell gives every cell its distance (in steps)
+# from the goal and the next cell to step on to get there. Every NPC heading to the same goal
+# shares the same field, so steering is a single lookup per NPC per tick:
+#   navigation = NavigationCache(tileMap, doors)
+#   navigation.update()	# Once per tick, after the doors moved
+#   mapArrayPosition = navigation.nextCell(npcMapArrayPosition, goalMapArrayPosition)
+# Steps go to the 4 neighbouring cells. Cells are walkable with the rules of
+# TileMap.isSolidCell(): empty cells, and doors only when completely open.
+# Fields are kept in a cache of NAV_CACHE_SIZE goals, evicting the least recently used.
+# When cells change (a door opens or closes, or the map is modified) the cached fields are
+# repaired around the changed cells: an opened cell lowers the distances behind it, a closed
+# one raises only the distances of the cells whose every shortest path went through it.
+#
+# ./navigation.py --npcs 1000 --goals 8 measures it, with NPCs walking between random goals
+# while doors open and close.
+
+import sys
+import time
+import random
+import argparse
+from array import array
+from collections import OrderedDict, deque
+from raycaster import TileMap, MAP_SCALE, MAP_DOOR_CELL_TYPE
+from doors import DoorRegistry, DOOR_OPEN
+from level import loadLevel
+
+NAV_CACHE_SIZE = 64	# Flow fields kept in the cache
+NAV_REPAIR_LIMIT = 32	# With more changed cells than this in a tick, fields are dropped instead of repaired
+NAV_UNREACHABLE = 0xFFFFFFFF	# Distance of the cells from where the goal can't be reached
+
+def neighbours(mapArrayPosition, size):
+	# The 4 cells around a cell, inside the map
+	mapY, mapX = divmod(mapArrayPosition, size)
+	if mapX > 0:
+		yield mapArrayPosition - 1
+	if mapX < size - 1:
+		yield mapArrayPosition + 1
+	if mapY > 0:
+		yield mapArrayPosition - size
+	if mapY < size - 1:
+		yield mapArrayPosition + size
+
+class FlowField:
+
+	def __init__(self, walkable, size, goal):
+		# walkable is a bytearray, 1 for the walkable cells
+		self.size = size
+		self.goal = goal
+		self.distance = array('I', [NAV_UNREACHABLE]) * len(walkable)
+		self.nextCell = array('i', [-1]) * len(walkable)	# -1 where the goal can't be reached
+		if walkable[goal]:
+			self.distance[goal] = 0
+			self.nextCell[goal] = goal
+			self.relax(walkable, [goal])
+
+	def relax(self, walkable, seeds):
+		# Lowers the distances around the seeds (cells whose distance is already right, or just
+		# lowered) until they are consistent again. Returns the number of cells changed
+		distance = self.distance
+		nextCell = self.nextCell
+		size = self.size
+		queue = deque(seeds)
+		changed = 0
+		while queue:
+			position = queue.popleft()
+			neighbourDistance = distance[position] + 1
+			for neighbour in neighbours(position, size):
+				if walkable[neighbour] and distance[neighbour] > neighbourDistance:
+					distance[neighbour] = neighbourDistance
+					nextCell[neighbour] = position
+					queue.append(neighbour)
+					changed = changed + 1
+		return changed
+
+	def cellOpened(self, walkable, mapArrayPosition):
+		# The cell became walkable: it may be a shortcut. Returns the number of cells changed
+		distance = self.distance
+		best = min((neighbour for neighbour in neighbours(mapArrayPosition, self.size) if walkable[neighbour]),
+			key=lambda neighbour: distance[neighbour], default=None)
+		if best is None or distance[best] == NAV_UNREACHABLE:
+			return 0
+		distance[mapArrayPosition] = distance[best] + 1
+		self.nextCell[mapArrayPosition] = best
+		return 1 + self.relax(walkable, [mapArrayPosition])
+
+	def cellClosed(self, walkable, mapArrayPosition):
+		# The cell is not walkable anymore (it is not the goal). Returns the number of cells changed
+		distance = self.distance
+		nextCell = self.nextCell
+		size = self.size
+		if distance[mapArrayPosition] == NAV_UNREACHABLE:
+			return 0
+		# Find the orphans: the cells left without a neighbour one step closer to the goal.
+		# They are visited by increasing distance, so all the orphans at a distance are known
+		# before looking for support at the next one
+		orphans = {mapArrayPosition}
+		queue = deque((mapArrayPosition,))
+		while queue:
+			position = queue.popleft()
+			childDistance = distance[position] + 1
+			for child in neighbours(position, size):
+				if not walkable[child] or distance[child] != childDistance or child in orphans:
+					continue
+				support = None
+				for neighbour in neighbours(child, size):
+					if walkable[neighbour] and distance[neighbour] == childDistance - 1 and neighbour not in orphans:
+						support = neighbour
+						break
+				if support is None:
+					orphans.add(child)
+					queue.append(child)
+				else:
+					nextCell[child] = support
+
+		# Forget the orphans' distances, then reach them again from the cells around them
+		for position in orphans:
+			distance[position] = NAV_UNREACHABLE
+			nextCell[position] = -1
+		seeds = []
+		for position in orphans:
+			if not walkable[position]:
+				continue
+			for neighbour in neighbours(position, size):
+				if walkable[neighbour] and distance[neighbour] + 1 < distance[position]:
+					distance[position] = distance[neighbour] + 1
+					nextCell[position] = neighbour
+			if distance[position] != NAV_UNREACHABLE:
+				seeds.append(position)
+		return len(orphans) + self.relax(walkable, seeds)
+
+class NavigationCache:
+
+	def __init__(self, tileMap, doors=None, capacity=NAV_CACHE_SIZE):
+		# doors is the DoorRegistry, if any
+		self.tileMap = tileMap
+		self.doors = doors
+		self.capacity = capacity
+		self.fields = OrderedDict()	# Goal map array position -> FlowField, least recently used first
+		self.mapVersion = tileMap.version
+		self.doorsVersion = doors.version if doors is not None else 0
+		self.openDoors = self.findOpenDoors()
+		self.walkable = bytearray(len(tileMap.cells))
+		for mapArrayPosition, cell in enumerate(tileMap.cells):
+			self.walkable[mapArrayPosition] = self.isWalkable(mapArrayPosition, cell)
+		# Statistics
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.repairedCells = 0
+
+	def findOpenDoors(self):
+		if self.doors is None:
+			return set()
+		return set(mapArrayPosition for mapArrayPosition, door in self.doors.doors.items() if self.isOpenDoor(door))
+
+	def isOpenDoor(self, door):
+		return door.state == DOOR_OPEN
+
+	def isWalkable(self, mapArrayPosition, cell):
+		if cell == 0:
+			return True
+		return self.doors is not None and mapArrayPosition in self.openDoors
+
+	def field(self, goal):
+		# The flow field towards the goal cell, built if not cached
+		field = self.fields.get(goal)
+		if field is not None:
+			self.fields.move_to_end(goal)
+			self.hits = self.hits + 1
+			return field
+		if goal < 0 or goal >= len(self.walkable):
+			raise ValueError("Goal {} is outside the map".format(goal))
+		self.misses = self.misses + 1
+		field = FlowField(self.walkable, self.tileMap.size, goal)
+		self.fields[goal] = field
+		if len(self.fields) > self.capacity:
+			self.fields.popitem(last=False)
+			self.evictions = self.evictions + 1
+		return field
+
+	def nextCell(self, mapArrayPosition, goal):
+		# The cell to step on to go from mapArrayPosition towards the goal, the goal itself once
+		# there, or -1 if the goal can't be reached
+		return self.field(goal).nextCell[mapArrayPosition]
+
+	def waypoint(self, x, y, goal):
+		# Like nextCell(), from a position in map pixels. Returns the center of the next cell in
+		# map pixels, or None
+		size = self.tileMap.size
+		mapArrayPosition = int(y / MAP_SCALE) * size + int(x / MAP_SCALE)
+		nextCell = self.nextCell(mapArrayPosition, goal)
+		if nextCell < 0:
+			return None
+		mapY, mapX = divmod(nextCell, size)
+		return (mapX + 0.5) * MAP_SCALE, (mapY + 0.5) * MAP_SCALE
+
+	def update(self):
+		# Repairs the cached fields after map or door changes since the last call.
+		# Returns the number of cells that changed walkability
+		changedCells = set()
+		if self.tileMap.version != self.mapVersion:
+			cells = self.tileMap.cells
+			changedCells.update(i for i in range(len(cells)) if self.isWalkable(i, cells[i]) != bool(self.walkable[i]))
+			self.mapVersion = self.tileMap.version
+		if self.doors is not None and self.doors.version != self.doorsVersion:
+			# Doors move a little every tick: only becoming (or stopping being) open changes walkability
+			for mapArrayPosition in self.doors.changedCells(self.doorsVersion):
+				if self.isOpenDoor(self.doors.get(mapArrayPosition)) != (mapArrayPosition in self.openDoors):
+					self.openDoors ^= {mapArrayPosition}
+					changedCells.add(mapArrayPosition)
+			self.doorsVersion = self.doors.version
+		if not changedCells:
+			return 0
+
+		cells = self.tileMap.cells
+		if len(changedCells) > NAV_REPAIR_LIMIT:
+			# Cheaper to build the fields again, when asked for
+			for mapArrayPosition in changedCells:
+				self.walkable[mapArrayPosition] = self.isWalkable(mapArrayPosition, cells[mapArrayPosition])
+			self.fields.clear()
+			return len(changedCells)
+		for mapArrayPosition in changedCells:
+			walkable = self.isWalkable(mapArrayPosition, cells[mapArrayPosition])
+			self.walkable[mapArrayPosition] = walkable
+			for goal, field in list(self.fields.items()):
+				if goal == mapArrayPosition:
+					# The goal itself changed: everything changes
+					del self.fields[goal]
+				elif walkable:
+					self.repairedCells = self.repairedCells + field.cellOpened(self.walkable, mapArrayPosition)
+				else:
+					self.repairedCells = self.repairedCells + field.cellClosed(self.walkable, mapArrayPosition)
+		return len(changedCells)
+
+def main():
+	parser = argparse.ArgumentParser(description="Measures flow field navigation, with NPCs walking between random goals while doors open and close")
+	parser.add_argument("-l", "--level", help="level file (default: the built-in map)")
+	parser.add_argument("--npcs", type=int, default=1000, help="how many NPCs (default: 1000)")
+	parser.add_argument("--goals", type=int, default=8, help="how many different goals (default: 8)")
+	parser.add_argument("--ticks", type=int, default=300, help="ticks to simulate (default: 300)")
+	parser.add_argument("--tick-rate", type=int, default=30, help="ticks per second, for the doors (default: 30)")
+	parser.add_argument("--seed", type=int, default=0, help="random seed (default: 0)")
+	args = parser.parse_args()
+
+	tileMap = loadLevel(args.level) if args.level else TileMap()
+	doors = DoorRegistry(tileMap.cells, tileMap.size, MAP_DOOR_CELL_TYPE)
+	rng = random.Random(args.seed)
+	emptyCells = [i for i, cell in enumerate(tileMap.cells) if cell == 0]
+	goals = rng.sample(emptyCells, min(args.goals, len(emptyCells)))
+	npcs = [[rng.choice(emptyCells), rng.choice(goals)] for i in range(args.npcs)]	# Position, goal
+	doorPositions = list(doors.doors)
+
+	startTime = time.perf_counter()
+	navigation = NavigationCache(tileMap, doors)
+	for goal in goals:
+		navigation.field(goal)
+	buildTime = time.perf_counter() - startTime
+
+	steerTime = 0.0
+	updateTime = 0.0
+	steps = 0
+	for tick in range(args.ticks):
+		if doorPositions and tick % 10 == 0:
+			doors.open(rng.choice(doorPositions))
+		doors.update(1 / args.tick_rate)
+		startTime = time.perf_counter()
+		navigation.update()
+		updateTime = updateTime + time.perf_counter() - startTime
+
+		startTime = time.perf_counter()
+		for npc in npcs:
+			nextCell = navigation.nextCell(npc[0], npc[1])
+			if nextCell == npc[1] or nextCell < 0:
+				npc[1] = rng.choice(goals)
+			else:
+				npc[0] = nextCell
+				steps = steps + 1
+		steerTime = steerTime + time.perf_counter() - startTime
+
+	print("{}x{} map, {} doors, {} goals: {:.1f} ms to build the fields ({:.2f} ms each)".format(
+		tileMap.size, tileMap.size, len(doorPositions), len(goals), 1000 * buildTime, 1000 * buildTime / max(len(goals), 1)))
+	print("{} NPCs, {} ticks: {:.3f} ms steering per tick ({:.2f} us per NPC), {} steps".format(
+		args.npcs, args.ticks, 1000 * steerTime / args.ticks, 1000000 * steerTime / args.ticks / max(args.npcs, 1), steps))
+	print("Repairs: {:.3f} ms per tick, {} cells changed; cache: {} hits, {} misses, {} evictions".format(
+		1000 * updateTime / args.ticks, navigation.repairedCells, navigation.hits, navigation.misses, navigation.evictions))
+	return 0
+
+if __name__ == '__main__':
+	try:
+		sys.exit(main())
+	except KeyboardInterrupt:
+		exit(0)
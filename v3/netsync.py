@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+
+# PYTHON RAYCASTER
+# Inspired by https://www.youtube.com/watch?v=gYRrGTC7GtA
+# Copyright (C) 2023 Daniele Verducci
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Multiplayer state sync
+# Several players share a dungeon run by an authoritative server: clients only send their
+# keys, the server moves everybody and the doors, and sends back snapshots of the world.
+#   ./netsync.py server                          listens on NET_DEFAULT_ADDRESS
+#   ./raycaster.py --connect 127.0.0.1:5001      plays on the server
+#   ./netsync.py bots 32 --seconds 10            connects 32 bots, and reports the bandwidth
+#
+# Everything goes over UDP, in single datagrams. Clients send NET_INPUT packets (their keys,
+# as KEY_* bits of replay.py, and the newest snapshot they received) at their frame rate; the
+# server applies the latest keys of every client once per tick, then sends every client a
+# NET_SNAPSHOT packet, with:
+#   the players near the client (within NET_RELEVANCE_RADIUS cells), pose quantized to
+#   16 bits per value (1/NET_POSITION_UNITS of a cell, 1/65536 of a turn)
+#   the doors not closed, open fraction quantized to a byte
+# Snapshots are deltas: only what changed since the last snapshot the client acknowledged
+# (the base tick in the header) is sent, so idle players and doors cost nothing. Without a
+# usable base (a new client, or an acknowledgement older than NET_HISTORY ticks) the
+# snapshot is complete (base tick 0).
+
+import sys
+import math
+import time
+import random
+import socket
+import struct
+import asyncio
+import argparse
+from raycaster import Player, TileMap, MAP_SCALE, MAP_DOOR_CELL_TYPE
+from doors import DoorRegistry
+from replay import KEY_UP, KEY_DOWN, KEY_LEFT, KEY_RIGHT, KEY_USE
+from level import loadLevel
+
+NET_TICK_RATE = 30	# Server ticks per second
+NET_DEFAULT_ADDRESS = "127.0.0.1:5001"
+NET_RELEVANCE_RADIUS = 16	# Players farther than this (in cells) are not sent
+NET_HISTORY = 64	# Ticks of sent snapshots kept as delta bases
+NET_TIMEOUT = 5.0	# Seconds of silence before a client is dropped
+NET_POSITION_UNITS = 64	# Quantization steps per cell
+NET_INPUT_MAGIC = b"RCNI"
+NET_BYE_MAGIC = b"RCNB"
+NET_SNAPSHOT_MAGIC = b"RCNS"
+NET_INPUT = struct.Struct("<4sIB")	# Magic, newest snapshot tick received, keys
+NET_SNAPSHOT = struct.Struct("<4sIIHHHH")	# Magic, tick, base tick, your player id, changed players, removed players, changed doors
+# Followed by: changed players (id, x, y, r: 4 x uint16 each), removed players (uint16 each),
+# changed door positions (uint32 each), their open fractions (uint8 each, 0 is closed)
+
+def quantizePose(player):
+	x = int(round(player.x / MAP_SCALE * NET_POSITION_UNITS))
+	y = int(round(player.y / MAP_SCALE * NET_POSITION_UNITS))
+	r = int(round(player.r / (2 * math.pi) * 65536)) % 65536
+	return x, y, r
+
+def unquantizePose(pose):
+	# -> (x, y, r), in map pixels and radiants
+	x, y, r = pose
+	return x * MAP_SCALE / NET_POSITION_UNITS, y * MAP_SCALE / NET_POSITION_UNITS, r * 2 * math.pi / 65536
+
+def encodeSnapshot(tick, baseTick, playerId, base, current):
+	# Encodes the delta from the base state to the current one. States are (players, doors):
+	# dicts of player id -> quantized pose and door position -> quantized open fraction
+	basePlayers, baseDoors = base
+	players, doors = current
+	changedPlayers = [(otherId, pose) for otherId, pose in players.items() if basePlayers.get(otherId) != pose]
+	removedPlayers = [otherId for otherId in basePlayers if otherId not in players]
+	changedDoors = [(position, fraction) for position, fraction in doors.items() if baseDoors.get(position) != fraction]
+	changedDoors.extend((position, 0) for position in baseDoors if position not in doors)
+
+	playerValues = []
+	for otherId, pose in changedPlayers:
+		playerValues.append(otherId)
+		playerValues.extend(pose)
+	return b"".join((
+		NET_SNAPSHOT.pack(NET_SNAPSHOT_MAGIC, tick, baseTick, playerId, len(changedPlayers), len(removedPlayers), len(changedDoors)),
+		struct.pack("<{}H".format(len(playerValues)), *playerValues),
+		struct.pack("<{}H".format(len(removedPlayers)), *removedPlayers),
+		struct.pack("<{}I".format(len(changedDoors)), *(position for position, fraction in changedDoors)),
+		bytes(fraction for position, fraction in changedDoors)))
+
+def decodeSnapshot(data, states):
+	# Decodes a snapshot against the states received before (dict of tick -> state).
+	# Returns (tick, player id, state), or None if the base state is not known (anymore)
+	magic, tick, baseTick, playerId, playersCount, removedCount, doorsCount = NET_SNAPSHOT.unpack_from(data)
+	if magic != NET_SNAPSHOT_MAGIC:
+		raise ValueError("Not a snapshot packet")
+	if baseTick == 0:
+		basePlayers, baseDoors = {}, {}
+	elif baseTick in states:
+		basePlayers, baseDoors = states[baseTick]
+	else:
+		return None
+	players = dict(basePlayers)
+	doors = dict(baseDoors)
+	offset = NET_SNAPSHOT.size
+	playerValues = struct.unpack_from("<{}H".format(playersCount * 4), data, offset)
+	offset = offset + playersCount * 8
+	for i in range(0, len(playerValues), 4):
+		players[playerValues[i]] = playerValues[i + 1:i + 4]
+	for otherId in struct.unpack_from("<{}H".format(removedCount), data, offset):
+		players.pop(otherId, None)
+	offset = offset + removedCount * 2
+	positions = struct.unpack_from("<{}I".format(doorsCount), data, offset)
+	offset = offset + doorsCount * 4
+	for position, fraction in zip(positions, data[offset:offset + doorsCount]):
+		if fraction == 0:
+			doors.pop(position, None)
+		else:
+			doors[position] = fraction
+	return tick, playerId, (players, doors)
+
+class Peer:
+	# A client, as seen by the server
+
+	def __init__(self, address, playerId):
+		self.address = address
+		self.playerId = playerId
+		self.player = Player.spawn()
+		self.keys = 0	# Latest keys received
+		self.ackTick = 0	# Newest snapshot the client received
+		self.sentStates = {}	# Tick -> state sent in that tick, until acknowledged
+		self.lastSeen = time.monotonic()
+
+class NetServer(asyncio.DatagramProtocol):
+
+	def __init__(self, tileMap=None, tickRate=NET_TICK_RATE, relevanceRadius=NET_RELEVANCE_RADIUS):
+		self.tileMap = tileMap.copy() if tileMap is not None else TileMap()
+		if self.tileMap.size * NET_POSITION_UNITS > 65535:
+			raise ValueError("Map size is {}, but can be at most {} for network play".format(self.tileMap.size, 65535 // NET_POSITION_UNITS))
+		self.doors = DoorRegistry(self.tileMap.cells, self.tileMap.size, MAP_DOOR_CELL_TYPE)
+		self.tickRate = tickRate
+		self.relevanceRadius = relevanceRadius * MAP_SCALE
+		self.peers = {}	# Address -> Peer
+		self.nextPlayerId = 1
+		self.tick = 0
+		self.transport = None
+		# Statistics since the last report
+		self.sentBytes = 0
+		self.sentSnapshots = 0
+		self.fullSnapshots = 0
+		self.fullBytes = 0	# What complete snapshots would have taken
+		self.encodeTime = 0.0
+
+	def connection_made(self, transport):
+		self.transport = transport
+
+	def datagram_received(self, data, address):
+		magic = data[:4]
+		if magic == NET_BYE_MAGIC:
+			self.peers.pop(address, None)
+			return
+		if magic != NET_INPUT_MAGIC or len(data) != NET_INPUT.size:
+			return	# Not for us
+		magic, ackTick, keys = NET_INPUT.unpack(data)
+		peer = self.peers.get(address)
+		if peer is None:
+			peer = Peer(address, self.nextPlayerId)
+			self.nextPlayerId = self.nextPlayerId % 65535 + 1
+			self.peers[address] = peer
+		peer.keys = keys
+		peer.lastSeen = time.monotonic()
+		if ackTick > peer.ackTick and ackTick in peer.sentStates:
+			peer.ackTick = ackTick
+			# Older states can't be bases anymore
+			for tick in [tick for tick in peer.sentStates if tick < ackTick]:
+				del peer.sentStates[tick]
+
+	def tickWorld(self):
+		# Doors move for everyone, and don't close on anybody. Then every player moves
+		occupiedCells = set()
+		for peer in self.peers.values():
+			occupiedCells.update(self.tileMap.cellsUnderBox(peer.player.x, peer.player.y, peer.player.radius))
+		self.doors.update(1 / self.tickRate, occupiedCells)
+		for peer in self.peers.values():
+			keys = peer.keys
+			peer.player.step(self.tileMap, keys & KEY_UP, keys & KEY_DOWN, keys & KEY_LEFT, keys & KEY_RIGHT, self.doors)
+			if keys & KEY_USE:
+				peer.player.openDoor(self.tileMap, self.doors)
+
+	def sendSnapshots(self):
+		startTime = time.perf_counter()
+		poses = [(peer.playerId, peer.player.x, peer.player.y, quantizePose(peer.player)) for peer in self.peers.values()]
+		doors = {}
+		for position, door in self.doors.doors.items():
+			fraction = int(round(door.openFraction * 255))
+			if fraction > 0:
+				doors[position] = fraction
+		radiusSquared = self.relevanceRadius * self.relevanceRadius
+		for peer in self.peers.values():
+			x = peer.player.x
+			y = peer.player.y
+			players = {}
+			for otherId, otherX, otherY, pose in poses:
+				if (otherX - x) * (otherX - x) + (otherY - y) * (otherY - y) <= radiusSquared:
+					players[otherId] = pose
+			state = (players, doors)
+			base = peer.sentStates.get(peer.ackTick)
+			baseTick = peer.ackTick
+			if base is None or self.tick - baseTick > NET_HISTORY:
+				base = ({}, {})
+				baseTick = 0
+				self.fullSnapshots = self.fullSnapshots + 1
+			packet = encodeSnapshot(self.tick, baseTick, peer.playerId, base, state)
+			peer.sentStates[self.tick] = state
+			if len(peer.sentStates) > NET_HISTORY:
+				del peer.sentStates[min(peer.sentStates)]
+			self.transport.sendto(packet, peer.address)
+			self.sentBytes = self.sentBytes + len(packet)
+			self.fullBytes = self.fullBytes + NET_SNAPSHOT.size + 8 * len(players) + 5 * len(doors)
+			self.sentSnapshots = self.sentSnapshots + 1
+		self.encodeTime = self.encodeTime + time.perf_counter() - startTime
+
+	async def runTicks(self, reportInterval=5.0):
+		loop = asyncio.get_running_loop()
+		tickDuration = 1 / self.tickRate
+		nextTickTime = loop.time()
+		lastReportTime = loop.time()
+		while True:
+			now = time.monotonic()
+			for address in [address for address, peer in self.peers.items() if now - peer.lastSeen > NET_TIMEOUT]:
+				del self.peers[address]
+			self.tick = self.tick + 1
+			self.tickWorld()
+			self.sendSnapshots()
+
+			if reportInterval and loop.time() - lastReportTime >= reportInterval:
+				ticks = (loop.time() - lastReportTime) * self.tickRate
+				print("{} clients, {:.0f} bytes per snapshot (complete: {:.0f}), {:.0f} bytes/s per client, {} complete snapshots sent, {:.3f} ms encoding per tick".format(
+					len(self.peers), self.sentBytes / max(self.sentSnapshots, 1), self.fullBytes / max(self.sentSnapshots, 1),
+					self.sentBytes * self.tickRate / max(self.sentSnapshots, 1), self.fullSnapshots, 1000 * self.encodeTime / ticks))
+				self.sentBytes = self.sentSnapshots = self.fullSnapshots = self.fullBytes = 0
+				self.encodeTime = 0.0
+				lastReportTime = loop.time()
+
+			nextTickTime = max(nextTickTime + tickDuration, loop.time())	# Don't try to catch up if late
+			await asyncio.sleep(nextTickTime - loop.time())
+
+	async def serve(self, address=NET_DEFAULT_ADDRESS):
+		loop = asyncio.get_running_loop()
+		host, port = address.rsplit(":", 1)
+		transport, protocol = await loop.create_datagram_endpoint(lambda: self, local_addr=(host, int(port)))
+		print("Net server listening on {}".format(address))
+		try:
+			await self.runTicks()
+		finally:
+			transport.close()
+
+class NetClient:
+	# Non blocking client: call sendInput() once per frame, and poll() to get the newest state
+
+	def __init__(self, address=NET_DEFAULT_ADDRESS):
+		host, port = address.rsplit(":", 1)
+		self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.socket.connect((host, int(port)))
+		self.socket.setblocking(False)
+		self.states = {}	# Tick -> state received, possible delta bases
+		self.tick = 0	# Newest snapshot received
+		self.playerId = None
+		self.players = {}	# Player id -> (x, y, r), in map pixels and radiants
+		self.doors = {}	# Door position -> open fraction, for the doors not closed
+		self.receivedBytes = 0
+		self.receivedSnapshots = 0
+		self.undecodableSnapshots = 0
+
+	def sendInput(self, up, down, left, right, use):
+		keys = (KEY_UP if up else 0) | (KEY_DOWN if down else 0) | (KEY_LEFT if left else 0) | (KEY_RIGHT if right else 0) | (KEY_USE if use else 0)
+		try:
+			self.socket.send(NET_INPUT.pack(NET_INPUT_MAGIC, self.tick, keys))
+		except ConnectionRefusedError:
+			pass	# No server (yet)
+
+	def poll(self):
+		# Reads all the received snapshots. Returns True if the state changed
+		changed = False
+		while True:
+			try:
+				data = self.socket.recv(65536)
+			except (BlockingIOError, ConnectionRefusedError):
+				break
+			self.receivedBytes = self.receivedBytes + len(data)
+			self.receivedSnapshots = self.receivedSnapshots + 1
+			decoded = decodeSnapshot(data, self.states)
+			if decoded is None:
+				self.undecodableSnapshots = self.undecodableSnapshots + 1
+				continue
+			tick, playerId, state = decoded
+			self.states[tick] = state
+			if tick <= self.tick:
+				continue	# Arrived late
+			self.tick = tick
+			self.playerId = playerId
+			players, doors = state
+			self.players = dict((otherId, unquantizePose(pose)) for otherId, pose in players.items())
+			self.doors = dict((position, fraction / 255) for position, fraction in doors.items())
+			changed = True
+		for tick in [tick for tick in self.states if tick < self.tick - NET_HISTORY]:
+			del self.states[tick]
+		return changed
+
+	def applyTo(self, player, doors):
+		# Moves the local player and doors (a DoorRegistry) where the server has them
+		pose = self.players.get(self.playerId)
+		if pose is not None:
+			player.x, player.y, player.r = pose
+		for position in doors.doors:
+			doors.setOpenFraction(position, self.doors.get(position, 0.0))
+
+	def close(self):
+		try:
+			self.socket.send(NET_BYE_MAGIC)
+		except ConnectionRefusedError:
+			pass
+		self.socket.close()
+
+def runBots(botsCount, address, seconds, tickRate=NET_TICK_RATE):
+	# Connects botsCount clients pressing random keys, and reports what they received
+	rng = random.Random(0)
+	bots = [NetClient(address) for i in range(botsCount)]
+	keys = [(False, False, False, False, False)] * botsCount
+	startTime = time.monotonic()
+	nextTickTime = startTime
+	while time.monotonic() - startTime < seconds:
+		for i, bot in enumerate(bots):
+			if rng.random() < 0.1:
+				# Change keys now and then: walk, turn, open doors or stand still
+				keys[i] = (rng.random() < 0.6, False, rng.random() < 0.2, rng.random() < 0.2, rng.random() < 0.1)
+			bot.sendInput(*keys[i])
+			bot.poll()
+		nextTickTime = max(nextTickTime + 1 / tickRate, time.monotonic())
+		time.sleep(max(0, nextTickTime - time.monotonic()))
+	elapsed = time.monotonic() - startTime
+	receivedBytes = sum(bot.receivedBytes for bot in bots)
+	receivedSnapshots = sum(bot.receivedSnapshots for bot in bots)
+	print("{} bots, {:.1f} s: {:.0f} snapshots/s per bot, {:.0f} bytes per snapshot, {:.0f} bytes/s per bot, {} undecodable".format(
+		botsCount, elapsed, receivedSnapshots / botsCount / elapsed, receivedBytes / max(receivedSnapshots, 1), receivedBytes / botsCount / elapsed,
+		sum(bot.undecodableSnapshots for bot in bots)))
+	for bot in bots:
+		bot.close()
+
+def main():
+	parser = argparse.ArgumentParser(description="Multiplayer server, and bots to test it")
+	parser.add_argument("mode", choices=("server", "bots"), help="run the server, or connect bots to a server")
+	parser.add_argument("count", type=int, nargs="?", default=8, help="with bots, how many (default: 8)")
+	parser.add_argument("--address", default=NET_DEFAULT_ADDRESS, help="server HOST:PORT (default: {})".format(NET_DEFAULT_ADDRESS))
+	parser.add_argument("-l", "--level", help="with server, level file (default: the built-in map)")
+	parser.add_argument("--tick-rate", type=int, default=NET_TICK_RATE, help="ticks per second (default: {})".format(NET_TICK_RATE))
+	parser.add_argument("--seconds", type=float, default=10, help="with bots, how long to play (default: 10)")
+	args = parser.parse_args()
+
+	if args.mode == "bots":
+		runBots(args.count, args.address, args.seconds, args.tick_rate)
+		return 0
+	tileMap = loadLevel(args.level) if args.level else TileMap()
+	server = NetServer(tileMap, args.tick_rate)
+	asyncio.run(server.serve(args.address))
+	return 0
+
+if __name__ == '__main__':
+	try:
+		sys.exit(main())
+	except KeyboardInterrupt:
+		exit(0)
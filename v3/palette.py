@@ -0,0 +1,149 @@
+# PYTHON RAYCASTER
+# Inspired by https://www.youtube.com/watch?v=gYRrGTC7GtA
+# Copyright (C) 2023 Daniele Verducci
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Indexed color
+# The textures are quantized at load to a shared palette of 256 colors, so texels and the
+# framebuffer take 1 byte per pixel instead of 4, and are converted to RGB only at upload time.
+# The first PALETTE_BASE_COLORS entries are the texture colors (found by median cut) plus the
+# ceiling and floor colors; the entry n + PALETTE_BASE_COLORS is entry n shaded, so shading a
+# texel is a table lookup (Palette.shadeTable).
+
+from array import array
+from raycaster import TextureStore, CEILING_COLOR, FLOOR_COLOR
+
+PALETTE_SIZE = 256
+PALETTE_BASE_COLORS = 128	# The other half are the same colors, shaded
+
+def packColor(color):
+	# [r, g, b] -> 0x00RRGGBB
+	return (color[0] << 16) + (color[1] << 8) + color[2]
+
+def channels(color):
+	return color >> 16 & 0xff, color >> 8 & 0xff, color & 0xff
+
+def medianCut(colorCounts, boxesCount):
+	# Splits the colors in up to boxesCount boxes, halving every time the box with the widest
+	# channel range along that channel (at the median pixel). colorCounts is a dict of packed
+	# color -> number of pixels. Returns the average color of every box, and a dict of packed
+	# color -> index of its box
+	boxes = [[(channels(color), count) for color, count in colorCounts.items()]]
+	while len(boxes) < boxesCount:
+		widestBox = None
+		widestRange = 0
+		widestChannel = 0
+		for box in boxes:
+			if len(box) < 2:
+				continue
+			for channel in range(3):
+				values = [rgb[channel] for rgb, count in box]
+				if max(values) - min(values) > widestRange:
+					widestBox = box
+					widestRange = max(values) - min(values)
+					widestChannel = channel
+		if widestBox is None:
+			break	# Every box has a single color
+		widestBox.sort(key=lambda entry: entry[0][widestChannel])
+		half = sum(count for rgb, count in widestBox) / 2
+		pixels = 0
+		split = 1
+		for split in range(1, len(widestBox)):
+			pixels = pixels + widestBox[split - 1][1]
+			if pixels >= half:
+				break
+		boxes.remove(widestBox)
+		boxes.append(widestBox[:split])
+		boxes.append(widestBox[split:])
+
+	colors = []
+	colorBoxes = {}
+	for box in boxes:
+		pixels = sum(count for rgb, count in box)
+		for rgb, count in box:
+			colorBoxes[packColor(rgb)] = len(colors)
+		colors.append(packColor([int(round(sum(rgb[channel] * count for rgb, count in box) / pixels)) for channel in range(3)]))
+	return colors, colorBoxes
+
+class Palette:
+	__slots__ = ("colors", "shadeTable", "redTable", "greenTable", "blueTable", "indexCache")
+
+	def __init__(self, baseColors):
+		if len(baseColors) > PALETTE_BASE_COLORS:
+			raise ValueError("Palette has {} base colors, but can have at most {}".format(len(baseColors), PALETTE_BASE_COLORS))
+		baseColors = list(baseColors) + [0] * (PALETTE_BASE_COLORS - len(baseColors))
+		self.colors = array('I', baseColors + [TextureStore.shade(color) for color in baseColors])
+		# Shaded colors stay as they are
+		self.shadeTable = bytes(list(range(PALETTE_BASE_COLORS, PALETTE_SIZE)) + list(range(PALETTE_BASE_COLORS, PALETTE_SIZE)))
+		# Index -> channel, for bytes.translate()
+		self.redTable = bytes(color >> 16 & 0xff for color in self.colors)
+		self.greenTable = bytes(color >> 8 & 0xff for color in self.colors)
+		self.blueTable = bytes(color & 0xff for color in self.colors)
+		self.indexCache = {}
+
+	@staticmethod
+	def fromTextures(textures, extraColors=(CEILING_COLOR, FLOOR_COLOR)):
+		# Palette for a TextureStore: the texture colors are quantized to make room for extraColors ([r, g, b])
+		colorCounts = {}
+		for color in textures.texels:
+			colorCounts[color] = colorCounts.get(color, 0) + 1
+		baseColors, colorBoxes = medianCut(colorCounts, PALETTE_BASE_COLORS - len(extraColors))
+		palette = Palette(baseColors + [packColor(color) for color in extraColors])
+		# Texture colors are mapped to their box, without searching the nearest color
+		palette.indexCache.update(colorBoxes)
+		return palette
+
+	def index(self, color):
+		# Index of the base color nearest to a packed color
+		index = self.indexCache.get(color)
+		if index is None:
+			r, g, b = channels(color)
+			bestDistance = None
+			for i in range(PALETTE_BASE_COLORS):
+				paletteR, paletteG, paletteB = channels(self.colors[i])
+				distance = (r - paletteR) * (r - paletteR) + (g - paletteG) * (g - paletteG) + (b - paletteB) * (b - paletteB)
+				if bestDistance is None or distance < bestDistance:
+					bestDistance = distance
+					index = i
+			self.indexCache[color] = index
+		return index
+
+	def toPacked(self, frame):
+		# Converts an indexed framebuffer to a packed one
+		colors = self.colors
+		return array('I', [colors[index] for index in frame])
+
+	def toRGB(self, frame):
+		# Converts an indexed framebuffer to a bytes object of RGB triplets
+		indexes = bytes(frame)
+		rgb = bytearray(len(indexes) * 3)
+		rgb[0::3] = indexes.translate(self.redTable)
+		rgb[1::3] = indexes.translate(self.greenTable)
+		rgb[2::3] = indexes.translate(self.blueTable)
+		return bytes(rgb)
+
+class IndexedTextureStore(TextureStore):
+	# A TextureStore whose texels are palette indexes (array('B')) instead of packed colors:
+	# can be used in its place by the renderers
+	__slots__ = ("palette",)
+
+	def __init__(self, textures, palette=None):
+		# textures is a TextureStore, palette defaults to one made for it
+		if palette is None:
+			palette = Palette.fromTextures(textures)
+		self.palette = palette
+		self.count = textures.count
+		self.texels = array('B', [palette.index(color) for color in textures.texels])
+		self.shadedTexels = array('B', bytes(self.texels).translate(palette.shadeTable))
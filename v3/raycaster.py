@@ -20,12 +20,20 @@
 # REQUIREMENTS:
 # pip install pysdl2 pysdl2-dll pypng
 
+import os
 import sys
 import sdl2.ext
 import math
 import time
 import ctypes
 import png
+import argparse
+from array import array
+from doors import DoorRegistry
+from visibility import loadOrComputeVisibility
+from replay import InputRecording, RECORDING_MAX_TICK_MS, readRendererHash
+from frameexport import FrameExporter
+from rectbatch import RectBatch
 
 # Map cfg
 MAP_HIDDEN = True
@@ -48,19 +56,41 @@ TEXTURES = [
 TEXTURE_SIZE = 64
 
 # Raycast cfg
-RAYCAST_WIN_WIDTH = 1000
+RAYCAST_WIN_WIDTH = 1000	# Initial window size: the window can be resized
 RAYCAST_WIN_HEIGHT = 1000
-RAYCAST_RENDER_MULTIPLIER = 4
-RAYCAST_RENDER_WIDTH = int(RAYCAST_WIN_WIDTH / RAYCAST_RENDER_MULTIPLIER)
+RAYCAST_RENDER_MULTIPLIER = 4	# Initial window size / internal resolution (any ratio works, also non integer)
+RAYCAST_RENDER_WIDTH = int(RAYCAST_WIN_WIDTH / RAYCAST_RENDER_MULTIPLIER)	# Internal resolution: the engine always draws at this size
 RAYCAST_RENDER_HEIGHT = int(RAYCAST_WIN_HEIGHT / RAYCAST_RENDER_MULTIPLIER)
+RAYCAST_SCALE_QUALITY = b"nearest"	# Upscaling filter: nearest (big pixels) or linear
+RAYCAST_VSYNC = True	# Wait for the display when presenting (smoother, but frames shown later: see latency.py)
 DOF = 2*MAP_SIZE	# Depth Of Field
+RAYCAST_SPAN_COLUMNS = 8	# Rays are fully cast at least every 8 columns, see TileMap.castColumns() (1 = every column)
+PVS_FILE = "assets/map.pvs"	# Precomputed visibility (./visibility.py -o assets/map.pvs), computed at load if missing
+RAYCAST_INDEXED_COLOR = False	# Render with 8 bit palette indexes instead of 32 bit colors, see palette.py
+RAYCAST_JIT = False	# Render with the Numba compiled renderer, if Numba is installed (see jitrender.py). Also enabled by --jit
 CEILING_COLOR = [0,128,255]
 FLOOR_COLOR = [64,64,64]
 
+# Lighting cfg
+LIGHTING = True	# Baked lightmaps, see lighting.py (False: horizontal walls are just shaded; always False with RAYCAST_INDEXED_COLOR)
+LIGHTS = [	# Position and radius in map cells
+	{"x": 6.5, "y": 4.5, "radius": 6, "intensity": 1.0},
+	{"x": 8.5, "y": 12.5, "radius": 5, "intensity": 0.8},
+	{"x": 20.5, "y": 7.5, "radius": 10, "intensity": 1.0},
+	{"x": 25.5, "y": 23.5, "radius": 9, "intensity": 0.9},
+	{"x": 8.5, "y": 25.5, "radius": 8, "intensity": 0.9},
+	{"x": 1.5, "y": 17.5, "radius": 6, "intensity": 0.7},
+]
+LIGHT_AMBIENT = 0.4	# Light of the faces no light reaches (0 to 1)
+LIGHT_LEVELS = 32	# Light levels, from black to full brightness
+LIGHTMAP_SIZE = 8	# Lightmap samples along every face
+
 # Player cfg
 PLAYER_SPEED = 8
 PLAYER_ROTATION_SPEED = 0.1
 PLAYER_SPAWN_POSITION = {"x": 1.5, "y": 1.5, "r": 1.7}	# r is rotation in radiants
+PLAYER_RADIUS = 6	# Half size of the collision box, in map pixels
+COLLISION_EPSILON = 0.001	# Distance kept from walls, in map pixels
 
 # Dungeon data
 MAP = [
@@ -98,20 +128,591 @@ MAP = [
 	1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1,
 ]
 
-class Main:
+class Camera:
+	# A point of view: x and y in map pixels, r is rotation in radiants
+	__slots__ = ("x", "y", "r")
+
+	def __init__(self, x, y, r):
+		self.x = x
+		self.y = y
+		self.r = r
+
+	def copy(self):
+		return Camera(self.x, self.y, self.r)
+
+	def mapArrayPosition(self, mapSize):
+		# The map cell containing the camera
+		return int(self.y / MAP_SCALE) * mapSize + int(self.x / MAP_SCALE)
+
+class Player(Camera):
+	# A camera that moves in the map, with a square collision box of half size radius
+	__slots__ = ("radius",)
+
+	def __init__(self, x, y, r, radius=PLAYER_RADIUS):
+		Camera.__init__(self, x, y, r)
+		self.radius = radius
+
+	@staticmethod
+	def spawn(spawnPosition=PLAYER_SPAWN_POSITION):
+		# New player at the spawn position (given in map cells)
+		return Player(MAP_SCALE * spawnPosition["x"], MAP_SCALE * spawnPosition["y"], spawnPosition["r"])
+
+	def moveRelative(self, tileMap, player_delta_x, player_delta_y, doors=None):
+		# Moves the player by the given delta, preventing it from going into walls.
+		# Axes are moved one at a time, so the player slides along the walls instead of stopping
+		self.x = tileMap.sweepAxis(self.x, player_delta_x, self.y, self.radius, False, doors)
+		self.y = tileMap.sweepAxis(self.y, player_delta_y, self.x, self.radius, True, doors)
+
+	def step(self, tileMap, up, down, left, right, doors=None):
+		# Applies one tick of player input (arrow keys state)
+		# Rotate player
+		if left:
+			self.r = self.r - PLAYER_ROTATION_SPEED
+		elif right:
+			self.r = self.r + PLAYER_ROTATION_SPEED
+
+		# Compute deltax and deltay based on player direction
+		player_delta_x = math.cos(self.r) * PLAYER_SPEED
+		player_delta_y = math.sin(self.r) * PLAYER_SPEED
+
+		# Move player based on its direction
+		if up:
+			self.moveRelative(tileMap, player_delta_x, player_delta_y, doors)
+		elif down:
+			self.moveRelative(tileMap, -player_delta_x, -player_delta_y, doors)
+
+		# Limit position into dungeon bounds
+		mapPixelSize = tileMap.size * MAP_SCALE
+		if self.x < 0:
+			self.x = 0
+		if self.x > mapPixelSize:
+			self.x = mapPixelSize
+		if self.y < 0:
+			self.y = 0
+		if self.y > mapPixelSize:
+			self.y = mapPixelSize
+		if self.r > 2*math.pi:
+			self.r = 0
+		if self.r < 0:
+			self.r = 2*math.pi
+
+	def openDoor(self, tileMap, doors=None):
+		# Opens the door in front of the player, if any
+		# With a DoorRegistry the door starts sliding open, otherwise it is removed from the map
+		# Returns (lookingAtMapArrayPosition, opened)
+		mapSize = tileMap.size
+
+		# Find where is the user
+		mapArrayPosition = self.mapArrayPosition(mapSize)
+
+		# Find in which direction the user is looking
+		playerAngle = self.r
+		lookingAtMapArrayPosition = 0
+		if playerAngle > math.pi / 4 and playerAngle <= 3 * math.pi / 4:
+			# Looking up
+			lookingAtMapArrayPosition = mapArrayPosition - mapSize
+		elif playerAngle > 3 * math.pi / 4 and playerAngle <= 5 * math.pi / 4:
+			# Looking left
+			lookingAtMapArrayPosition = mapArrayPosition - 1
+		elif playerAngle > 5 * math.pi / 4 and playerAngle <= 7 * math.pi / 4:
+			# Looking down
+			lookingAtMapArrayPosition = mapArrayPosition + mapSize
+		else:
+			# Looking right
+			lookingAtMapArrayPosition = mapArrayPosition + 1
+
+		if lookingAtMapArrayPosition >= 0 and lookingAtMapArrayPosition < mapSize * mapSize and tileMap.cells[lookingAtMapArrayPosition] == MAP_DOOR_CELL_TYPE:
+			# Player looking at a door: open it
+			if doors is not None:
+				return lookingAtMapArrayPosition, doors.open(lookingAtMapArrayPosition)
+			# No door registry: "remove" it, leaving an empty space
+			tileMap.setCell(lookingAtMapArrayPosition, 0)
+			return lookingAtMapArrayPosition, True
+		return lookingAtMapArrayPosition, False
+
+class TileMap:
+	# Square map of tiles, one byte per cell (0 is empty, n is the wall with texture n-1)
+	__slots__ = ("size", "cells", "version")
+
+	def __init__(self, cells=MAP, size=MAP_SIZE):
+		if len(cells) != size * size:
+			raise ValueError("Map size is {}, but should be a power of {}".format(len(cells), size))
+		self.size = size
+		self.cells = array('B', cells)
+		self.version = 0	# Incremented at every change, for caches
+
+	def copy(self):
+		return TileMap(self.cells, self.size)
+
+	def setCell(self, mapArrayPosition, value):
+		self.cells[mapArrayPosition] = value
+		self.version = self.version + 1
+
+	def isSolidCell(self, mapX, mapY, doors=None):
+		# Walls and doors (unless completely open) are solid, and so is everything outside the map
+		size = self.size
+		if mapX < 0 or mapY < 0 or mapX >= size or mapY >= size:
+			return True
+		mapArrayPosition = mapY * size + mapX
+		if self.cells[mapArrayPosition] == 0:
+			return False
+		if doors is not None:
+			door = doors.get(mapArrayPosition)
+			if door is not None:
+				return not door.isPassable()
+		return True
+
+	def cellsUnderBox(self, centerX, centerY, radius):
+		# Returns the map array positions of the cells touched by a collision box
+		cells = set()
+		for mapY in range(math.floor((centerY - radius) / MAP_SCALE), math.floor((centerY + radius) / MAP_SCALE) + 1):
+			for mapX in range(math.floor((centerX - radius) / MAP_SCALE), math.floor((centerX + radius) / MAP_SCALE) + 1):
+				cells.add(mapY * self.size + mapX)
+		return cells
+
+	def sweepAxis(self, center, delta, sideCenter, radius, alongY, doors=None):
+		# Moves the collision box (center +- radius) by delta along a single axis, stopping it right before
+		# the first solid cell it would enter. sideCenter is the box center on the other axis.
+		# Returns the new center
+		if delta == 0:
+			return center
+		direction = 1 if delta > 0 else -1
+		lead = center + direction * radius	# Box side facing the movement
+		firstSideCell = math.floor((sideCenter - radius) / MAP_SCALE)
+		lastSideCell = math.floor((sideCenter + radius) / MAP_SCALE)
+		cell = math.floor(lead / MAP_SCALE)
+		targetCell = math.floor((lead + delta) / MAP_SCALE)
+		while cell != targetCell:
+			# Check every cell entered by the box, one row (or column) at a time
+			cell = cell + direction
+			for sideCell in range(firstSideCell, lastSideCell + 1):
+				if alongY:
+					solid = self.isSolidCell(sideCell, cell, doors)
+				else:
+					solid = self.isSolidCell(cell, sideCell, doors)
+				if solid:
+					# Stop touching the wall
+					if direction > 0:
+						return cell * MAP_SCALE - radius - COLLISION_EPSILON
+					return (cell + 1) * MAP_SCALE + radius + COLLISION_EPSILON
+		return center + delta
+
+	def castRay(self, playerX, playerY, rayAngle, doors=None, maxDof=None):
+		# Casts a single ray from the given position (and against the DoorRegistry, if any).
+		# maxDof limits the grid lines checked (see VisibilitySets.maxDof()), default is twice the map size.
+		# maxDof is found by sampling: a ray reaching no wall within it is cast again without limit
+		# Returns (distance, hitX, hitY, hitTile, texColumn, shading): hitTile is the map value of the
+		# reached wall (0 if none was found within the depth of field), shading is True for horizontal walls
+		fullDof = 2 * self.size
+		dofMax = fullDof if maxDof is None else maxDof
+		hit = self.marchRay(playerX, playerY, rayAngle, doors, dofMax)
+		if hit[3] == 0 and dofMax < fullDof:
+			hit = self.marchRay(playerX, playerY, rayAngle, doors, fullDof)
+		return hit
+
+	def marchRay(self, playerX, playerY, rayAngle, doors, dofMax):
+		# castRay(), checking dofMax grid lines (Depth Of Field) on each axis
+		mapCells = self.cells
+		mapSize = self.size
+		cellsCount = mapSize * mapSize
+
+		# Which map wall tiles have been hit by rayX and rayY
+		mapBlockHitX = 0
+		mapBlockHitY = 0
+		# Texture shift of the hit walls (doors slide with their texture)
+		texShiftX = 0
+		texShiftY = 0
+
+		# Check horizontal lines
+		dof = 0 # Depth of field
+		if rayAngle == 0 or rayAngle == math.pi:
+			# Looking left or right (ray will never intersect parallel lines)
+			rayY = playerY
+			rayX = playerX + dofMax * MAP_SCALE
+			dof = dofMax	# Set depth of field to maximum to avoid unneeded checks
+		elif rayAngle > math.pi:
+			# Looking up
+			aTan = -1/math.tan(rayAngle)
+			rayY = (int(playerY / MAP_SCALE) * MAP_SCALE) - 0.00001
+			rayX = (playerY - rayY) * aTan + playerX
+			yOffset = -MAP_SCALE
+			xOffset = -yOffset * aTan
+		else:
+			# Looking down
+			aTan = -1/math.tan(rayAngle)
+			rayY = (int(playerY / MAP_SCALE) * MAP_SCALE) + MAP_SCALE
+			rayX = (playerY - rayY) * aTan + playerX
+			yOffset = MAP_SCALE
+			xOffset = -yOffset * aTan
+
+		# Check if we reached a wall
+		while dof < dofMax:
+			mapX = int(rayX / MAP_SCALE)
+			mapY = int(rayY / MAP_SCALE)
+			mapArrayPosition = mapY * mapSize + mapX
+			if mapArrayPosition >= 0 and mapArrayPosition < cellsCount and mapCells[mapArrayPosition] != 0:
+				door = None
+				if doors is not None and mapCells[mapArrayPosition] == MAP_DOOR_CELL_TYPE:
+					door = doors.get(mapArrayPosition)
+				if door is None:
+					dof = dofMax	# Hit the wall: we are done, no need to do other checks
+					mapBlockHitY = mapCells[mapArrayPosition]	# Save which map wall tile we reached
+					continue
+				if not door.vertical:
+					# Door plane is half a step further: check if the ray reaches it inside the cell, where the door still covers it
+					doorX = rayX + xOffset / 2
+					doorShift = door.openFraction * MAP_SCALE
+					if int(doorX / MAP_SCALE) == mapX and doorX % MAP_SCALE >= doorShift:
+						rayX = doorX
+						rayY = rayY + yOffset / 2
+						texShiftY = doorShift
+						dof = dofMax
+						mapBlockHitY = mapCells[mapArrayPosition]
+						continue
+				# Ray passed the door: check successive horizontal line
+				rayX = rayX + xOffset
+				rayY = rayY + yOffset
+				dof = dof + 1
+			else:
+				# Didn't hit the wall: check successive horizontal line
+				rayX = rayX + xOffset
+				rayY = rayY + yOffset
+				dof = dof + 1
+
+		# Save horyzontal probe rays for later comparison with vertical
+		horizRayX = rayX
+		horizRayY = rayY
+
+		# Check vertical lines
+		dof = 0 # Depth of field
+		nTan = -math.tan(rayAngle)
+		xOffset = 0
+		yOffset = 0
+		if rayAngle == math.pi * 0.5 or rayAngle == math.pi * 1.5:
+			# Looking up or down (ray will never intersect vertical lines)
+			rayX = playerX
+			rayY = playerY + dofMax * MAP_SCALE
+			dof = dofMax	# Set depth of field to maximum to avoid unneeded checks
+		elif rayAngle > math.pi * 0.5 and rayAngle < math.pi * 1.5:
+			# Looking left
+			rayX = (int(playerX / MAP_SCALE) * MAP_SCALE) - 0.00001
+			rayY = (playerX - rayX) * nTan + playerY
+			xOffset = -MAP_SCALE
+			yOffset = -xOffset * nTan
+		else:
+			# Looking right
+			rayX = (int(playerX / MAP_SCALE) * MAP_SCALE) + MAP_SCALE
+			rayY = (playerX - rayX) * nTan + playerY
+			xOffset = MAP_SCALE
+			yOffset = -xOffset * nTan
+
+		# Check if we reached a wall
+		while dof < dofMax:
+			mapX = int(rayX / MAP_SCALE)
+			mapY = int(rayY / MAP_SCALE)
+			mapArrayPosition = mapY * mapSize + mapX
+			if mapArrayPosition >= 0 and mapArrayPosition < cellsCount-1 and mapCells[mapArrayPosition] != 0:
+				door = None
+				if doors is not None and mapCells[mapArrayPosition] == MAP_DOOR_CELL_TYPE:
+					door = doors.get(mapArrayPosition)
+				if door is None:
+					dof = dofMax	# Hit the wall: we are done, no need to do other checks
+					mapBlockHitX = mapCells[mapArrayPosition]	# Save which map wall tile we reached
+					continue
+				if door.vertical:
+					# Door plane is half a step further: check if the ray reaches it inside the cell, where the door still covers it
+					doorY = rayY + yOffset / 2
+					doorShift = door.openFraction * MAP_SCALE
+					if int(doorY / MAP_SCALE) == mapY and doorY % MAP_SCALE >= doorShift:
+						rayX = rayX + xOffset / 2
+						rayY = doorY
+						texShiftX = doorShift
+						dof = dofMax
+						mapBlockHitX = mapCells[mapArrayPosition]
+						continue
+				# Ray passed the door: check successive vertical line
+				rayX = rayX + xOffset
+				rayY = rayY + yOffset
+				dof = dof + 1
+			else:
+				# Didn't hit the wall: check successive horizontal line
+				rayX = rayX + xOffset
+				rayY = rayY + yOffset
+				dof = dof + 1
+
+		horizDist = math.sqrt((horizRayX-playerX)*(horizRayX-playerX) + (horizRayY-playerY)*(horizRayY-playerY))
+		vertDist = math.sqrt((rayX-playerX)*(rayX-playerX) + (rayY-playerY)*(rayY-playerY))
+		if vertDist > horizDist:
+			# Horizontal wall is nearer: texture column depends on X, and wall is shaded
+			texColumn = int((horizRayX - texShiftY) / (MAP_SCALE / TEXTURE_SIZE) % TEXTURE_SIZE)
+			return horizDist, horizRayX, horizRayY, mapBlockHitY, texColumn, True
+		texColumn = int((rayY - texShiftX) / (MAP_SCALE / TEXTURE_SIZE) % TEXTURE_SIZE)
+		return vertDist, rayX, rayY, mapBlockHitX, texColumn, False
+
+	def castColumns(self, playerX, playerY, playerAngle, columns, doors=None, maxDof=None, spanColumns=RAYCAST_SPAN_COLUMNS, firstColumn=0, columnsCount=None):
+		# Casts the rays of the screen columns, from -0,5 rads to +0,5 rads (about 60° viewing angle).
+		# Returns a list with the castRay() result of every column (or of columnsCount columns
+		# starting from firstColumn, if given).
+		# Adjacent columns nearly always hit the same face of the same tile, so rays are fully cast
+		# only every spanColumns columns: if the rays at both ends of a span hit the same face, the
+		# columns between them are intersected directly with that face (see intersectFace(): the
+		# hits are the same as casting), otherwise the span is split in two and its middle column
+		# is cast. A face is one side of one tile: a solid tile in front of it can't fit between
+		# two rays reaching it without blocking one of them, so solid tiles are never missed.
+		# Partly open doors may be: the rays between two rays passing through a door's gap (or
+		# by its side) may hit its panel.
+		if columnsCount is None:
+			columnsCount = columns
+		angles = []
+		for i in range(firstColumn, firstColumn + columnsCount):
+			rayAngle = playerAngle + (i/columns) - 0.5
+			if rayAngle < 0:
+				rayAngle = math.pi * 2 + rayAngle
+			if rayAngle > math.pi * 2:
+				rayAngle = rayAngle - math.pi * 2
+			angles.append(rayAngle)
+
+		castRay = self.castRay
+		hits = [None] * columnsCount
+		if spanColumns <= 1:
+			for i in range(columnsCount):
+				hits[i] = castRay(playerX, playerY, angles[i], doors, maxDof)
+			return hits
+
+		last = columnsCount - 1
+		spans = []
+		for start in range(0, columnsCount, spanColumns):
+			end = min(start + spanColumns, last)
+			hits[start] = castRay(playerX, playerY, angles[start], doors, maxDof)
+			if end > start:
+				spans.append((start, end))
+		hits[last] = castRay(playerX, playerY, angles[last], doors, maxDof)
+
+		while spans:
+			start, end = spans.pop()
+			if end - start < 2:
+				continue
+			face = self.hitFace(hits[start], doors)
+			if face is not None and face == self.hitFace(hits[end], doors):
+				faceHit = hits[start]
+				for i in range(start + 1, end):
+					hits[i] = self.intersectFace(playerX, playerY, angles[i], faceHit) or castRay(playerX, playerY, angles[i], doors, maxDof)
+			else:
+				middle = (start + end) // 2
+				hits[middle] = castRay(playerX, playerY, angles[middle], doors, maxDof)
+				spans.append((start, middle))
+				spans.append((middle, end))
+		return hits
+
+	def hitFace(self, hit, doors=None):
+		# The wall face hit by a castRay() result, as (map array position, shading), or None
+		# if the ray hit nothing or a door (doors are not flat faces: they slide and have gaps)
+		hitTile = hit[3]
+		if hitTile == 0 or (doors is not None and hitTile == MAP_DOOR_CELL_TYPE):
+			return None
+		return int(hit[2] / MAP_SCALE) * self.size + int(hit[1] / MAP_SCALE), hit[5]
+
+	def intersectFace(self, playerX, playerY, rayAngle, faceHit):
+		# Like castRay(), but intersects the ray with the wall face hit by faceHit (a castRay()
+		# result) instead of traversing the map. The ray steps from grid line to grid line exactly
+		# like castRay() does (only without looking at the map), so the hit is the one castRay()
+		# finds when the ray reaches the same face: same rounding, same distance.
+		# Returns None for rays parallel to the face, which castRay() must cast
+		dist, hitX, hitY, hitTile, texColumn, shading = faceHit
+		if shading:
+			# Horizontal face: same as the horizontal lines check in castRay()
+			if rayAngle == 0 or rayAngle == math.pi:
+				return None
+			aTan = -1/math.tan(rayAngle)
+			if rayAngle > math.pi:
+				rayY = (int(playerY / MAP_SCALE) * MAP_SCALE) - 0.00001
+				yOffset = -MAP_SCALE
+			else:
+				rayY = (int(playerY / MAP_SCALE) * MAP_SCALE) + MAP_SCALE
+				yOffset = MAP_SCALE
+			rayX = (playerY - rayY) * aTan + playerX
+			xOffset = -yOffset * aTan
+			for step in range(round((hitY - rayY) / yOffset)):
+				rayX = rayX + xOffset
+				rayY = rayY + yOffset
+			texColumn = int(rayX / (MAP_SCALE / TEXTURE_SIZE) % TEXTURE_SIZE)
+		else:
+			# Vertical face: same as the vertical lines check in castRay()
+			if rayAngle == math.pi * 0.5 or rayAngle == math.pi * 1.5:
+				return None
+			nTan = -math.tan(rayAngle)
+			if rayAngle > math.pi * 0.5 and rayAngle < math.pi * 1.5:
+				rayX = (int(playerX / MAP_SCALE) * MAP_SCALE) - 0.00001
+				xOffset = -MAP_SCALE
+			else:
+				rayX = (int(playerX / MAP_SCALE) * MAP_SCALE) + MAP_SCALE
+				xOffset = MAP_SCALE
+			rayY = (playerX - rayX) * nTan + playerY
+			yOffset = -xOffset * nTan
+			for step in range(round((hitX - rayX) / xOffset)):
+				rayX = rayX + xOffset
+				rayY = rayY + yOffset
+			texColumn = int(rayY / (MAP_SCALE / TEXTURE_SIZE) % TEXTURE_SIZE)
+		dist = math.sqrt((rayX-playerX)*(rayX-playerX) + (rayY-playerY)*(rayY-playerY))
+		return dist, rayX, rayY, hitTile, texColumn, shading
+
+class ColumnCache:
+	# The per-column hits of the previous frame, reused when the camera only rotated.
+	# Turning moves the camera by a whole number of columns (PLAYER_ROTATION_SPEED is 25 columns
+	# at the default resolution): hits are then shifted sideways, and only the newly exposed
+	# columns are cast. Hits are keyed by position and by map version, so moving or a map change
+	# casts all the columns again. A door moving casts again only the columns whose rays cross
+	# its cell.
+	__slots__ = ("key", "angle", "hits", "doorsVersion")
 
 	def __init__(self):
+		self.key = None
+		self.angle = 0.0
+		self.hits = None
+		self.doorsVersion = 0
+
+	def castColumns(self, tileMap, camera, columns, doors=None, maxDof=None, spanColumns=RAYCAST_SPAN_COLUMNS):
+		# Same as TileMap.castColumns() from camera
+		key = (camera.x, camera.y, columns, tileMap.version, doors, maxDof, spanColumns)
+		shift = None
+		if key == self.key:
+			turn = (camera.r - self.angle) * columns
+			shift = round(turn)
+			if abs(turn - shift) > 0.000001 or abs(shift) >= columns:
+				# Not a whole number of columns (e.g. the angle wrapped around), or nothing to reuse
+				shift = None
+
+		if shift is None:
+			hits = tileMap.castColumns(camera.x, camera.y, camera.r, columns, doors, maxDof, spanColumns)
+		else:
+			if shift > 0:
+				# Turned right: columns move left, new ones appear on the right
+				hits = self.hits[shift:] + tileMap.castColumns(camera.x, camera.y, camera.r, columns, doors, maxDof, spanColumns, columns - shift, shift)
+			elif shift < 0:
+				# Turned left: columns move right, new ones appear on the left
+				hits = tileMap.castColumns(camera.x, camera.y, camera.r, columns, doors, maxDof, spanColumns, 0, -shift) + self.hits[:shift]
+			else:
+				hits = list(self.hits)
+			if doors is not None and doors.version != self.doorsVersion:
+				self.castDoorColumns(tileMap, camera, columns, doors, maxDof, spanColumns, hits)
+
+		self.key = key
+		self.angle = camera.r
+		self.hits = hits
+		self.doorsVersion = doors.version if doors is not None else 0
+		return hits
+
+	def castDoorColumns(self, tileMap, camera, columns, doors, maxDof, spanColumns, hits):
+		# Casts again (into hits) the columns whose rays cross the cells of the doors moved since
+		# the last frame
+		recast = bytearray(columns)
+		for mapArrayPosition in doors.changedCells(self.doorsVersion):
+			first, end = ColumnCache.cellColumns(tileMap.size, camera, columns, mapArrayPosition)
+			recast[first:end] = b"\x01" * (end - first)
+		column = 0
+		while column < columns:
+			if not recast[column]:
+				column = column + 1
+				continue
+			end = column
+			while end < columns and recast[end]:
+				end = end + 1
+			hits[column:end] = tileMap.castColumns(camera.x, camera.y, camera.r, columns, doors, maxDof, spanColumns, column, end - column)
+			column = end
+
+	@staticmethod
+	def cellColumns(mapSize, camera, columns, mapArrayPosition):
+		# The columns whose rays may cross a map cell, as a (first, end) range (empty if none)
+		mapY, mapX = divmod(mapArrayPosition, mapSize)
+		if abs(int(camera.x / MAP_SCALE) - mapX) <= 1 and abs(int(camera.y / MAP_SCALE) - mapY) <= 1:
+			return 0, columns	# The camera is in the cell or next to it: the cell may cover any angle
+		# The cell is at least a cell away, so it covers less than pi/2: its corners are measured
+		# from its middle, in -pi..pi from the middle of the view
+		middleAngle = math.atan2((mapY + 0.5) * MAP_SCALE - camera.y, (mapX + 0.5) * MAP_SCALE - camera.x)
+		middleOffset = (middleAngle - camera.r + math.pi) % (math.pi * 2) - math.pi
+		offsets = []
+		for cornerX, cornerY in ((mapX, mapY), (mapX + 1, mapY), (mapX, mapY + 1), (mapX + 1, mapY + 1)):
+			angle = math.atan2(cornerY * MAP_SCALE - camera.y, cornerX * MAP_SCALE - camera.x)
+			offsets.append(middleOffset + (angle - middleAngle + math.pi) % (math.pi * 2) - math.pi)
+		# Column i casts at i / columns - 0.5 from the middle of the view; one more column on both
+		# sides for the rays grazing the corners
+		first = max(0, int(math.floor((min(offsets) + 0.5) * columns)) - 1)
+		end = min(columns, int(math.ceil((max(offsets) + 0.5) * columns)) + 2)
+		return first, max(first, end)
+
+class TextureStore:
+	# All the textures packed one after another in a single array of 0x00RRGGBB ints,
+	# with a shaded copy (for horizontal walls), texture n starting at n * TEXTURE_SIZE * TEXTURE_SIZE
+	__slots__ = ("count", "texels", "shadedTexels")
+
+	def __init__(self, textures):
+		self.count = len(textures)
+		self.texels = array('I')
+		for texture in textures:
+			if len(texture) != TEXTURE_SIZE * TEXTURE_SIZE:
+				raise ValueError("Texture has {} texels, but should have {}".format(len(texture), TEXTURE_SIZE * TEXTURE_SIZE))
+			self.texels.extend(texture)
+		self.shadedTexels = array('I', [TextureStore.shade(color) for color in self.texels])
+
+	@staticmethod
+	def load(texFiles=TEXTURES, baseDir=""):
+		return TextureStore([TextureStore.loadTexture(os.path.join(baseDir, texFile)) for texFile in texFiles])
+
+	def textureBase(self, hitTile):
+		# Index of the first texel of the texture covering the given map tile
+		# (0 is no texture, 1 is texture 0 etc; tile 0 gets the last texture)
+		return ((hitTile - 1) % self.count) * TEXTURE_SIZE * TEXTURE_SIZE
+
+	@staticmethod
+	def shade(color):
+		# Obtain channels
+		b = color & 0b000000000000000011111111
+		g = color >> 8 & 0b000000000000000011111111
+		r = color >> 16 & 0b000000000000000011111111
+		# Dim channels (and limit to 255, because python doesn't have a fixed byte length)
+		b = (b >> 1)
+		g = (g >> 1)
+		r = (r >> 1)
+		# Compose color
+		return b + (g << 8) + (r << 16)
+
+	@staticmethod
+	def loadTexture(pngFilePath):
+		# Loads a texture from png file and converts to sdl2-friendly format
+		reader = png.Reader(filename=pngFilePath)
+		w, h, pixels, metadata = reader.read_flat()
+		if w != TEXTURE_SIZE or h != TEXTURE_SIZE:
+			raise ValueError("Texture {} is not {}x{}, but {}x{}".format(pngFilePath, TEXTURE_SIZE, TEXTURE_SIZE, w, h))
+		color_length = 3 # RGB
+		if metadata['alpha']:
+			color_length = 4 # RGBA (but alpha is ignored)
+		# Convert to sdl2-friendly format
+		converted = array('I')
+		for i in range(0, len(pixels), color_length):
+			# PNG is RGB, SDL surface is BGR
+			converted.append(pixels[i+2] + (pixels[i+1] << 8) + (pixels[i] << 16)) # BGR
+		return converted
+
+def gameTick(tileMap, player, doors, up, down, left, right, use, elapsedTime):
+	# One tick of game logic, shared by the game loop and by replays: doors move by elapsedTime
+	# seconds, then the player moves and uses doors. Returns True if a door was opened
+	doors.update(elapsedTime, tileMap.cellsUnderBox(player.x, player.y, player.radius))
+	player.step(tileMap, up, down, left, right, doors)
+	if use:
+		return player.openDoor(tileMap, doors)[1]
+	return False
+
+class Main:
+
+	def __init__(self, recordingFilePath=None, exportName=None, connectAddress=None, allocProfile=None, latency=None, latencyProbePresses=None, jit=RAYCAST_JIT):
 		# Print instructions
 		print('RAYCASTER by penguin86\n\nMovement: up, down, left, right\nOpen door: space\n\nFPS:')
 
-		# Check valid map
-		if len(MAP) != MAP_SIZE * MAP_SIZE:
-			raise ValueError("Map size is {}, but should be a power of {}".format(len(MAP), MAP_SIZE))
+		# Map (checks it is valid)
+		self.tileMap = TileMap(MAP, MAP_SIZE)
 
 		# Load textures
-		self.textures = []
-		for texFile in TEXTURES:
-			self.textures.append(self.loadTexture(texFile))
+		self.textures = TextureStore.load(TEXTURES)
 
 		# Graphics
 		sdl2.ext.init()
@@ -120,21 +721,118 @@ class Main:
 			self.mapWindow.show()
 			self.mapSurface = self.mapWindow.get_surface()
 
-		self.raycastWindow = sdl2.SDL_CreateWindow(b"3D View", 100, 100, RAYCAST_WIN_WIDTH, RAYCAST_WIN_HEIGHT,sdl2.SDL_WINDOW_SHOWN)
-		self.raycastRenderer = sdl2.SDL_CreateRenderer(self.raycastWindow, -1,sdl2.SDL_RENDERER_ACCELERATED |sdl2.SDL_RENDERER_PRESENTVSYNC)
-		self.raycastSurface = sdl2.SDL_CreateRGBSurface(0,RAYCAST_WIN_WIDTH,RAYCAST_WIN_HEIGHT,32,0,0,0,0)
+		self.raycastWindow = sdl2.SDL_CreateWindow(b"3D View", 100, 100, RAYCAST_WIN_WIDTH, RAYCAST_WIN_HEIGHT,sdl2.SDL_WINDOW_SHOWN | sdl2.SDL_WINDOW_RESIZABLE)
+		self.raycastRenderer = sdl2.SDL_CreateRenderer(self.raycastWindow, -1,sdl2.SDL_RENDERER_ACCELERATED | (sdl2.SDL_RENDERER_PRESENTVSYNC if RAYCAST_VSYNC else 0))
+		if not self.raycastRenderer:
+			# No GPU (e.g. SDL_VIDEODRIVER=dummy)
+			self.raycastRenderer = sdl2.SDL_CreateRenderer(self.raycastWindow, -1, sdl2.SDL_RENDERER_SOFTWARE)
+
+		# Render target: the frame is drawn at the internal resolution into this texture, which is
+		# then scaled to the window when presenting. The logical size keeps the aspect ratio at any
+		# window size (adding black bars), so drawing cost depends on the internal resolution only
+		sdl2.SDL_SetHint(sdl2.SDL_HINT_RENDER_SCALE_QUALITY, RAYCAST_SCALE_QUALITY)
+		self.renderTarget = sdl2.SDL_CreateTexture(self.raycastRenderer, sdl2.SDL_PIXELFORMAT_ARGB8888, sdl2.SDL_TEXTUREACCESS_TARGET, RAYCAST_RENDER_WIDTH, RAYCAST_RENDER_HEIGHT)
+		if not self.renderTarget:
+			raise RuntimeError("Unable to create the render target: {}".format(sdl2.SDL_GetError().decode()))
+		sdl2.SDL_RenderSetLogicalSize(self.raycastRenderer, RAYCAST_RENDER_WIDTH, RAYCAST_RENDER_HEIGHT)
+		if not RAYCAST_INDEXED_COLOR:
+			self.raycastSurface = sdl2.SDL_CreateRGBSurface(0,RAYCAST_WIN_WIDTH,RAYCAST_WIN_HEIGHT,32,0,0,0,0)
+
+		# Doors
+		self.doors = DoorRegistry(self.tileMap.cells, MAP_SIZE, MAP_DOOR_CELL_TYPE)
+
+		# Potentially visible sets (None if not available: rays are then limited by DOF only)
+		self.pvs = loadOrComputeVisibility(self.tileMap.cells, MAP_SIZE, MAP_DOOR_CELL_TYPE, PVS_FILE)
 
 		# Player
-		self.player_position = {"x": int(MAP_SCALE * PLAYER_SPAWN_POSITION["x"]), "y": int(MAP_SCALE * PLAYER_SPAWN_POSITION["y"]), "r": PLAYER_SPAWN_POSITION["r"]}	# r is rotation in radiants
+		self.player = Player.spawn()
+		self.columnCache = ColumnCache()
+		self.rectBatch = RectBatch()	# Wall segments of the frame, see drawRays()
+
+		# Indexed color: frames are rendered by a SoftRenderer into an 8 bit surface, and converted
+		# through the palette only when uploaded to the render target
+		self.indexedRenderer = None
+		if RAYCAST_INDEXED_COLOR:
+			from palette import IndexedTextureStore
+			from softrender import SoftRenderer
+			self.indexedRenderer = SoftRenderer(IndexedTextureStore(self.textures), self.tileMap, doors=self.doors, pvs=self.pvs)
+			self.columnCache = self.indexedRenderer.columnCache
+			self.raycastSurface = sdl2.SDL_CreateRGBSurfaceWithFormat(0, RAYCAST_RENDER_WIDTH, RAYCAST_RENDER_HEIGHT, 8, sdl2.SDL_PIXELFORMAT_INDEX8)
+			palette = self.indexedRenderer.palette
+			paletteColors = (sdl2.SDL_Color * len(palette.colors))(*[sdl2.SDL_Color(color >> 16 & 0xff, color >> 8 & 0xff, color & 0xff, 255) for color in palette.colors])
+			sdl2.SDL_SetPaletteColors(self.raycastSurface.contents.format.contents.palette, paletteColors, 0, len(palette.colors))
+
+		# Baked lighting (see lighting.py): the textures lit at every light level
+		self.lightMaps = None
+		if LIGHTING and not RAYCAST_INDEXED_COLOR:
+			from lighting import LightMaps, litTexels
+			self.lightMaps = LightMaps(self.tileMap, LIGHTS, self.doors)
+			self.litTexels = litTexels(self.textures)
+
+		# JIT compiled renderer (see jitrender.py): frames are rendered into a 32 bit surface, without
+		# alpha (frames have it 0, that would make them transparent). Without Numba, frames are drawn
+		# by drawRays() itself
+		self.jitRenderer = None
+		if jit and not RAYCAST_INDEXED_COLOR:
+			from jitrender import JitRenderer, JIT_AVAILABLE
+			if JIT_AVAILABLE:
+				self.jitRenderer = JitRenderer(self.textures, self.tileMap, doors=self.doors, pvs=self.pvs, lightMaps=self.lightMaps)
+				self.raycastSurface = sdl2.SDL_CreateRGBSurfaceWithFormat(0, RAYCAST_RENDER_WIDTH, RAYCAST_RENDER_HEIGHT, 32, sdl2.SDL_PIXELFORMAT_RGB888)
+
+		# Input recording (see replay.py)
+		self.recordingFilePath = recordingFilePath
+		self.recording = None
+		if recordingFilePath:
+			self.recording = InputRecording.start(self.tileMap, self.player)
+
+		# Shared memory frame export (see frameexport.py)
+		self.exporter = None
+		if exportName:
+			self.exporter = FrameExporter(exportName, RAYCAST_RENDER_WIDTH, RAYCAST_RENDER_HEIGHT)
+
+		# Multiplayer (see netsync.py): the server moves the player and the doors
+		self.netClient = None
+		if connectAddress:
+			if recordingFilePath:
+				raise ValueError("Input can't be recorded while playing on a server")
+			from netsync import NetClient
+			self.netClient = NetClient(connectAddress)
+
+		# Allocation profiling (see allocprofile.py): allocProfile is the CSV file path, or "" for
+		# the report only
+		self.allocProfiler = None
+		if allocProfile is not None:
+			from allocprofile import AllocationProfiler
+			self.allocProfiler = AllocationProfiler(allocProfile)
+			self.allocProfiler.start()
+
+		# Input latency measurement (see latency.py): latency is the CSV file path, or "" for the
+		# report only. The probe presses the rotate left key by itself, and quits when done
+		self.latency = None
+		self.latencyProbe = None
+		if latency is not None or latencyProbePresses:
+			from latency import LatencyTracker, LatencyProbe
+			self.latency = LatencyTracker(latency)
+			if latencyProbePresses:
+				self.latencyProbe = LatencyProbe(latencyProbePresses)
 
 		return
 
 	def run(self):
 		lastFpsCalcTime = 0
 		frames = 0
+		lastFrameTime = time.time()
 
 		running = True
 		while running:
+			frameTime = time.time()
+			# Elapsed time is rounded to milliseconds, like in recordings, so replays match exactly
+			elapsedMs = min(int(round((frameTime - lastFrameTime) * 1000)), RECORDING_MAX_TICK_MS)
+			lastFrameTime = frameTime
+			if self.allocProfiler is not None:
+				self.allocProfiler.beginFrame()
+			self.profileStage("input")
+
 			events = sdl2.ext.get_events()
 			for event in events:
 				if event.type == sdl2.SDL_QUIT or (event.type == sdl2.SDL_KEYDOWN and event.key.keysym.sym == sdl2.SDLK_ESCAPE):
@@ -142,44 +840,41 @@ class Main:
 					break
 
 			keystate = sdl2.SDL_GetKeyboardState(None)
-			# Rotate player
-			if keystate[sdl2.SDL_SCANCODE_LEFT]:
-				self.player_position["r"] = self.player_position["r"] - PLAYER_ROTATION_SPEED
-			elif keystate[sdl2.SDL_SCANCODE_RIGHT]:
-				self.player_position["r"] = self.player_position["r"] + PLAYER_ROTATION_SPEED
-
-			# Compute deltax and deltay based on player direction
-			player_delta_x = (math.cos(self.player_position["r"]) * PLAYER_SPEED) + 1 # "+ 1": Adjust for rounding errors
-			player_delta_y = math.sin(self.player_position["r"]) * PLAYER_SPEED
-
-			# Move player based on its direction
-			if keystate[sdl2.SDL_SCANCODE_UP]:
-				self.movePlayerRelative(player_delta_x, player_delta_y)
-			elif keystate[sdl2.SDL_SCANCODE_DOWN]:
-				self.movePlayerRelative(-player_delta_x, -player_delta_y)
-
-			# Limit position into dungeon bounds
-			if self.player_position["x"] < 0:
-				self.player_position["x"] = 0
-			if self.player_position["x"] > MAP_WIN_WIDTH:
-				self.player_position["x"] = MAP_WIN_WIDTH
-			if self.player_position["y"] < 0:
-				self.player_position["y"] = 0
-			if self.player_position["y"] > MAP_WIN_HEIGHT:
-				self.player_position["y"] = MAP_WIN_HEIGHT
-			if self.player_position["r"] > 2*math.pi:
-				self.player_position["r"] = 0
-			if self.player_position["r"] < 0:
-				self.player_position["r"] = 2*math.pi
-
-			# Open doors
-			if keystate[sdl2.SDL_SCANCODE_SPACE]:
-				self.openDoor()
+			up = keystate[sdl2.SDL_SCANCODE_UP]
+			down = keystate[sdl2.SDL_SCANCODE_DOWN]
+			left = keystate[sdl2.SDL_SCANCODE_LEFT]
+			right = keystate[sdl2.SDL_SCANCODE_RIGHT]
+			use = keystate[sdl2.SDL_SCANCODE_SPACE]
+			if self.latency is not None:
+				self.latency.inputSampled(events)
+			if self.latencyProbe is not None:
+				left = left or self.latencyProbe.keyDown()
+			if self.netClient is not None:
+				# Send the keys, show where the server moved everything
+				self.netClient.sendInput(up, down, left, right, use)
+				if self.netClient.poll():
+					self.netClient.applyTo(self.player, self.doors)
+			else:
+				# Move doors, rotate and move player, open doors
+				doorOpened = gameTick(self.tileMap, self.player, self.doors, up, down, left, right, use, elapsedMs / 1000)
+				if self.recording is not None:
+					self.recording.record(up, down, left, right, use, elapsedMs, doorOpened)
+			if self.latency is not None:
+				self.latency.stageDone("tick")
 
 			self.draw()
 			if not MAP_HIDDEN:
 				self.mapWindow.refresh()
 			#self.raycastWindow.refresh()
+			if self.allocProfiler is not None:
+				self.allocProfiler.endFrame()
+			if self.latency is not None:
+				self.latency.presented()
+			if self.latencyProbe is not None:
+				presentTime = time.perf_counter()
+				self.latencyProbe.framePresented(self.readFrameHash, presentTime)
+				if self.latencyProbe.done():
+					running = False
 
 			# Calculate FPS
 			frames = frames + 1
@@ -189,169 +884,122 @@ class Main:
 				frames = 0
 				lastFpsCalcTime = time.time()
 
+		if self.recording is not None:
+			self.recording.save(self.recordingFilePath)
+			print("Recorded {} ticks to {}".format(len(self.recording.ticks), self.recordingFilePath))
+		if self.exporter is not None:
+			print("Exported {} frames, {} dropped".format(self.exporter.frameNumber, self.exporter.droppedFrames))
+			self.exporter.close()
+		if self.netClient is not None:
+			self.netClient.close()
+		if self.allocProfiler is not None:
+			self.allocProfiler.stop()
+			self.allocProfiler.report()
+		if self.latency is not None:
+			self.latency.report(self.latencyProbe)
+
 		return 0
 
 	def movePlayerRelative(self, player_delta_x, player_delta_y):
-		# Prevent player from going into walls (X axis)
-		newPlayerX = int(self.player_position["x"] + player_delta_x)
-		mapX = int(newPlayerX / MAP_SCALE)
-		mapY = int(self.player_position["y"] / MAP_SCALE)
-		mapArrayPosition = mapY * MAP_SIZE + mapX
-		if mapArrayPosition >= 0 and mapArrayPosition < MAP_SIZE*MAP_SIZE-1 and MAP[mapArrayPosition] == 0:
-			# Move player (X)
-			self.player_position["x"] = newPlayerX
-
-		# Prevent player from going into walls (Y axis)
-		newPlayerY = int(self.player_position["y"] + player_delta_y)
-		mapX = int(self.player_position["x"] / MAP_SCALE)
-		mapY = int(newPlayerY / MAP_SCALE)
-		mapArrayPosition = mapY * MAP_SIZE + mapX
-		if mapArrayPosition >= 0 and mapArrayPosition < MAP_SIZE*MAP_SIZE-1 and MAP[mapArrayPosition] == 0:
-			# Move player (Y)
-			self.player_position["y"] = newPlayerY
+		self.player.moveRelative(self.tileMap, player_delta_x, player_delta_y, self.doors)
 
 	def draw(self):
 		if not MAP_HIDDEN:
+			self.profileStage("map")
 			self.draw2Dmap()
 			self.drawPlayer()
 
+		self.profileStage("rays")
 		self.drawRays()
+		if self.latency is not None:
+			self.latency.stageDone("rays")
+		if self.exporter is not None:
+			self.profileStage("export")
+			self.exportFrame()
+		self.profileStage("present")
+		self.present()
+
+	def profileStage(self, name):
+		# Starts a frame stage, when profiling allocations
+		if self.allocProfiler is not None:
+			self.allocProfiler.stage(name)
+
+	def present(self):
+		# Scales the frame drawn by drawRays() to the window
+		sdl2.SDL_SetRenderTarget(self.raycastRenderer, None)
+		sdl2.SDL_SetRenderDrawColor(self.raycastRenderer, 0, 0, 0, sdl2.SDL_ALPHA_OPAQUE)
+		sdl2.SDL_RenderClear(self.raycastRenderer)
+		sdl2.SDL_RenderCopy(self.raycastRenderer, self.renderTarget, None, None)
 		sdl2.SDL_RenderPresent(self.raycastRenderer)
 
+	def readFrameHash(self):
+		# Hash of the last frame, read back from the render target
+		sdl2.SDL_SetRenderTarget(self.raycastRenderer, self.renderTarget)
+		frameHash = readRendererHash(self.raycastRenderer, RAYCAST_RENDER_WIDTH, RAYCAST_RENDER_HEIGHT)
+		sdl2.SDL_SetRenderTarget(self.raycastRenderer, None)
+		return frameHash
+
 	def drawPlayer(self):
 		# Player in 2D map
-		sdl2.ext.draw.fill(self.mapSurface, sdl2.ext.Color(0,255,0,255), (self.player_position["x"] - 2, self.player_position["y"] - 2, 4, 4))
+		player = self.player
+		sdl2.ext.draw.fill(self.mapSurface, sdl2.ext.Color(0,255,0,255), (player.x - 2, player.y - 2, 4, 4))
 		# Player line of sight in 2D map
-		ray = {
-			"x": int(self.player_position["x"] + math.cos(self.player_position["r"]) * 50), # deltaX + playerX
-			"y": int(self.player_position["y"] + math.sin(self.player_position["r"]) * 50)  # deltaY + playerY
-		}
-		sdl2.ext.draw.line(self.mapSurface, sdl2.ext.Color(255,0,0,255), (self.player_position["x"], self.player_position["y"], ray["x"], ray["y"]))
+		rayX = int(player.x + math.cos(player.r) * 50) # deltaX + playerX
+		rayY = int(player.y + math.sin(player.r) * 50) # deltaY + playerY
+		sdl2.ext.draw.line(self.mapSurface, sdl2.ext.Color(255,0,0,255), (player.x, player.y, rayX, rayY))
 
 
 	def draw2Dmap(self):
 		# 2D map
 		sdl2.ext.draw.fill(self.mapSurface, sdl2.ext.Color(0,0,0,255)) # Clears map screen
-		for i in range(len(MAP)):
+		for i in range(len(self.tileMap.cells)):
 			posX = i % MAP_SIZE * MAP_SCALE
 			posY = math.floor(i / MAP_SIZE) * MAP_SCALE
 			color = 0
-			if MAP[i] > 0:
+			if self.tileMap.cells[i] > 0:
 				color = 255
 			sdl2.ext.draw.fill(self.mapSurface, sdl2.ext.Color(color,color,color,255), (posX, posY, MAP_SCALE - 1, MAP_SCALE - 1))
 
 	def drawRays(self):
+		# Draws the frame into the render target, at the internal resolution
+		sdl2.SDL_SetRenderTarget(self.raycastRenderer, self.renderTarget)
+		if self.indexedRenderer is not None:
+			self.drawFramebuffer(self.indexedRenderer)
+			return
+		if self.jitRenderer is not None:
+			self.drawFramebuffer(self.jitRenderer)
+			return
+
 		# Ceiling
 		sdl2.SDL_SetRenderDrawColor(self.raycastRenderer, CEILING_COLOR[0], CEILING_COLOR[1], CEILING_COLOR[2], sdl2.SDL_ALPHA_OPAQUE)
 		sdl2.SDL_RenderClear(self.raycastRenderer)
 		# Floor
 		sdl2.SDL_SetRenderDrawColor(self.raycastRenderer, FLOOR_COLOR[0], FLOOR_COLOR[1], FLOOR_COLOR[2], sdl2.SDL_ALPHA_OPAQUE)
-		sdl2.SDL_RenderFillRect(self.raycastRenderer, sdl2.SDL_Rect(0, int(RAYCAST_WIN_HEIGHT/2), RAYCAST_WIN_WIDTH, int(RAYCAST_WIN_HEIGHT)))
+		sdl2.SDL_RenderFillRect(self.raycastRenderer, sdl2.SDL_Rect(0, int(RAYCAST_RENDER_HEIGHT/2), RAYCAST_RENDER_WIDTH, int(RAYCAST_RENDER_HEIGHT)))
 
 		# Casts rays for raycasting
-		playerAngle = self.player_position["r"]
-
-		# Cast one ray for every window pixel, from -0,5 rads to +0,5 rads (about 60° viewing angle)
+		player = self.player
+		playerX = player.x
+		playerY = player.y
+		textures = self.textures
+		lightMaps = self.lightMaps
+		if lightMaps is not None:
+			lightMaps.update()	# Doors may have changed the light
+		maxDof = DOF
+		if self.pvs is not None:
+			# Rays don't need to go farther than the farthest cell visible from here
+			maxDof = self.pvs.maxDof(player.mapArrayPosition(MAP_SIZE))
+
+		rectBatch = self.rectBatch
+
+		# Cast one ray for every window pixel
+		hits = self.columnCache.castColumns(self.tileMap, player, RAYCAST_RENDER_WIDTH, self.doors, maxDof)
 		for i in range(RAYCAST_RENDER_WIDTH):
-			rayAngle = playerAngle + (i/RAYCAST_RENDER_WIDTH) - 0.5
-			if rayAngle < 0:
-				rayAngle = math.pi * 2 + rayAngle
-			if rayAngle > math.pi * 2:
-				rayAngle = rayAngle - math.pi * 2
-
-			# Which map wall tiles have been hit by rayX and rayY
-			mapBlockHitX = 0
-			mapBlockHitY = 0
-
-			# Check horizontal lines
-			dof = 0 # Depth of field
-			if rayAngle == 0 or rayAngle == math.pi:
-				# Looking left or right (ray will never intersect parallel lines)
-				rayY = self.player_position["y"]
-				rayX = self.player_position["x"] + DOF * MAP_SCALE
-				dof = DOF	# Set depth of field to maximum to avoid unneeded checks
-			elif rayAngle > math.pi:
-				# Looking up
-				aTan = -1/math.tan(rayAngle)
-				rayY = (int(self.player_position["y"] / MAP_SCALE) * MAP_SCALE) - 0.00001
-				rayX = (self.player_position["y"] - rayY) * aTan + self.player_position["x"]
-				yOffset = -MAP_SCALE
-				xOffset = -yOffset * aTan
-			else:
-				# Looking down
-				aTan = -1/math.tan(rayAngle)
-				rayY = (int(self.player_position["y"] / MAP_SCALE) * MAP_SCALE) + MAP_SCALE
-				rayX = (self.player_position["y"] - rayY) * aTan + self.player_position["x"]
-				yOffset = MAP_SCALE
-				xOffset = -yOffset * aTan
-
-			# Check if we reached a wall
-			while dof < DOF:
-				mapX = int(rayX / MAP_SCALE)
-				mapY = int(rayY / MAP_SCALE)
-				mapArrayPosition = mapY * MAP_SIZE + mapX
-				if mapArrayPosition >= 0 and mapArrayPosition < MAP_SIZE*MAP_SIZE and MAP[mapArrayPosition] != 0:
-					dof = DOF	# Hit the wall: we are done, no need to do other checks
-					mapBlockHitY = MAP[mapArrayPosition]	# Save which map wall tile we reached
-				else:
-					# Didn't hit the wall: check successive horizontal line
-					rayX = rayX + xOffset
-					rayY = rayY + yOffset
-					dof = dof + 1
-
-			# Save horyzontal probe rays for later comparison with vertical
-			horizRayX = rayX
-			horizRayY = rayY
-
-			# Check vertical lines
-			dof = 0 # Depth of field
-			nTan = -math.tan(rayAngle)
-			xOffset = 0
-			yOffset = 0
-			if rayAngle == math.pi * 0.5 or rayAngle == math.pi * 1.5:
-			#if rayAngle == 0 or rayAngle == math.pi:
-				# Looking up or down (ray will never intersect vertical lines)
-				rayX = self.player_position["x"]
-				rayY = self.player_position["y"] + DOF * MAP_SCALE
-				dof = DOF	# Set depth of field to maximum to avoid unneeded checks
-			elif rayAngle > math.pi * 0.5 and rayAngle < math.pi * 1.5:
-				# Looking left
-				rayX = (int(self.player_position["x"] / MAP_SCALE) * MAP_SCALE) - 0.00001
-				rayY = (self.player_position["x"] - rayX) * nTan + self.player_position["y"]
-				xOffset = -MAP_SCALE
-				yOffset = -xOffset * nTan
-			else:
-				# Looking right
-				rayX = (int(self.player_position["x"] / MAP_SCALE) * MAP_SCALE) + MAP_SCALE
-				rayY = (self.player_position["x"] - rayX) * nTan + self.player_position["y"]
-				xOffset = MAP_SCALE
-				yOffset = -xOffset * nTan
-
-			# Check if we reached a wall
-			while dof < DOF:
-				mapX = int(rayX / MAP_SCALE)
-				mapY = int(rayY / MAP_SCALE)
-				mapArrayPosition = mapY * MAP_SIZE + mapX
-				if mapArrayPosition >= 0 and mapArrayPosition < MAP_SIZE*MAP_SIZE-1 and MAP[mapArrayPosition] != 0:
-					dof = DOF	# Hit the wall: we are done, no need to do other checks
-					mapBlockHitX = MAP[mapArrayPosition]	# Save which map wall tile we reached
-				else:
-					# Didn't hit the wall: check successive horizontal line
-					rayX = rayX + xOffset
-					rayY = rayY + yOffset
-					dof = dof + 1
-
-			horizDist = self.dist(self.player_position["x"], self.player_position["y"], horizRayX, horizRayY)
-			vertDist = self.dist(self.player_position["x"], self.player_position["y"], rayX, rayY)
-			shortestDist = vertDist
-			if vertDist > horizDist:
-				rayX = horizRayX
-				rayY = horizRayY
-				shortestDist = horizDist
+			shortestDist, rayX, rayY, hitTile, texColumn, shading = hits[i]
 
 			if not MAP_HIDDEN:
 				# Draw rays in 2D view
-				sdl2.ext.draw.line(self.mapSurface, sdl2.ext.Color(0,0,255,255), (self.player_position["x"], self.player_position["y"], rayX, rayY))
+				sdl2.ext.draw.line(self.mapSurface, sdl2.ext.Color(0,0,255,255), (playerX, playerY, rayX, rayY))
 
 
 			# ------ Draw 3D view ------
@@ -361,122 +1009,108 @@ class Main:
 			# Center line vertically in window
 			lineOffset = RAYCAST_RENDER_HEIGHT / 2 - lineHeight / 2
 
-			# Draw pixels vertically from top to bottom to obtain a line
-			textureSegmentEnd = 0
-			for textureColumnPixel in range(0, TEXTURE_SIZE):
-				# Calc texture segment length on screen
-				textureSegmentLength = lineHeight / TEXTURE_SIZE
-				if textureSegmentEnd == 0:
-					# First iteration: calculate segment start
-					textureSegmentStart = lineOffset + textureColumnPixel * textureSegmentLength
-				else:
-					# Next iterations: use the previous segment end (avoids rounding errors)
-					textureSegmentStart = textureSegmentEnd
-				textureSegmentEnd = textureSegmentStart + textureSegmentLength
-				# Obtain texture value in the pixel representing the current segment and calculate shading
-				if vertDist > horizDist:
-					texIndex = mapBlockHitY - 1	# The texture covering the selected map tile (0 is no texture, 1 is texture at self.textures[0] etc)
-					texColumn = int(rayX / (MAP_SCALE / TEXTURE_SIZE) % TEXTURE_SIZE)
-					shading = True
-				else:
-					texIndex = mapBlockHitX - 1	# The texture covering the selected map tile
-					texColumn = int(rayY / (MAP_SCALE / TEXTURE_SIZE) % TEXTURE_SIZE)
-					shading = False
-
-				# Obtain texture pixel color
-				color = self.textures[texIndex][texColumn + textureColumnPixel * TEXTURE_SIZE]
-				# Calculate color resulting from texture pixel value + shading
-				if shading:
-					color = self.shade(color)
-
+			# The texture covering the selected map tile, already lit (or shaded for horizontal walls)
+			if lightMaps is not None:
+				texels = self.litTexels[lightMaps.level(rayX, rayY, texColumn, shading, playerX, playerY)]
+			else:
+				texels = textures.shadedTexels if shading else textures.texels
+			texBase = textures.textureBase(hitTile) + texColumn
+
+			# Draw pixels vertically from top to bottom to obtain a line. Pixel rows are sampled as
+			# SoftRenderer.drawColumn() does: row y gets the texel under its top edge, texel
+			# int((y - lineOffset) * texStep), so texel k starts at the first row at or below
+			# lineOffset + k * textureSegmentLength (moved by a row if rounding disagrees).
+			# Consecutive texels of the same color make a single segment
+			textureSegmentLength = lineHeight / TEXTURE_SIZE
+			texStep = TEXTURE_SIZE / lineHeight
+			lineStart = max(0, int(lineOffset))
+			lineEnd = min(RAYCAST_RENDER_HEIGHT, int(lineOffset + lineHeight))
+			firstTexel = max(0, min(TEXTURE_SIZE - 1, int((lineStart - lineOffset) * texStep)))	# The first row may start above the wall
+			segmentStart = lineStart
+			segmentColor = texels[texBase + firstTexel * TEXTURE_SIZE]
+			for textureColumnPixel in range(firstTexel + 1, TEXTURE_SIZE):
+				texelStart = math.ceil(lineOffset + textureColumnPixel * textureSegmentLength)
+				if int((texelStart - lineOffset) * texStep) < textureColumnPixel:
+					texelStart = texelStart + 1
+				elif int((texelStart - 1 - lineOffset) * texStep) >= textureColumnPixel:
+					texelStart = texelStart - 1
 				# Clipping
-				lineEnd = textureSegmentEnd
-				if lineEnd > RAYCAST_RENDER_HEIGHT:
-					lineEnd = RAYCAST_RENDER_HEIGHT
-				lineStart = textureSegmentStart
-				if lineStart < 0:
-					lineStart = 0
-				if lineEnd < lineStart:
-					continue
-
-				# Draw segment (all is scaled x4)
-
-				b = color & 0b000000000000000011111111
-				g = color >> 8 & 0b000000000000000011111111
-				r = color >> 16 & 0b000000000000000011111111
-				sdl2.SDL_SetRenderDrawColor(self.raycastRenderer, r, g, b, sdl2.SDL_ALPHA_OPAQUE) # Non fare in tutti i cicli
-
-				x = i * RAYCAST_RENDER_MULTIPLIER
-				#sdl2.SDL_RenderFillRect(self.raycastRenderer, sdl2.SDL_Rect(x, int(lineStart * RAYCAST_RENDER_MULTIPLIER), RAYCAST_RENDER_MULTIPLIER, int((lineEnd - lineStart) * RAYCAST_RENDER_MULTIPLIER) + 1))
-				sdl2.SDL_RenderFillRectF(self.raycastRenderer, sdl2.SDL_FRect(x, lineStart * RAYCAST_RENDER_MULTIPLIER, RAYCAST_RENDER_MULTIPLIER, (lineEnd - lineStart) * RAYCAST_RENDER_MULTIPLIER))
-
-	def shade(self, color):
-		# Obtain channels
-		b = color & 0b000000000000000011111111
-		g = color >> 8 & 0b000000000000000011111111
-		r = color >> 16 & 0b000000000000000011111111
-		# Dim channels (and limit to 255, because python doesn't have a fixed byte length)
-		b = (b >> 1)
-		g = (g >> 1)
-		r = (r >> 1)
-		# Compose color
-		return b + (g << 8) + (r << 16)
-
-	def dist(self, ax, ay, bx, by):
-		return math.sqrt((bx-ax)*(bx-ax) + (by-ay)*(by-ay))
+				if texelStart >= lineEnd:
+					break
+				# Obtain texture pixel color
+				color = texels[texBase + textureColumnPixel * TEXTURE_SIZE]
+				if color != segmentColor:
+					if texelStart > segmentStart:
+						rectBatch.add(segmentColor, i, segmentStart, 1, texelStart - segmentStart)
+					segmentColor = color
+					segmentStart = texelStart
+			if lineEnd > segmentStart:
+				rectBatch.add(segmentColor, i, segmentStart, 1, lineEnd - segmentStart)
+
+		# Draw all the segments: a fill call per color
+		rectBatch.submit(self.raycastRenderer)
+
+	def drawFramebuffer(self, renderer):
+		# Renders with a framebuffer renderer into the surface, then uploads it to the render target:
+		# 8 bit with the indexed renderer (SDL converts it through its palette), 32 bit with the JIT one
+		player = self.player
+		frame = renderer.renderFrame(player)
+		surface = self.raycastSurface.contents
+		if renderer is self.jitRenderer:
+			frameAddress = frame.ctypes.data
+		else:
+			frameAddress = frame.buffer_info()[0]
+		rowSize = RAYCAST_RENDER_WIDTH * frame.itemsize
+		if surface.pitch == rowSize:
+			ctypes.memmove(surface.pixels, frameAddress, len(frame) * frame.itemsize)
+		else:
+			for y in range(RAYCAST_RENDER_HEIGHT):
+				ctypes.memmove(surface.pixels + y * surface.pitch, frameAddress + y * rowSize, rowSize)
+		texture = sdl2.SDL_CreateTextureFromSurface(self.raycastRenderer, self.raycastSurface)
+		sdl2.SDL_RenderCopy(self.raycastRenderer, texture, None, None)
+		sdl2.SDL_DestroyTexture(texture)
 
-	def loadTexture(self, pngFilePath):
-		# Loads a texture from png file and converts to sdl2-friendly format
-		reader = png.Reader(filename=pngFilePath)
-		w, h, pixels, metadata = reader.read_flat()
-		if w != TEXTURE_SIZE or h != TEXTURE_SIZE:
-			raise ValueError("Texture {} is not {}x{}, but {}x{}".format(pngFilePath, TEXTURE_SIZE, TEXTURE_SIZE, w, h))
-		color_length = 3 # RGB
-		if metadata['alpha']:
-			color_length = 4 # RGBA (but alpha is ignored)
-		# Convert to sdl2-friendly format
-		converted = []
-		for i in range(0, len(pixels), color_length):
-			# PNG is RGB, SDL surface is BGR
-			converted.append(pixels[i+2] + (pixels[i+1] << 8) + (pixels[i] << 16)) # BGR
-		return converted
+		if not MAP_HIDDEN:
+			# Draw rays in 2D view
+			if renderer is self.jitRenderer:
+				hitPoints = zip(renderer.hitXs, renderer.hitYs)
+			else:
+				hitPoints = [(hit[1], hit[2]) for hit in self.columnCache.hits]
+			for rayX, rayY in hitPoints:
+				sdl2.ext.draw.line(self.mapSurface, sdl2.ext.Color(0,0,255,255), (player.x, player.y, rayX, rayY))
+
+	def exportFrame(self):
+		# Reads the frame drawn by drawRays() back from the render target straight into the next
+		# export slot, with depth and hit tiles of every column
+		pixels = self.exporter.beginFrame()
+		pixelsPointer = (ctypes.c_char * len(pixels)).from_buffer(pixels)
+		sdl2.SDL_RenderReadPixels(self.raycastRenderer, None, sdl2.SDL_PIXELFORMAT_ARGB8888, pixelsPointer, RAYCAST_RENDER_WIDTH * 4)
+		del pixelsPointer
+		pixels.release()
+		if self.jitRenderer is not None:
+			self.exporter.endFrame(self.player, self.jitRenderer.depth, self.jitRenderer.hitTiles)
+		else:
+			hits = self.columnCache.hits
+			self.exporter.endFrame(self.player, [hit[0] for hit in hits], [hit[3] for hit in hits])
 
 	def openDoor(self):
 		# Opens a door near the user
-		# Works by modifying the map (removing the door)
-
-		# Find where is the user
-		mapX = int(self.player_position["x"] / MAP_SCALE)
-		mapY = int(self.player_position["y"] / MAP_SCALE)
-		mapArrayPosition = mapY * MAP_SIZE + mapX
-
-		# Find in which direction the user is looking
-		playerAngle = self.player_position["r"]
-		lookingAtMapArrayPosition = 0
-		if playerAngle > math.pi / 4 and playerAngle <= 3 * math.pi / 4:
-			# Looking up
-			lookingAtMapArrayPosition = mapArrayPosition - MAP_SIZE
-		elif playerAngle > 3 * math.pi / 4 and playerAngle <= 5 * math.pi / 4:
-			# Looking left
-			lookingAtMapArrayPosition = mapArrayPosition - 1
-		elif playerAngle > 5 * math.pi / 4 and playerAngle <= 7 * math.pi / 4:
-			# Looking down
-			lookingAtMapArrayPosition = mapArrayPosition + MAP_SIZE
-		else:
-			# Looking right
-			lookingAtMapArrayPosition = mapArrayPosition + 1
-
-		if MAP[lookingAtMapArrayPosition] == MAP_DOOR_CELL_TYPE:
-			# Player looking at a door: open it ("remove" it, leaving an empty space)
-			MAP[lookingAtMapArrayPosition] = 0
-		else:
-			print("Player looking at cell #{} of type {}: nothing to do".format(lookingAtMapArrayPosition, MAP[lookingAtMapArrayPosition]))
+		self.player.openDoor(self.tileMap, self.doors)
 
 
 
 if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Raycaster")
+	parser.add_argument("--record", metavar="FILE", help="record the input to FILE, to be replayed with replay.py")
+	parser.add_argument("--export", metavar="NAME", help="publish frames to the shared memory block NAME, see frameexport.py")
+	parser.add_argument("--connect", metavar="HOST:PORT", help="play on a multiplayer server, see netsync.py")
+	parser.add_argument("--alloc-profile", metavar="FILE", nargs="?", const="", help="report allocations and GC pauses per frame stage at exit, and write them to the CSV FILE if given (see allocprofile.py)")
+	parser.add_argument("--latency", metavar="FILE", nargs="?", const="", help="report input to present latency at exit, and write it to the CSV FILE if given (see latency.py)")
+	parser.add_argument("--latency-probe", metavar="PRESSES", type=int, help="measure latency with synthetic key presses, and quit after PRESSES presses")
+	parser.add_argument("--jit", action="store_true", help="render with the Numba compiled renderer, if available (see jitrender.py)")
+	args = parser.parse_args()
 	try:
-		main = Main()
+		main = Main(args.record, args.export, args.connect, args.alloc_profile, args.latency, args.latency_probe, args.jit or RAYCAST_JIT)
 		main.run()
 	except KeyboardInterrupt:
 		exit(0)
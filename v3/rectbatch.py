@@ -0,0 +1,83 @@
+# PYTHON RAYCASTER
+# Inspired by https://www.youtube.com/watch?v=gYRrGTC7GtA
+# Copyright (C) 2023 Daniele Verducci
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Batched rectangles
+# Collects the rectangles of a frame grouped by color, and draws every color with a single
+# SDL_RenderFillRectsF() call, instead of setting the color and filling a rectangle at a time.
+# Every color of a frame gets a bucket: an array of floats (x, y, w, h) laid out in memory
+# like an SDL_FRect array, that SDL reads directly. Buckets are kept for the next frames,
+# and rectangles are written in place into them: nothing is allocated per rectangle, and
+# buckets only grow until they hold the largest frame.
+
+from array import array
+import sdl2
+
+RECT_BATCH_BUCKET_SIZE = 16	# Rectangles a new bucket can hold (it doubles when full)
+
+class RectBatch:
+
+	def __init__(self):
+		self.buckets = {}	# 0xRRGGBB color -> bucket index, for the current frame
+		self.rects = []	# Bucket index -> array of x, y, w, h
+		self.pointers = []	# Bucket index -> the same array, as SDL_FRect array
+		self.used = array('I')	# Bucket index -> rectangles added since the last submit()
+
+	def add(self, color, x, y, w, h):
+		bucket = self.buckets.get(color)
+		if bucket is None:
+			bucket = len(self.buckets)
+			if bucket == len(self.rects):
+				self.addBucket()
+			self.buckets[color] = bucket
+		used = self.used[bucket]
+		rects = self.rects[bucket]
+		i = 4 * used
+		if i == len(rects):
+			rects = self.growBucket(bucket)
+		rects[i] = x
+		rects[i + 1] = y
+		rects[i + 2] = w
+		rects[i + 3] = h
+		self.used[bucket] = used + 1
+
+	def submit(self, renderer):
+		# Draws all the rectangles added so far, and empties the batch
+		pointers = self.pointers
+		used = self.used
+		for color, bucket in self.buckets.items():
+			sdl2.SDL_SetRenderDrawColor(renderer, color >> 16 & 0xff, color >> 8 & 0xff, color & 0xff, sdl2.SDL_ALPHA_OPAQUE)
+			sdl2.SDL_RenderFillRectsF(renderer, pointers[bucket], used[bucket])
+			used[bucket] = 0
+		# The colors change at every frame (walls are lit differently at every distance): the
+		# buckets are assigned again to the colors of the next one
+		self.buckets.clear()
+
+	def addBucket(self):
+		self.rects.append(None)
+		self.pointers.append(None)
+		self.used.append(0)
+		self.setBucket(len(self.rects) - 1, array('f', [0.0]) * (4 * RECT_BATCH_BUCKET_SIZE))
+
+	def growBucket(self, bucket):
+		# Doubles a full bucket: its array can't be resized while SDL_FRect arrays use its memory
+		rects = self.rects[bucket]
+		return self.setBucket(bucket, rects + array('f', [0.0]) * len(rects))
+
+	def setBucket(self, bucket, rects):
+		self.rects[bucket] = rects
+		self.pointers[bucket] = (sdl2.SDL_FRect * (len(rects) // 4)).from_buffer(rects)
+		return rects
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+# PYTHON RAYCASTER
+# Inspired by https://www.youtube.com/watch?v=gYRrGTC7GtA
+# Copyright (C) 2023 Daniele Verducci
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Input recording and replay
+# The game records the input of every tick when started with --record, and the recording is
+# fed back through the same movement and door logic (gameTick()), without a keyboard:
+#   ./raycaster.py --record run.rec
+#   ./replay.py run.rec                      replays in the game window
+#   ./replay.py run.rec --headless -o a.csv  replays with the software renderer, no display needed
+#   ./replay.py run.rec --headless --expect a.csv
+# Replays report the time taken to render every frame and a hash of its image, so a replay is
+# also a performance and rendering regression test. Hashes depend on the renderer: compare
+# headless runs with headless runs.
+#
+# Recording file: RECORDING_HEADER, followed by the zlib compressed ticks (RECORDING_TICK):
+# the KEY_* bitmask and the time elapsed since the previous tick, in milliseconds.
+
+import os
+import sys
+import csv
+import time
+import zlib
+import struct
+import ctypes
+import argparse
+from visibility import mapChecksum
+
+RECORDING_MAGIC = b"RCIN"
+RECORDING_VERSION = 1
+RECORDING_HEADER = struct.Struct("<4sBIIddd")	# Magic, version, map checksum, ticks count, spawn x, y, r (map pixels)
+RECORDING_TICK = struct.Struct("<BH")	# Keys, elapsed ms
+RECORDING_MAX_TICK_MS = 65535
+
+KEY_UP = 1
+KEY_DOWN = 2
+KEY_LEFT = 4
+KEY_RIGHT = 8
+KEY_USE = 16
+KEY_DOOR_OPENED = 128	# Not a key: the use key opened a door in this tick (checked while replaying)
+
+class InputRecording:
+
+	def __init__(self, mapCrc, spawn, ticks=None):
+		# spawn is the player (x, y, r) at the first tick, ticks a list of (keys, elapsedMs)
+		self.mapCrc = mapCrc
+		self.spawn = spawn
+		self.ticks = ticks if ticks is not None else []
+
+	@staticmethod
+	def start(tileMap, player):
+		# New empty recording, starting from the current state
+		return InputRecording(mapChecksum(tileMap.cells), (player.x, player.y, player.r))
+
+	def record(self, up, down, left, right, use, elapsedMs, doorOpened):
+		keys = 0
+		if up:
+			keys = keys | KEY_UP
+		if down:
+			keys = keys | KEY_DOWN
+		if left:
+			keys = keys | KEY_LEFT
+		if right:
+			keys = keys | KEY_RIGHT
+		if use:
+			keys = keys | KEY_USE
+		if doorOpened:
+			keys = keys | KEY_DOOR_OPENED
+		self.ticks.append((keys, elapsedMs))
+
+	def save(self, recordingFilePath):
+		body = b"".join(RECORDING_TICK.pack(keys, elapsedMs) for keys, elapsedMs in self.ticks)
+		with open(recordingFilePath, "wb") as recordingFile:
+			recordingFile.write(RECORDING_HEADER.pack(RECORDING_MAGIC, RECORDING_VERSION, self.mapCrc, len(self.ticks), *self.spawn))
+			recordingFile.write(zlib.compress(body, 9))
+
+	@staticmethod
+	def load(recordingFilePath):
+		with open(recordingFilePath, "rb") as recordingFile:
+			data = recordingFile.read()
+		magic, version, mapCrc, ticksCount, spawnX, spawnY, spawnR = RECORDING_HEADER.unpack_from(data)
+		if magic != RECORDING_MAGIC:
+			raise ValueError("{} is not an input recording".format(recordingFilePath))
+		if version != RECORDING_VERSION:
+			raise ValueError("Recording {} has version {}, but should be {}".format(recordingFilePath, version, RECORDING_VERSION))
+		body = zlib.decompress(data[RECORDING_HEADER.size:])
+		if len(body) != ticksCount * RECORDING_TICK.size:
+			raise ValueError("Recording {} is truncated: {} of {} ticks".format(recordingFilePath, len(body) // RECORDING_TICK.size, ticksCount))
+		return InputRecording(mapCrc, (spawnX, spawnY, spawnR), list(RECORDING_TICK.iter_unpack(body)))
+
+def readRendererHash(renderer, width, height):
+	# Hash of the image drawn so far on an SDL renderer
+	import sdl2
+	pixels = ctypes.create_string_buffer(width * height * 4)
+	sdl2.SDL_RenderReadPixels(renderer, None, sdl2.SDL_PIXELFORMAT_ARGB8888, pixels, width * 4)
+	return zlib.crc32(pixels.raw)
+
+def percentile(sortedValues, fraction):
+	return sortedValues[min(int(len(sortedValues) * fraction), len(sortedValues) - 1)]
+
+def main():
+	# Imported here, as raycaster.py imports this module
+	from raycaster import Main, Player, TileMap, gameTick, MAP_DOOR_CELL_TYPE, PVS_FILE, RAYCAST_RENDER_WIDTH, RAYCAST_RENDER_HEIGHT, LIGHTING, LIGHTS
+	from doors import DoorRegistry
+	from visibility import loadOrComputeVisibility
+	from softrender import loadTextures, toRGB, ASSETS_BASE_DIR
+	from jitrender import createRenderer
+	from frameexport import FrameExporter
+	from palette import IndexedTextureStore
+	from lighting import LightMaps
+	from allocprofile import AllocationProfiler
+
+	parser = argparse.ArgumentParser(description="Replays an input recording, measuring frame times and hashing frames")
+	parser.add_argument("recording", help="recording file (./raycaster.py --record FILE)")
+	parser.add_argument("--headless", action="store_true", help="render with the software renderer, without opening a window")
+	parser.add_argument("--indexed", action="store_true", help="with --headless, render with 8 bit palette indexes (see palette.py)")
+	parser.add_argument("--jit", action="store_true", help="with --headless, render with the Numba compiled renderer, if available (see jitrender.py)")
+	parser.add_argument("-o", "--output", help="write tick, pose, frame time and hash of every frame to this CSV file")
+	parser.add_argument("--expect", help="CSV file of a previous run: fails if any frame hash differs")
+	parser.add_argument("--export", metavar="NAME", help="also publish frames to the shared memory block NAME, see frameexport.py")
+	parser.add_argument("--alloc-profile", metavar="FILE", nargs="?", const="", help="report allocations and GC pauses per frame stage, and write them to the CSV FILE if given (see allocprofile.py)")
+	args = parser.parse_args()
+
+	# Without --headless the working dir is changed to load the assets: files are made absolute
+	if args.output:
+		args.output = os.path.abspath(args.output)
+	if args.expect:
+		args.expect = os.path.abspath(args.expect)
+	if args.alloc_profile:
+		args.alloc_profile = os.path.abspath(args.alloc_profile)
+
+	recording = InputRecording.load(args.recording)
+
+	if args.headless:
+		tileMap = TileMap()
+		doors = DoorRegistry(tileMap.cells, tileMap.size, MAP_DOOR_CELL_TYPE)
+		pvs = loadOrComputeVisibility(tileMap.cells, tileMap.size, MAP_DOOR_CELL_TYPE, os.path.join(ASSETS_BASE_DIR, PVS_FILE))
+		player = Player(*recording.spawn)
+		textures = loadTextures()
+		lightMaps = None
+		if args.indexed:
+			textures = IndexedTextureStore(textures)
+		elif LIGHTING:
+			lightMaps = LightMaps(tileMap, LIGHTS, doors)	# Lit like the game
+		renderer = createRenderer(textures, tileMap, doors=doors, pvs=pvs, lightMaps=lightMaps, jit=args.jit)
+		exporter = None
+		if args.export:
+			exporter = FrameExporter(args.export, renderer.width, renderer.height)
+	else:
+		import sdl2.ext
+		os.chdir(ASSETS_BASE_DIR)	# Main loads assets relative to the working dir
+		game = Main(exportName=args.export)
+		exporter = game.exporter
+		tileMap = game.tileMap
+		doors = game.doors
+		player = game.player
+		player.x, player.y, player.r = recording.spawn
+
+	if mapChecksum(tileMap.cells) != recording.mapCrc:
+		print("The recording was made on a different map", file=sys.stderr)
+		if exporter is not None:
+			exporter.close()
+		return 1
+
+	expectedHashes = {}
+	if args.expect:
+		with open(args.expect, newline="") as expectFile:
+			for row in csv.DictReader(expectFile):
+				expectedHashes[int(row["tick"])] = row["hash"]
+
+	profiler = None
+	if args.alloc_profile is not None:
+		profiler = AllocationProfiler(args.alloc_profile)
+		profiler.start()
+
+	rows = []
+	frameTimes = []
+	desyncs = 0
+	mismatches = 0
+	for tick, (keys, elapsedMs) in enumerate(recording.ticks):
+		if profiler is not None:
+			profiler.beginFrame()
+			profiler.stage("tick")
+		opened = gameTick(tileMap, player, doors, keys & KEY_UP, keys & KEY_DOWN, keys & KEY_LEFT, keys & KEY_RIGHT, keys & KEY_USE, elapsedMs / 1000)
+		if bool(opened) != bool(keys & KEY_DOOR_OPENED):
+			# The game logic doesn't behave as when recording
+			desyncs = desyncs + 1
+
+		# Only rendering is timed, hashing is not
+		if profiler is not None:
+			profiler.stage("render")
+		if args.headless:
+			frameStart = time.perf_counter()
+			frame = renderer.renderFrame(player)
+			frameTime = time.perf_counter() - frameStart
+			if profiler is not None:
+				profiler.stage("hash")
+			frameHash = zlib.crc32(toRGB(frame, renderer.palette))
+			if exporter is not None:
+				if profiler is not None:
+					profiler.stage("export")
+				if renderer.palette is not None:
+					frame = renderer.palette.toPacked(frame)
+				hitTiles = renderer.hitTiles if hasattr(renderer, "hitTiles") else [hit[3] for hit in renderer.columnCache.hits]
+				exporter.publish(player, frame, renderer.depth, hitTiles)
+		else:
+			sdl2.ext.get_events()	# Keeps the window responsive
+			frameStart = time.perf_counter()
+			game.drawRays()
+			frameTime = time.perf_counter() - frameStart
+			if profiler is not None:
+				profiler.stage("hash")
+			frameHash = readRendererHash(game.raycastRenderer, RAYCAST_RENDER_WIDTH, RAYCAST_RENDER_HEIGHT)
+			if exporter is not None:
+				if profiler is not None:
+					profiler.stage("export")
+				game.exportFrame()
+			if profiler is not None:
+				profiler.stage("present")
+			game.present()
+
+		frameHash = "{:08x}".format(frameHash)
+		expectedHash = expectedHashes.get(tick)
+		if expectedHash is not None and expectedHash != frameHash:
+			if mismatches == 0:
+				print("First mismatching frame: tick {} (hash {}, expected {})".format(tick, frameHash, expectedHash), file=sys.stderr)
+			mismatches = mismatches + 1
+		frameTimes.append(frameTime)
+		rows.append((tick, "{:.3f}".format(player.x), "{:.3f}".format(player.y), "{:.4f}".format(player.r), "{:.3f}".format(frameTime * 1000), frameHash))
+		if profiler is not None:
+			profiler.endFrame()
+
+	if profiler is not None:
+		profiler.stop()
+		profiler.report()
+
+	if exporter is not None:
+		print("Exported {} frames, {} dropped".format(exporter.frameNumber, exporter.droppedFrames))
+		exporter.close()
+
+	if args.output:
+		with open(args.output, "w", newline="") as outputFile:
+			writer = csv.writer(outputFile)
+			writer.writerow(("tick", "x", "y", "r", "frame_ms", "hash"))
+			writer.writerows(rows)
+
+	if frameTimes:
+		sortedTimes = sorted(frameTimes)
+		print("Replayed {} ticks: frame time mean {:.2f} ms, median {:.2f} ms, p95 {:.2f} ms, max {:.2f} ms".format(
+			len(frameTimes), 1000 * sum(frameTimes) / len(frameTimes), 1000 * percentile(sortedTimes, 0.5), 1000 * percentile(sortedTimes, 0.95), 1000 * sortedTimes[-1]))
+	if desyncs:
+		print("{} ticks opened doors differently than when recording".format(desyncs), file=sys.stderr)
+	if args.expect:
+		print("{} of {} frames differ from {}".format(mismatches, len(expectedHashes), args.expect))
+	return 1 if desyncs or mismatches else 0
+
+if __name__ == '__main__':
+	try:
+		sys.exit(main())
+	except KeyboardInterrupt:
+		exit(0)
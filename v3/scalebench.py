@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+# PYTHON RAYCASTER
+# Inspired by https://www.youtube.com/watch?v=gYRrGTC7GtA
+# Copyright (C) 2023 Daniele Verducci
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Scale benchmark
+# Sweeps the levels of a corpus written by worldgen.py, measuring for every level the time
+# taken to load it and to set up the doors, and the software renderer frame time from random
+# poses (the same ones for the same level). Prints a row per level:
+#   ./worldgen.py --corpus corpus/
+#   ./scalebench.py corpus/ -o scale.csv
+# Precomputed visibility is not used: rays are only limited by the map size, as on any level
+# without a PVS file.
+
+import os
+import sys
+import csv
+import math
+import time
+import random
+import argparse
+from raycaster import Camera, MAP_SCALE, MAP_DOOR_CELL_TYPE
+from doors import DoorRegistry
+from level import loadLevel
+from softrender import SoftRenderer, loadTextures
+from replay import percentile
+from worldgen import WORLDGEN_CORPUS_MANIFEST
+
+SCALEBENCH_FRAMES = 16	# Frames rendered on every level
+SCALEBENCH_SEED = 0
+
+def randomPoses(tileMap, count, seed=SCALEBENCH_SEED):
+	# count Cameras in random empty cells, looking in random directions
+	rng = random.Random(seed)
+	size = tileMap.size
+	cells = tileMap.cells
+	poses = []
+	while len(poses) < count:
+		mapX = rng.randrange(1, size - 1)
+		mapY = rng.randrange(1, size - 1)
+		if cells[mapY * size + mapX] == 0:
+			poses.append(Camera((mapX + 0.5) * MAP_SCALE, (mapY + 0.5) * MAP_SCALE, rng.uniform(0, 2 * math.pi)))
+	return poses
+
+def benchLevel(levelFilePath, textures, frames):
+	# Returns (load s, doors setup s, doors count, frame times, mean wall distance in cells)
+	startTime = time.perf_counter()
+	tileMap = loadLevel(levelFilePath)
+	loadTime = time.perf_counter() - startTime
+	startTime = time.perf_counter()
+	doors = DoorRegistry(tileMap.cells, tileMap.size, MAP_DOOR_CELL_TYPE)
+	doorsTime = time.perf_counter() - startTime
+
+	renderer = SoftRenderer(textures, tileMap, doors=doors)
+	frameTimes = []
+	distances = []
+	for pose in randomPoses(tileMap, frames):
+		startTime = time.perf_counter()
+		renderer.renderFrame(pose)
+		frameTimes.append(time.perf_counter() - startTime)
+		distances.append(sum(renderer.depth) / len(renderer.depth) / MAP_SCALE)
+	return loadTime, doorsTime, len(doors.doors), frameTimes, sum(distances) / len(distances)
+
+def main():
+	parser = argparse.ArgumentParser(description="Measures load and frame times on the levels of a corpus written by worldgen.py")
+	parser.add_argument("corpus", help="corpus directory (./worldgen.py --corpus DIR)")
+	parser.add_argument("--frames", type=int, default=SCALEBENCH_FRAMES, help="frames rendered on every level (default: {})".format(SCALEBENCH_FRAMES))
+	parser.add_argument("--max-size", type=int, help="skip the levels bigger than this")
+	parser.add_argument("-o", "--output", help="write the results to this CSV file")
+	args = parser.parse_args()
+
+	with open(os.path.join(args.corpus, WORLDGEN_CORPUS_MANIFEST), newline="") as manifestFile:
+		levels = [row for row in csv.DictReader(manifestFile) if args.max_size is None or int(row["size"]) <= args.max_size]
+
+	textures = loadTextures()
+	rows = []
+	print("{:<20} {:>6} {:>8} {:>8} {:>8} {:>10} {:>10} {:>10}".format("level", "size", "doors", "load s", "doors s", "frame ms", "p95 ms", "distance"))
+	for level in levels:
+		loadTime, doorsTime, doorsCount, frameTimes, distance = benchLevel(os.path.join(args.corpus, level["file"]), textures, args.frames)
+		sortedTimes = sorted(frameTimes)
+		meanTime = sum(frameTimes) / len(frameTimes)
+		print("{:<20} {:>6} {:>8} {:>8.2f} {:>8.2f} {:>10.2f} {:>10.2f} {:>10.1f}".format(
+			level["file"], level["size"], doorsCount, loadTime, doorsTime, 1000 * meanTime, 1000 * percentile(sortedTimes, 0.95), distance))
+		rows.append((level["file"], level["kind"], level["size"], doorsCount, "{:.3f}".format(loadTime), "{:.3f}".format(doorsTime),
+			"{:.3f}".format(1000 * meanTime), "{:.3f}".format(1000 * percentile(sortedTimes, 0.95)), "{:.2f}".format(distance)))
+
+	if args.output:
+		with open(args.output, "w", newline="") as outputFile:
+			writer = csv.writer(outputFile)
+			writer.writerow(("file", "kind", "size", "doors", "load_s", "doors_s", "frame_ms", "frame_p95_ms", "mean_distance"))
+			writer.writerows(rows)
+	return 0
+
+if __name__ == '__main__':
+	try:
+		sys.exit(main())
+	except KeyboardInterrupt:
+		exit(0)
@@ -0,0 +1,149 @@
+# PYTHON RAYCASTER
+# Inspired by https://www.youtube.com/watch?v=gYRrGTC7GtA
+# Copyright (C) 2023 Daniele Verducci
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Software renderer
+# Renders the same view as Main.drawRays(), but into a memory framebuffer instead of an
+# SDL window, so frames can be produced without a display (batch rendering, servers...).
+# The framebuffer is an array of packed 0x00RRGGBB ints (the same format used by textures),
+# RAYCAST_RENDER_WIDTH x RAYCAST_RENDER_HEIGHT pixels, row by row. With an IndexedTextureStore
+# it is an array of palette indexes instead (see palette.py).
+# Walls are lit by LightMaps if given (see lighting.py), otherwise horizontal walls are shaded.
+
+import os
+import sys
+from array import array
+from raycaster import TileMap, TextureStore, ColumnCache, MAP_SCALE, TEXTURES, TEXTURE_SIZE, RAYCAST_SPAN_COLUMNS, RAYCAST_RENDER_WIDTH, RAYCAST_RENDER_HEIGHT, CEILING_COLOR, FLOOR_COLOR
+from palette import IndexedTextureStore, packColor
+from lighting import litTexels
+
+ASSETS_BASE_DIR = os.path.dirname(os.path.abspath(__file__))	# TEXTURES paths are relative to this dir
+
+def loadTextures():
+	# Loads all the TEXTURES, independently from the current working directory
+	return TextureStore.load(TEXTURES, ASSETS_BASE_DIR)
+
+def toRGB(frame, palette=None):
+	# Converts a packed framebuffer (or an indexed one, given its palette) to a bytes object of
+	# RGB triplets (e.g. for PNG or raw video)
+	if palette is not None:
+		return palette.toRGB(frame)
+	if sys.byteorder == "big":
+		frame = array('I', frame)
+		frame.byteswap()
+	raw = frame.tobytes()	# Little endian: every pixel is B, G, R, 0
+	rgb = bytearray(len(frame) * 3)
+	rgb[0::3] = raw[2::4]
+	rgb[1::3] = raw[1::4]
+	rgb[2::3] = raw[0::4]
+	return bytes(rgb)
+
+class SoftRenderer:
+
+	def __init__(self, textures, tileMap=None, width=RAYCAST_RENDER_WIDTH, height=RAYCAST_RENDER_HEIGHT, doors=None, pvs=None, spanColumns=RAYCAST_SPAN_COLUMNS, lightMaps=None):
+		# textures is a TextureStore, tileMap defaults to the built-in map.
+		# spanColumns is passed to TileMap.castColumns() (1 casts a ray for every column)
+		# lightMaps is a LightMaps of the same map (not supported with indexed textures)
+		self.textures = textures
+		self.tileMap = tileMap if tileMap is not None else TileMap()
+		self.doors = doors
+		self.pvs = pvs
+		self.lightMaps = lightMaps
+		self.litTexels = None
+		if lightMaps is not None:
+			if isinstance(textures, IndexedTextureStore):
+				raise ValueError("Lightmaps can't be used with indexed textures")
+			self.litTexels = litTexels(textures, lightMaps.levels)
+		self.spanColumns = spanColumns
+		self.columnCache = ColumnCache()
+		self.width = width
+		self.height = height
+
+		# Ceiling and floor, copied into the framebuffer at the beginning of every frame
+		ceilingPixels = width * (height // 2)
+		if isinstance(textures, IndexedTextureStore):
+			# 8 bit framebuffer
+			self.palette = textures.palette
+			ceiling = array('B', [self.palette.index(packColor(CEILING_COLOR))])
+			floor = array('B', [self.palette.index(packColor(FLOOR_COLOR))])
+		else:
+			self.palette = None
+			ceiling = array('I', [packColor(CEILING_COLOR)])
+			floor = array('I', [packColor(FLOOR_COLOR)])
+		self.background = ceiling * ceilingPixels + floor * (width * height - ceilingPixels)
+		self.frame = self.background[:]
+		# Distance of the wall drawn in every column
+		self.depth = array('d', bytes(8 * width))
+
+	def renderFrame(self, camera):
+		# Renders the view from camera (a Camera or Player) and returns the framebuffer.
+		# The returned array is reused by the next call.
+		frame = self.frame
+		frame[:] = self.background
+		width = self.width
+		height = self.height
+		maxDof = None
+		if self.pvs is not None:
+			maxDof = self.pvs.maxDof(camera.mapArrayPosition(self.tileMap.size))
+
+		lightMaps = self.lightMaps
+		if lightMaps is not None:
+			lightMaps.update()
+
+		# Cast one ray for every column
+		hits = self.columnCache.castColumns(self.tileMap, camera, width, self.doors, maxDof, self.spanColumns)
+		for i in range(width):
+			shortestDist, rayX, rayY, hitTile, texColumn, shading = hits[i]
+			self.depth[i] = shortestDist
+			texels = None
+			if lightMaps is not None:
+				texels = self.litTexels[lightMaps.level(rayX, rayY, texColumn, shading, camera.x, camera.y)]
+			self.drawColumn(i, shortestDist, hitTile, texColumn, shading, texels)
+
+		return frame
+
+	def drawColumn(self, i, shortestDist, hitTile, texColumn, shading, texels=None):
+		# Draws the textured wall slice of column i, from texels if given (e.g. lit ones)
+		frame = self.frame
+		width = self.width
+		height = self.height
+		textures = self.textures
+		if texels is None:
+			texels = textures.shadedTexels if shading else textures.texels
+		texBase = textures.textureBase(hitTile) + texColumn
+
+		# Calculate line height based on distance and center it vertically
+		lineHeight = MAP_SCALE * height / shortestDist
+		lineOffset = height / 2 - lineHeight / 2
+
+		# Clipping
+		lineStart = max(0, int(lineOffset))
+		lineEnd = min(height, int(lineOffset + lineHeight))
+
+		# Walk the texture column while walking the screen column. Every row gets the texel under
+		# its top edge, computed from y rather than summing texStep, which drifts below texel
+		# boundaries: Main.drawRays() batches segments with the same texels
+		texStep = TEXTURE_SIZE / lineHeight
+		lastTexRow = TEXTURE_SIZE - 1
+		pixelIndex = lineStart * width + i
+		for y in range(lineStart, lineEnd):
+			texRow = int((y - lineOffset) * texStep)
+			if texRow > lastTexRow:
+				texRow = lastTexRow
+			elif texRow < 0:
+				texRow = 0	# The first row starts above the wall (lineStart is rounded down)
+			frame[pixelIndex] = texels[texBase + texRow * TEXTURE_SIZE]
+			pixelIndex = pixelIndex + width
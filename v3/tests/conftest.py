@@ -0,0 +1,5 @@
+# Tests import the v3 modules like the scripts do, from the v3 directory
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
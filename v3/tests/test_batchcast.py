@@ -0,0 +1,25 @@
+# BatchRenderer draws the same pixels as SoftRenderer casting every column
+
+import math
+import random
+import pytest
+
+np = pytest.importorskip("numpy")
+from raycaster import TileMap, Camera, MAP_SCALE
+from softrender import SoftRenderer, loadTextures
+from batchcast import BatchRenderer
+
+def test_matches_soft_renderer():
+	tileMap = TileMap()
+	textures = loadTextures()
+	soft = SoftRenderer(textures, tileMap, spanColumns=1)
+	rng = random.Random(0)
+	emptyCells = [i for i, cell in enumerate(tileMap.cells) if cell == 0]
+	poses = []
+	for pose in range(30):
+		mapY, mapX = divmod(rng.choice(emptyCells), tileMap.size)
+		poses.append(((mapX + rng.random()) * MAP_SCALE, (mapY + rng.random()) * MAP_SCALE, rng.uniform(0, 2 * math.pi)))
+	frames = BatchRenderer(textures, tileMap).render(poses)
+	for pose, frame in zip(poses, frames):
+		expected = np.asarray(soft.renderFrame(Camera(*pose)), dtype=np.uint32).reshape(frame.shape)
+		assert (frame == expected).all()
@@ -0,0 +1,19 @@
+# batchrender.py stops, with exit status 1, when the raw stream reader goes away
+
+import os
+import sys
+import subprocess
+
+BATCHRENDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "batchrender.py")
+
+def test_stops_when_stdout_is_closed(tmp_path):
+	cameraPath = tmp_path / "path.txt"
+	cameraPath.write_text("".join("{} 1.5 {}\n".format(1.5 + 0.01 * i, 0.05 * i) for i in range(40)))
+	process = subprocess.Popen([sys.executable, BATCHRENDER, str(cameraPath), "-j", "1", "--raw"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	try:
+		process.stdout.read(10)
+		process.stdout.close()	# Like "| head -c 10"
+		assert process.wait(timeout=60) == 1
+		assert b"Broken pipe" in process.stderr.read()
+	finally:
+		process.kill()
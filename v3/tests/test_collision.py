@@ -0,0 +1,32 @@
+# Actors swept by ActorCollider pass doors only when they are completely open
+
+import pytest
+from raycaster import TileMap, MAP, MAP_SIZE, MAP_SCALE, MAP_DOOR_CELL_TYPE
+from doors import DoorRegistry
+
+np = pytest.importorskip("numpy")
+from collision import ActorCollider
+
+DOOR = 2 * MAP_SIZE + 10	# The door at (10, 2), between the empty cells (9, 2) and (11, 2)
+
+def walkThroughDoor(collider):
+	# Walks an actor from the middle of (9, 2) towards (11, 2): returns its final cell x
+	positions = np.array([[9.5 * MAP_SCALE, 2.5 * MAP_SCALE]])
+	for step in range(2 * MAP_SCALE // 8):
+		positions, blocked = collider.move(positions, np.array([[8.0, 0.0]]))
+	return int(positions[0, 0] // MAP_SCALE)
+
+def test_closed_door_blocks():
+	assert MAP[DOOR] == MAP_DOOR_CELL_TYPE
+	doors = DoorRegistry(MAP, MAP_SIZE, MAP_DOOR_CELL_TYPE)
+	assert walkThroughDoor(ActorCollider(TileMap(), doors)) == 9
+
+def test_actor_passes_opened_door():
+	doors = DoorRegistry(MAP, MAP_SIZE, MAP_DOOR_CELL_TYPE)
+	collider = ActorCollider(TileMap(), doors)
+	doors.setOpenFraction(DOOR, 1.0)
+	assert walkThroughDoor(collider) == 11
+	# Closing again makes the door solid again
+	doors.setOpenFraction(DOOR, 0.0)
+	positions, blocked = collider.move(np.array([[9.5 * MAP_SCALE, 2.5 * MAP_SCALE]]), np.array([[MAP_SCALE, 0.0]]))
+	assert blocked[0, 0] and int(positions[0, 0] // MAP_SCALE) == 9
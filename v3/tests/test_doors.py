@@ -0,0 +1,68 @@
+# Doors tell every cache what moved since the version it last saw, without taking the changes
+# away from the other caches, and doors moved without animation keep sliding by themselves
+
+import random
+from raycaster import TileMap, ColumnCache, Camera, MAP, MAP_SIZE, MAP_SCALE, MAP_DOOR_CELL_TYPE
+from doors import DoorRegistry, DOOR_CLOSED, DOOR_OPEN, DOOR_SLIDE_TIME, DOOR_STAY_OPEN_TIME
+
+DOOR = 2 * MAP_SIZE + 10	# The door at (10, 2)
+OTHER_DOOR = 10 * MAP_SIZE + 2	# The door at (2, 10)
+
+def test_changed_cells_per_consumer():
+	doors = DoorRegistry(MAP, MAP_SIZE, MAP_DOOR_CELL_TYPE)
+	firstVersion = doors.version
+	doors.open(DOOR)
+	doors.update(0.1)
+	secondVersion = doors.version
+	doors.open(OTHER_DOOR)
+	doors.update(0.1)
+	assert sorted(doors.changedCells(firstVersion)) == sorted([DOOR, OTHER_DOOR])
+	assert sorted(doors.changedCells(secondVersion)) == sorted([DOOR, OTHER_DOOR])
+	# Asking doesn't consume anything
+	assert sorted(doors.changedCells(firstVersion)) == sorted([DOOR, OTHER_DOOR])
+	assert doors.changedCells(doors.version) == []
+
+def test_door_set_open_closes_by_itself():
+	doors = DoorRegistry(MAP, MAP_SIZE, MAP_DOOR_CELL_TYPE)
+	doors.setOpenFraction(DOOR, 1.0)
+	assert doors.get(DOOR).state == DOOR_OPEN
+	elapsedTime = 0.0
+	while elapsedTime < DOOR_STAY_OPEN_TIME + DOOR_SLIDE_TIME + 0.5:
+		doors.update(0.1)
+		elapsedTime = elapsedTime + 0.1
+	assert doors.get(DOOR).state == DOOR_CLOSED
+	assert doors.get(DOOR).openFraction == 0.0
+	assert not doors.moving
+
+def test_column_cache_recasts_door_columns():
+	# Cached hits, after the camera turned and doors moved, are the hits of a full cast
+	tileMap = TileMap()
+	doors = DoorRegistry(tileMap.cells, tileMap.size, MAP_DOOR_CELL_TYPE)
+	rng = random.Random(1)
+	columns = 120
+	for trial in range(100):
+		cache = ColumnCache()
+		while True:
+			camera = Camera(rng.uniform(MAP_SCALE, (MAP_SIZE - 1) * MAP_SCALE), rng.uniform(MAP_SCALE, (MAP_SIZE - 1) * MAP_SCALE), rng.uniform(0.6, 5.6))
+			if tileMap.cells[camera.mapArrayPosition(MAP_SIZE)] == 0:
+				break
+		for step in range(6):
+			cache.castColumns(tileMap, camera, columns, doors, spanColumns=1)
+			for mapArrayPosition in rng.sample(sorted(doors.doors), 2):
+				doors.setOpenFraction(mapArrayPosition, rng.choice([0.0, 0.3, 1.0]))
+			camera.r = camera.r + rng.choice([-5, 0, 5]) / columns
+			hits = cache.castColumns(tileMap, camera, columns, doors, spanColumns=1)
+			expectedHits = tileMap.castColumns(camera.x, camera.y, camera.r, columns, doors, spanColumns=1)
+			for hit, expectedHit in zip(hits, expectedHits):
+				# Turning adds the angles in another order: distances differ by rounding only
+				assert hit[3] == expectedHit[3]
+				assert abs(hit[0] - expectedHit[0]) < 0.001
+
+def test_column_cache_ignores_doors_behind():
+	# From (4.5, 2.5) looking left, the door at (10, 2) is behind the camera
+	camera = Camera(4.5 * MAP_SCALE, 2.5 * MAP_SCALE, 3.14)
+	first, end = ColumnCache.cellColumns(MAP_SIZE, camera, 120, DOOR)
+	assert first == end
+	camera.r = 0.0
+	first, end = ColumnCache.cellColumns(MAP_SIZE, camera, 120, DOOR)
+	assert 0 < first < 60 < end < 120
@@ -0,0 +1,42 @@
+# The SDL drawing of Main.drawRays() (batched wall segments, see rectbatch.py) samples the
+# textures as SoftRenderer does: both draw the same pixels
+
+import os
+import math
+import ctypes
+import random
+import pytest
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+import sdl2
+from raycaster import Main, MAP_SCALE, RAYCAST_RENDER_WIDTH, RAYCAST_RENDER_HEIGHT
+from softrender import SoftRenderer
+
+def test_sdl_drawing_matches_soft_renderer():
+	game = Main()
+	if game.jitRenderer is not None or game.indexedRenderer is not None:
+		pytest.skip("drawRays() doesn't draw segments with this configuration")
+	soft = SoftRenderer(game.textures, game.tileMap, doors=game.doors, pvs=game.pvs, lightMaps=game.lightMaps)
+	rng = random.Random(1)
+	emptyCells = [i for i, cell in enumerate(game.tileMap.cells) if cell == 0]
+	pixels = (ctypes.c_uint32 * (RAYCAST_RENDER_WIDTH * RAYCAST_RENDER_HEIGHT))()
+	for frame in range(10):
+		mapY, mapX = divmod(rng.choice(emptyCells), game.tileMap.size)
+		game.player.x = (mapX + rng.random()) * MAP_SCALE
+		game.player.y = (mapY + rng.random()) * MAP_SCALE
+		game.player.r = rng.uniform(0, 2 * math.pi)
+		game.drawRays()
+		sdl2.SDL_RenderReadPixels(game.raycastRenderer, None, sdl2.SDL_PIXELFORMAT_ARGB8888, pixels, RAYCAST_RENDER_WIDTH * 4)
+		sdl2.SDL_SetRenderTarget(game.raycastRenderer, None)
+		expected = soft.renderFrame(game.player)
+		assert [pixel & 0xffffff for pixel in pixels] == list(expected)
+
+def test_row_above_wall_top_gets_first_texel():
+	# A far wall starting just below a row boundary: the row it starts in gets texel 0
+	from softrender import loadTextures
+	soft = SoftRenderer(loadTextures())
+	lineHeight = 16.02
+	soft.drawColumn(0, MAP_SCALE * soft.height / lineHeight, 1, 5, False)
+	lineStart = int(soft.height / 2 - lineHeight / 2)
+	textures = soft.textures
+	assert soft.frame[lineStart * soft.width] == textures.texels[textures.textureBase(1) + 5]
@@ -0,0 +1,22 @@
+# A frame export replaces the shared memory block left behind by a writer that crashed
+
+import os
+from multiprocessing import shared_memory
+from raycaster import Camera
+from frameexport import FrameExporter, EXPORT_HEADER, EXPORT_MAGIC, EXPORT_VERSION, SLOT_HEADER
+
+def test_replaces_stale_block():
+	name = "raycaster-test-{}".format(os.getpid())
+	# A crashed writer closes its block (when the process ends) but never unlinks it
+	stale = shared_memory.SharedMemory(name, create=True, size=64)
+	stale.buf[:4] = b"XXXX"
+	stale.close()
+
+	exporter = FrameExporter(name, 4, 2)
+	try:
+		assert EXPORT_HEADER.unpack_from(exporter.buffer)[:7] == (EXPORT_MAGIC, EXPORT_VERSION, 1, 4, 2, 4, 4)
+		exporter.publish(Camera(1.0, 2.0, 3.0), bytes(range(32)))
+		sequence, frameNumber, timestamp, x, y, r = SLOT_HEADER.unpack_from(exporter.buffer, exporter.slotOffset(1))
+		assert (sequence, frameNumber, x, y, r) == (2, 1, 1.0, 2.0, 3.0)
+	finally:
+		exporter.close()
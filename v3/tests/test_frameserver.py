@@ -0,0 +1,44 @@
+# A client sending a bad pose gets an error, and can't stop the ticks of the other clients
+
+import math
+import asyncio
+import pytest
+from frameserver import FrameServer, Session, FRAME_HEADER, FRAME_MAGIC, ERROR_MAGIC
+
+class FakeWriter:
+
+	def __init__(self):
+		self.data = b""
+		self.closed = False
+
+	def write(self, data):
+		self.data = self.data + data
+
+	async def drain(self):
+		pass
+
+	def close(self):
+		self.closed = True
+
+@pytest.mark.parametrize("value", ["nan", "inf", "-inf"])
+def test_non_finite_pose_is_rejected(value):
+	server = FrameServer()
+	session = Session(FakeWriter())
+	with pytest.raises(ValueError):
+		server.handleRequest(session, "POSE", [value, "1", "1"])
+	assert not session.frameRequested
+
+def test_broken_session_is_dropped():
+	server = FrameServer()
+	good = Session(FakeWriter())
+	bad = Session(FakeWriter())
+	server.sessions.update((good, bad))
+	server.handleRequest(good, "POSE", ["1.5", "1.5", "0"])
+	bad.player.x = math.nan	# As set before poses were checked
+	bad.frameRequested = True
+	asyncio.run(server.serveTick(1 / 30))
+	asyncio.run(server.serveTick(1 / 30))
+	assert server.sessions == {good}
+	assert bad.writer.closed and FRAME_HEADER.unpack_from(bad.writer.data)[0] == ERROR_MAGIC
+	magic, tick, width, height, encoding, length = FRAME_HEADER.unpack_from(good.writer.data)
+	assert magic == FRAME_MAGIC and len(good.writer.data) == FRAME_HEADER.size + length
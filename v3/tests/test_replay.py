@@ -0,0 +1,22 @@
+# replay.py resolves the files it is given from the working dir, also in windowed mode (which
+# changes the working dir to load the assets)
+
+import os
+import sys
+import subprocess
+from raycaster import TileMap, Player
+from replay import InputRecording
+
+REPLAY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "replay.py")
+
+def test_windowed_relative_paths(tmp_path):
+	recording = InputRecording.start(TileMap(), Player.spawn())
+	for tick in range(10):
+		recording.record(False, False, True, False, False, 16, False)
+	recording.save(str(tmp_path / "rec.bin"))
+	environment = dict(os.environ, SDL_VIDEODRIVER="dummy")
+	subprocess.run([sys.executable, REPLAY, "rec.bin", "-o", "out.csv"], cwd=tmp_path, env=environment, check=True, timeout=120)
+	assert (tmp_path / "out.csv").exists()
+	result = subprocess.run([sys.executable, REPLAY, "rec.bin", "--expect", "out.csv"], cwd=tmp_path, env=environment, capture_output=True, timeout=120)
+	assert result.returncode == 0
+	assert b"0 of 10 frames differ" in result.stdout
@@ -0,0 +1,35 @@
+# Casting walls by spans finds the same hits, and draws the same frames, as casting every column
+
+import math
+import random
+from raycaster import TileMap, Camera, MAP_SCALE, MAP_DOOR_CELL_TYPE
+from doors import DoorRegistry
+from softrender import SoftRenderer, loadTextures
+from worldgen import generateWorld
+
+def randomPoses(tileMap, count, rng):
+	emptyCells = [i for i, cell in enumerate(tileMap.cells) if cell == 0]
+	poses = []
+	for pose in range(count):
+		mapY, mapX = divmod(rng.choice(emptyCells), tileMap.size)
+		poses.append(((mapX + rng.random()) * MAP_SCALE, (mapY + rng.random()) * MAP_SCALE, rng.uniform(0, 2 * math.pi)))
+	return poses
+
+def test_frames_match_every_column():
+	tileMap = TileMap()
+	textures = loadTextures()
+	doors = DoorRegistry(tileMap.cells, tileMap.size, MAP_DOOR_CELL_TYPE)
+	spans = SoftRenderer(textures, tileMap, doors=doors, spanColumns=8)
+	columns = SoftRenderer(textures, tileMap, doors=doors, spanColumns=1)
+	for pose in randomPoses(tileMap, 40, random.Random(0)):
+		assert list(spans.renderFrame(Camera(*pose))) == list(columns.renderFrame(Camera(*pose)))
+
+def test_hits_match_every_column():
+	rng = random.Random(1)
+	for kind in ("maze", "rooms", "arena"):
+		tileMap, doorsCount = generateWorld(kind, 48, 3)
+		doors = DoorRegistry(tileMap.cells, tileMap.size, MAP_DOOR_CELL_TYPE)
+		for mapArrayPosition in doors.doors:
+			doors.setOpenFraction(mapArrayPosition, rng.choice([0.0, 0.3, 1.0]))
+		for x, y, r in randomPoses(tileMap, 100, rng):
+			assert tileMap.castColumns(x, y, r, 250, doors, spanColumns=8) == tileMap.castColumns(x, y, r, 250, doors, spanColumns=1)
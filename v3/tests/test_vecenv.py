@@ -0,0 +1,29 @@
+# Agents open sliding doors as the player does: a door is passable (and drawn open) only once
+# it has slid open
+
+import pytest
+
+np = pytest.importorskip("numpy")
+from raycaster import MAP_SCALE, MAP_SIZE
+from doors import DOOR_SLIDE_TIME
+from vecenv import RaycasterVecEnv, ACTION_NONE, ACTION_FORWARD, ACTION_OPEN_DOOR, VECENV_STEP_TIME
+
+DOOR = 2 * MAP_SIZE + 10	# The door at (10, 2), between the empty cells (9, 2) and (11, 2)
+
+def test_agent_opens_sliding_door():
+	env = RaycasterVecEnv(2)
+	env.reset()
+	player = env.players[0]
+	player.x, player.y, player.r = 9.5 * MAP_SCALE, 2.5 * MAP_SCALE, 0.0
+	observations, rewards, dones, infos = env.step([ACTION_OPEN_DOOR, ACTION_NONE])
+	assert infos[0]["door_opened"] and not infos[1]["door_opened"]
+	# Still closed: the agent is stopped, and sees it
+	for step in range(int(DOOR_SLIDE_TIME / VECENV_STEP_TIME) // 2):
+		env.step([ACTION_FORWARD, ACTION_NONE])
+	assert int(player.x // MAP_SCALE) == 9
+	assert env.renderer.maps[0, DOOR] != 0
+	for step in range(int(DOOR_SLIDE_TIME / VECENV_STEP_TIME) + 40):
+		env.step([ACTION_FORWARD, ACTION_NONE])
+	assert int(player.x // MAP_SCALE) == 11
+	# Only the environment that opened it
+	assert env.renderer.maps[1, DOOR] != 0
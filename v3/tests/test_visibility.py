@@ -0,0 +1,96 @@
+# Rays capped by the PVS maxDof must find the same walls as uncapped ones, with every door
+# open (rays then cross any number of doors, not just PVS_MAX_PORTALS). maxDof is sampled:
+# castRay() casts again the rays finding no wall within it
+
+import math
+import random
+import pytest
+from raycaster import Camera, MAP_SCALE, MAP_DOOR_CELL_TYPE
+from doors import DoorRegistry
+import visibility
+from visibility import VisibilitySets
+from worldgen import generateWorld
+
+pytest.importorskip("numpy")
+
+def openWorld(kind, size, seed, doorDensity):
+	# Generated world with every door open, and its PVS
+	tileMap, doorsCount = generateWorld(kind, size, seed, doorDensity)
+	doors = DoorRegistry(tileMap.cells, tileMap.size, MAP_DOOR_CELL_TYPE)
+	for mapArrayPosition in doors.doors:
+		doors.setOpenFraction(mapArrayPosition, 1.0)
+	return tileMap, doors, VisibilitySets.compute(tileMap.cells, tileMap.size, MAP_DOOR_CELL_TYPE)
+
+def randomRays(tileMap, count, seed):
+	# (x, y, angle, map array position) from random points of empty cells
+	rng = random.Random(seed)
+	size = tileMap.size
+	emptyCells = [i for i, cell in enumerate(tileMap.cells) if cell == 0]
+	for ray in range(count):
+		mapY, mapX = divmod(rng.choice(emptyCells), size)
+		yield (mapX + rng.random()) * MAP_SCALE, (mapY + rng.random()) * MAP_SCALE, rng.uniform(0, 2 * math.pi), mapY * size + mapX
+
+@pytest.mark.parametrize("kind,seed", [("rooms", 1), ("maze", 1)])
+def test_max_dof_ignores_portal_limit(kind, seed, monkeypatch):
+	# The portal limit only trims the visible sets: maxDof is the same as with no limit
+	tileMap, doors, pvs = openWorld(kind, 64, seed, 0.3)
+	monkeypatch.setattr(visibility, "PVS_MAX_PORTALS", 1000)
+	unlimited = VisibilitySets.compute(tileMap.cells, tileMap.size, MAP_DOOR_CELL_TYPE)
+	assert pvs.cellMaxDof == unlimited.cellMaxDof
+	assert pvs.cellSets != unlimited.cellSets
+
+@pytest.mark.parametrize("kind,seed", [("rooms", 1), ("rooms", 2), ("maze", 1)])
+def test_capped_casts_match_uncapped(kind, seed):
+	tileMap, doors, pvs = openWorld(kind, 64, seed, 0.3)
+	for x, y, angle, mapArrayPosition in randomRays(tileMap, 5000, seed):
+		assert tileMap.castRay(x, y, angle, doors, pvs.maxDof(mapArrayPosition)) == tileMap.castRay(x, y, angle, doors)
+
+def test_compiled_renderer_finds_walls_through_open_doors():
+	jitrender = pytest.importorskip("jitrender")
+	if not jitrender.JIT_AVAILABLE:
+		pytest.skip("Numba not installed")
+	from softrender import loadTextures
+	tileMap, doors, pvs = openWorld("rooms", 64, 1, 0.3)
+	renderer = jitrender.JitRenderer(loadTextures(), tileMap, doors=doors, pvs=pvs)
+	for x, y, angle, mapArrayPosition in randomRays(tileMap, 50, 1):
+		renderer.renderFrame(Camera(x, y, angle))
+		assert all(hitTile != 0 for hitTile in renderer.hitTiles)
+
+def positions(bitset):
+	return [position for position in range(bitset.bit_length()) if (bitset >> position) & 1]
+
+def test_sets_on_large_maps():
+	# A world in the corner of a 256 x 256 map (65536 cells) has the same sets as on its own:
+	# packing the doors crossed with the start and reached cells would overflow
+	tileMap, doorsCount = generateWorld("rooms", 64, 1, 0.5)
+	size = 256
+	offset = size - tileMap.size
+	cells = [1] * (size * size)
+	for mapY in range(tileMap.size):
+		cells[(mapY + offset) * size + offset:(mapY + offset + 1) * size] = tileMap.cells[mapY * tileMap.size:(mapY + 1) * tileMap.size]
+	def moved(position):
+		mapY, mapX = divmod(position, tileMap.size)
+		return (mapY + offset) * size + mapX + offset
+
+	pvs = VisibilitySets.compute(tileMap.cells, tileMap.size, MAP_DOOR_CELL_TYPE)
+	largePvs = VisibilitySets.compute(cells, size, MAP_DOOR_CELL_TYPE)
+	doorCells = set(i for i, cell in enumerate(cells) if cell == MAP_DOOR_CELL_TYPE)
+	assert len(largePvs.cellSets) == len(pvs.cellSets)
+	assert any(len(portals) == visibility.PVS_MAX_PORTALS for sets in largePvs.cellSets.values() for portals in sets)
+	for mapArrayPosition, sets in pvs.cellSets.items():
+		largeSets = largePvs.cellSets[moved(mapArrayPosition)]
+		for portals in largeSets:
+			assert doorCells.issuperset(portals)
+		assert largeSets == dict((tuple(moved(door) for door in portals), sum(1 << moved(position) for position in positions(bitset))) for portals, bitset in sets.items())
+
+def test_portals_are_doors_on_large_maps():
+	# On a generated 256 x 256 world, every set is keyed by door cells crossed
+	tileMap, doorsCount = generateWorld("rooms", 256, 1, 0.5)
+	pvs = VisibilitySets.compute(tileMap.cells, tileMap.size, MAP_DOOR_CELL_TYPE)
+	doorCells = set(i for i, cell in enumerate(tileMap.cells) if cell == MAP_DOOR_CELL_TYPE)
+	for mapArrayPosition, sets in pvs.cellSets.items():
+		assert (sets[()] >> mapArrayPosition) & 1 == 1
+		for portals in sets:
+			assert len(portals) <= visibility.PVS_MAX_PORTALS
+			assert list(portals) == sorted(set(portals))
+			assert doorCells.issuperset(portals)
@@ -0,0 +1,123 @@
+# PYTHON RAYCASTER
+# Inspired by https://www.youtube.com/watch?v=gYRrGTC7GtA
+# Copyright (C) 2023 Daniele Verducci
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Vectorized environment
+# Gym-style wrapper running many independent agents in their own copy of the dungeon.
+# Agents move with the same rules as the player (gameTick(): every environment has its own
+# sliding doors, moved by VECENV_STEP_TIME every step) and all the observations of a step are
+# rendered together by a BatchRenderer. The BatchRenderer has no sliding doors: a door is
+# drawn closed until it is completely open, as agents can't pass it before.
+#
+#   env = RaycasterVecEnv(128)
+#   observations = env.reset()
+#   observations, rewards, dones, infos = env.step(actions)
+#
+# Observations are N x H x W uint32 packed 0x00RRGGBB frames (see batchcast.toRGBArray()).
+# Requires NumPy:
+# pip install numpy
+
+import numpy as np
+from raycaster import Player, TileMap, gameTick, PLAYER_SPAWN_POSITION, MAP_DOOR_CELL_TYPE
+from doors import DoorRegistry
+from softrender import loadTextures
+from batchcast import BatchRenderer
+
+# Actions
+ACTION_NONE = 0
+ACTION_FORWARD = 1
+ACTION_BACKWARD = 2
+ACTION_TURN_LEFT = 3
+ACTION_TURN_RIGHT = 4
+ACTION_OPEN_DOOR = 5
+ACTIONS_COUNT = 6
+
+VECENV_MAX_EPISODE_STEPS = 1000
+VECENV_STEP_TIME = 1 / 30	# Seconds of game time per step
+
+class RaycasterVecEnv:
+
+	def __init__(self, envsCount, tileMap=None, maxEpisodeSteps=VECENV_MAX_EPISODE_STEPS, spawnPosition=PLAYER_SPAWN_POSITION):
+		self.envsCount = envsCount
+		self.tileMap = tileMap if tileMap is not None else TileMap()
+		self.maxEpisodeSteps = maxEpisodeSteps
+		self.spawnPosition = spawnPosition
+		# Every environment opens its own doors: one map copy each, textures are shared
+		self.renderer = BatchRenderer(loadTextures(), self.tileMap, mapsCount=envsCount)
+		self.mapIds = np.arange(envsCount)
+		self.envMaps = []
+		self.envDoors = []
+		self.envDoorsVersions = []	# DoorRegistry version drawn by the renderer, per environment
+		self.players = []
+		self.episodeSteps = np.zeros(envsCount, dtype=np.int64)
+		self.observationShape = (self.renderer.height, self.renderer.width)
+		self.actionsCount = ACTIONS_COUNT
+
+	def resetEnv(self, env):
+		self.envMaps[env] = self.tileMap.copy()
+		self.envDoors[env] = DoorRegistry(self.envMaps[env].cells, self.envMaps[env].size, MAP_DOOR_CELL_TYPE)
+		self.envDoorsVersions[env] = self.envDoors[env].version
+		self.renderer.maps[env] = self.tileMap.cells
+		self.players[env] = Player.spawn(self.spawnPosition)
+		self.episodeSteps[env] = 0
+
+	def reset(self):
+		self.envMaps = [None] * self.envsCount
+		self.envDoors = [None] * self.envsCount
+		self.envDoorsVersions = [None] * self.envsCount
+		self.players = [None] * self.envsCount
+		for env in range(self.envsCount):
+			self.resetEnv(env)
+		return self.observe()[0]
+
+	def poses(self):
+		# N x 3 array of (x, y, r), in map pixels
+		return np.array([(player.x, player.y, player.r) for player in self.players], dtype=np.float64)
+
+	def observe(self):
+		return self.renderer.render(self.poses(), self.mapIds, depth=True)
+
+	def step(self, actions):
+		# Applies one action per environment. Environments reaching maxEpisodeSteps are reset,
+		# and their returned observation is the first one of the new episode.
+		doorsOpened = np.zeros(self.envsCount, dtype=bool)
+		for env, action in enumerate(actions):
+			doorsOpened[env] = gameTick(self.envMaps[env], self.players[env], self.envDoors[env], action == ACTION_FORWARD, action == ACTION_BACKWARD,
+				action == ACTION_TURN_LEFT, action == ACTION_TURN_RIGHT, action == ACTION_OPEN_DOOR, VECENV_STEP_TIME)
+			self.updateDoorCells(env)
+		rewards = self.computeRewards(doorsOpened)
+
+		self.episodeSteps = self.episodeSteps + 1
+		dones = self.episodeSteps >= self.maxEpisodeSteps
+		for env in np.flatnonzero(dones):
+			self.resetEnv(env)
+
+		observations, depth = self.observe()
+		infos = [{"depth": depth[env], "door_opened": bool(doorsOpened[env])} for env in range(self.envsCount)]
+		return observations, rewards, dones, infos
+
+	def updateDoorCells(self, env):
+		# Draws the doors that moved as empty cells if passable, as doors otherwise
+		doors = self.envDoors[env]
+		if doors.version == self.envDoorsVersions[env]:
+			return
+		for mapArrayPosition in doors.changedCells(self.envDoorsVersions[env]):
+			self.renderer.setCell(env, mapArrayPosition, 0 if doors.get(mapArrayPosition).isPassable() else self.tileMap.cells[mapArrayPosition])
+		self.envDoorsVersions[env] = doors.version
+
+	def computeRewards(self, doorsOpened):
+		# No task is defined by default: override to shape rewards for a specific task
+		return np.zeros(self.envsCount, dtype=np.float32)
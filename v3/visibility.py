@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+# PYTHON RAYCASTER
+# Inspired by https://www.youtube.com/watch?v=gYRrGTC7GtA
+# Copyright (C) 2023 Daniele Verducci
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Potentially visible sets
+# For every empty cell of the map, the set of cells that can be seen from somewhere inside it.
+# Sets are found by casting a fan of rays from a few points of every cell, and are stored as
+# bitsets (Python ints, bit n is map array position n).
+# Door cells are portals: the cells seen through a door are stored apart, keyed by the doors
+# crossed, and only count as visible while those doors are open.
+# Every cell also stores how many grid lines a ray cast from it may need to check before
+# reaching a wall (maxDof), to be used in place of the global DOF. Rays pass through any
+# number of open doors while rendering, so maxDof counts every door as see-through: rays
+# stopped by PVS_MAX_PORTALS keep marching for it, without adding cells to the sets.
+#
+# Sets are computed at load (requires NumPy), or offline and saved to file:
+#   ./visibility.py -o map.pvs
+#   ./visibility.py -l level.txt -o level.pvs
+
+import os
+import sys
+import json
+import zlib
+import math
+import argparse
+
+PVS_ORIGINS_PER_SIDE = 3	# Rays are cast from a grid of 3 x 3 points inside every cell
+PVS_RAYS_PER_ORIGIN = 256
+PVS_MAX_PORTALS = 2	# Rays crossing more doors add no more cells to the sets
+PVS_CELLS_PER_BATCH = 64	# Cells whose rays are marched together
+PVS_DOF_MARGIN = 2	# Extra grid lines added to maxDof, as rays are sampled
+PVS_FILE_VERSION = 3
+
+def mapChecksum(mapCells):
+	return zlib.crc32(",".join(str(cell) for cell in mapCells).encode("ascii"))
+
+def bitsetFromMask(mask):
+	# Boolean array (one element per map cell) -> int bitset
+	import numpy as np
+	return int.from_bytes(np.packbits(mask, bitorder="little").tobytes(), "little")
+
+def uniquePairs(first, second):
+	# Unique (first, second) pairs of two int arrays, sorted by first then second. Returns them,
+	# and for every input pair the index of its unique pair
+	import numpy as np
+	order = np.lexsort((second, first))
+	first = first[order]
+	second = second[order]
+	isNew = np.ones(len(first), dtype=bool)
+	isNew[1:] = (first[1:] != first[:-1]) | (second[1:] != second[:-1])
+	inverse = np.empty(len(first), dtype=np.int64)
+	inverse[order] = np.cumsum(isNew) - 1
+	return first[isNew], second[isNew], inverse
+
+class VisibilitySets:
+
+	def __init__(self, mapSize, mapCrc, cellSets, cellMaxDof):
+		self.mapSize = mapSize
+		self.mapCrc = mapCrc
+		# map array position -> {tuple of door positions crossed: bitset}. The () key holds the cells
+		# visible without crossing any door
+		self.cellSets = cellSets
+		self.cellMaxDof = cellMaxDof	# map array position -> max grid lines to check
+
+	@staticmethod
+	def compute(mapCells, mapSize, doorCellType):
+		# Computes the sets for every empty cell (requires NumPy)
+		import numpy as np
+
+		cellsCount = mapSize * mapSize
+		cells = np.asarray(mapCells).reshape(mapSize, mapSize)
+		isWall = ((cells != 0) & (cells != doorCellType)).ravel()
+		isDoor = (cells == doorCellType).ravel()
+		# Sets of doors crossed, by id (sorted tuples of door positions): rays carry the id
+		portalSets = [()]
+		portalSetIds = {(): 0}
+
+		# Rays directions and origins (relative to the cell corner), the same for every cell
+		angles = np.arange(PVS_RAYS_PER_ORIGIN) * (2 * math.pi / PVS_RAYS_PER_ORIGIN) + 0.0001
+		offsets = (np.arange(PVS_ORIGINS_PER_SIDE) + 0.5) / PVS_ORIGINS_PER_SIDE
+		originX, originY, angle = (grid.ravel() for grid in np.meshgrid(offsets, offsets, angles, indexing="ij"))
+		dirX = np.cos(angle)
+		dirY = np.sin(angle)
+		with np.errstate(divide="ignore"):
+			tDeltaX = np.abs(1 / dirX)
+			tDeltaY = np.abs(1 / dirY)
+
+		startCells = np.flatnonzero(np.asarray(mapCells) == 0)
+		# Reached cells, as start cell * cellsCount + reached cell (fits int64 up to 2^31 cells),
+		# and the id of the doors crossed to reach them
+		eventPortals = []
+		eventCells = []
+		maxDof = np.zeros(cellsCount, dtype=np.int64)
+		for batchStart in range(0, len(startCells), PVS_CELLS_PER_BATCH):
+			# March the rays of a batch of start cells together
+			start = np.repeat(startCells[batchStart:batchStart + PVS_CELLS_PER_BATCH], len(angle))
+			raysCount = len(start)
+			rays = np.tile(np.arange(len(angle)), raysCount // len(angle))
+			startX = start % mapSize
+			startY = start // mapSize
+			mapX = startX.copy()
+			mapY = startY.copy()
+			stepX = np.where(dirX[rays] > 0, 1, -1)
+			stepY = np.where(dirY[rays] > 0, 1, -1)
+			rayDeltaX = tDeltaX[rays]
+			rayDeltaY = tDeltaY[rays]
+			tMaxX = np.where(dirX[rays] > 0, 1 - originX[rays], originX[rays]) * rayDeltaX
+			tMaxY = np.where(dirY[rays] > 0, 1 - originY[rays], originY[rays]) * rayDeltaY
+			portalIds = np.zeros(raysCount, dtype=np.int64)
+			portalsCount = np.zeros(raysCount, dtype=np.int64)
+			overPortals = np.zeros(raysCount, dtype=bool)	# Marching for maxDof only
+			alive = np.arange(raysCount)	# Indexes of the rays still marching
+
+			while len(alive) > 0:
+				# Grid traversal: move every ray to the next cell it enters
+				advanceX = tMaxX[alive] < tMaxY[alive]
+				movingX = alive[advanceX]
+				movingY = alive[~advanceX]
+				mapX[movingX] = mapX[movingX] + stepX[movingX]
+				tMaxX[movingX] = tMaxX[movingX] + rayDeltaX[movingX]
+				mapY[movingY] = mapY[movingY] + stepY[movingY]
+				tMaxY[movingY] = tMaxY[movingY] + rayDeltaY[movingY]
+				inside = (mapX[alive] >= 0) & (mapY[alive] >= 0) & (mapX[alive] < mapSize) & (mapY[alive] < mapSize)
+				alive = alive[inside]
+				if len(alive) == 0:
+					break
+				reached = mapY[alive] * mapSize + mapX[alive]
+
+				# Record the reached cells, with the doors crossed to see them
+				recording = ~overPortals[alive]
+				recorded = alive[recording]
+				recordedPortals, recordedCells = uniquePairs(portalIds[recorded], start[recorded] * cellsCount + reached[recording])[:2]
+				eventPortals.append(recordedPortals)
+				eventCells.append(recordedCells)
+				np.maximum.at(maxDof, start[alive], np.maximum(np.abs(mapX[alive] - startX[alive]), np.abs(mapY[alive] - startY[alive])))
+
+				# Walls stop the rays, doors are crossed (recording up to PVS_MAX_PORTALS)
+				hitDoor = isDoor[reached] & recording
+				overLimit = hitDoor & (portalsCount[alive] >= PVS_MAX_PORTALS)
+				overPortals[alive[overLimit]] = True
+				crossingMask = hitDoor & ~overLimit
+				crossing = alive[crossingMask]
+				if len(crossing) > 0:
+					fromIds, doorsCrossed, inverse = uniquePairs(portalIds[crossing], reached[crossingMask])
+					toIds = np.empty(len(fromIds), dtype=np.int64)
+					for pair, (fromId, door) in enumerate(zip(fromIds.tolist(), doorsCrossed.tolist())):
+						portalSet = tuple(sorted(portalSets[fromId] + (door,)))
+						toId = portalSetIds.get(portalSet)
+						if toId is None:
+							toId = len(portalSets)
+							portalSets.append(portalSet)
+							portalSetIds[portalSet] = toId
+						toIds[pair] = toId
+					portalIds[crossing] = toIds[inverse]
+				portalsCount[crossing] = portalsCount[crossing] + 1
+				alive = alive[~isWall[reached]]
+
+		# Every cell sees itself
+		eventPortals.append(np.zeros(len(startCells), dtype=np.int64))
+		eventCells.append(startCells * cellsCount + startCells)
+		eventPortals, eventCells = uniquePairs(np.concatenate(eventPortals), np.concatenate(eventCells))[:2]
+		starts = eventCells // cellsCount
+		reached = eventCells % cellsCount
+		# Groups of (doors crossed, start cell)
+		groupStarts = np.flatnonzero((np.diff(eventPortals, prepend=-1) != 0) | (np.diff(starts, prepend=-1) != 0))
+		cellSets = {int(startPosition): {} for startPosition in startCells}
+		for groupStart, groupEnd in zip(groupStarts.tolist(), groupStarts[1:].tolist() + [len(eventCells)]):
+			mask = np.zeros(cellsCount, dtype=bool)
+			mask[reached[groupStart:groupEnd]] = True
+			cellSets[int(starts[groupStart])][portalSets[eventPortals[groupStart]]] = bitsetFromMask(mask)
+		cellMaxDof = {int(startPosition): int(maxDof[startPosition]) + 1 + PVS_DOF_MARGIN for startPosition in startCells}
+
+		return VisibilitySets(mapSize, mapChecksum(mapCells), cellSets, cellMaxDof)
+
+	def isDoorOpen(self, doors, door):
+		# Without a DoorRegistry, doors are removed from the map when opened: consider them open
+		if doors is None:
+			return True
+		state = doors.get(door)
+		return state is None or state.openFraction > 0
+
+	def visibleCells(self, mapArrayPosition, doors=None):
+		# Bitset of the cells visible from the given cell, with the doors currently open.
+		# Non empty cells (where no one can stand) see everything
+		sets = self.cellSets.get(mapArrayPosition)
+		if sets is None:
+			return (1 << (self.mapSize * self.mapSize)) - 1
+		visible = 0
+		for portals, bitset in sets.items():
+			if all(self.isDoorOpen(doors, door) for door in portals):
+				visible = visible | bitset
+		return visible
+
+	def isVisible(self, fromMapArrayPosition, toMapArrayPosition, doors=None):
+		return (self.visibleCells(fromMapArrayPosition, doors) >> toMapArrayPosition) & 1 == 1
+
+	def maxDof(self, mapArrayPosition):
+		# Grid lines to check when casting from the given cell (valid whatever the doors state)
+		return self.cellMaxDof.get(mapArrayPosition, 2 * self.mapSize)
+
+	def matches(self, mapCells, mapSize):
+		return self.mapSize == mapSize and self.mapCrc == mapChecksum(mapCells)
+
+	def save(self, pvsFilePath):
+		data = {
+			"version": PVS_FILE_VERSION,
+			"mapSize": self.mapSize,
+			"mapCrc": self.mapCrc,
+			"cells": [
+				[mapArrayPosition, self.cellMaxDof[mapArrayPosition], [[list(portals), "{:x}".format(bitset)] for portals, bitset in sets.items()]]
+				for mapArrayPosition, sets in self.cellSets.items()
+			],
+		}
+		with open(pvsFilePath, "wb") as pvsFile:
+			pvsFile.write(zlib.compress(json.dumps(data, separators=(",", ":")).encode("ascii"), 9))
+
+	@staticmethod
+	def load(pvsFilePath):
+		with open(pvsFilePath, "rb") as pvsFile:
+			data = json.loads(zlib.decompress(pvsFile.read()))
+		if data["version"] != PVS_FILE_VERSION:
+			raise ValueError("PVS file {} has version {}, but should be {}".format(pvsFilePath, data["version"], PVS_FILE_VERSION))
+		cellSets = {}
+		cellMaxDof = {}
+		for mapArrayPosition, maxDof, sets in data["cells"]:
+			cellSets[mapArrayPosition] = {tuple(portals): int(bitset, 16) for portals, bitset in sets}
+			cellMaxDof[mapArrayPosition] = maxDof
+		return VisibilitySets(data["mapSize"], data["mapCrc"], cellSets, cellMaxDof)
+
+def loadOrComputeVisibility(mapCells, mapSize, doorCellType, pvsFilePath=None):
+	# Loads the sets from pvsFilePath if it exists and matches the map, otherwise computes them.
+	# Returns None if they can't be computed (NumPy not installed)
+	if pvsFilePath and os.path.exists(pvsFilePath):
+		try:
+			pvs = VisibilitySets.load(pvsFilePath)
+		except ValueError:
+			pvs = None	# Written by an older version: computed again
+		if pvs is not None and pvs.matches(mapCells, mapSize):
+			return pvs
+	try:
+		return VisibilitySets.compute(mapCells, mapSize, doorCellType)
+	except ImportError:
+		return None
+
+def main():
+	from raycaster import TileMap, MAP_DOOR_CELL_TYPE
+	from level import loadLevel
+
+	parser = argparse.ArgumentParser(description="Computes the potentially visible sets of a map")
+	parser.add_argument("-l", "--level", help="level file (default: the built-in map)")
+	parser.add_argument("-o", "--output", required=True, help="PVS file to write")
+	args = parser.parse_args()
+
+	if args.level:
+		tileMap = loadLevel(args.level)
+	else:
+		tileMap = TileMap()
+	pvs = VisibilitySets.compute(tileMap.cells, tileMap.size, MAP_DOOR_CELL_TYPE)
+	pvs.save(args.output)
+	visibleCounts = [bin(pvs.visibleCells(cell)).count("1") for cell in pvs.cellSets]
+	print("{} cells, {:.1f} visible cells on average (all doors open)".format(len(visibleCounts), sum(visibleCounts) / max(len(visibleCounts), 1)))
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
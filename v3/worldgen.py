@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+# PYTHON RAYCASTER
+# Inspired by https://www.youtube.com/watch?v=gYRrGTC7GtA
+# Copyright (C) 2023 Daniele Verducci
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# World generator
+# Generates seeded random levels (see level.py), to test the engine on bigger maps than the
+# built-in one:
+#   maze     a perfect maze of 1 cell wide corridors
+#   rooms    rooms of random size, joined by corridors (binary space partitioning)
+#   arena    a single open hall, with scattered pillars
+# Doors are placed in 1 cell wide gaps between two walls (door density is the fraction of
+# those gaps that get one), and walls get textures at random from a weighted mix:
+#   ./worldgen.py maze -s 256 --seed 7 --doors 0.1 --textures 1:20,5:1,6:1 -o maze.txt
+# The same seed and options always give the same level. The player spawns in cell (1, 1),
+# like with the built-in map, and every generator keeps it empty and reachable.
+#
+# The standard corpus is every kind at every WORLDGEN_CORPUS_SIZES size, with fixed seeds,
+# listed in a corpus.csv manifest for benchmarks to sweep (see scalebench.py):
+#   ./worldgen.py --corpus corpus/
+
+import os
+import sys
+import csv
+import time
+import random
+import argparse
+from raycaster import TileMap, MAP_DOOR_CELL_TYPE
+from level import saveLevel
+
+WORLDGEN_KINDS = ("maze", "rooms", "arena")
+WORLDGEN_DOOR_DENSITY = 0.05	# Default fraction of the door gaps that get a door
+WORLDGEN_TEXTURES = "1:24,5:1"	# Default wall texture mix, map value:weight
+WORLDGEN_ROOM_MIN = 4	# Rooms size range, in cells
+WORLDGEN_ROOM_MAX = 12
+WORLDGEN_ARENA_PILLARS = 0.01	# Fraction of the arena cells covered by pillars
+WORLDGEN_CORPUS_SIZES = (32, 256, 1024, 4096)
+WORLDGEN_CORPUS_SEED = 1
+WORLDGEN_CORPUS_MANIFEST = "corpus.csv"
+DOOR_FRAME_LEFT = 2	# Wall textures on the two sides of a door (left or top, right or bottom)
+DOOR_FRAME_RIGHT = 4
+
+def parseTextureMix(textureMix):
+	# "1:20,5:1" -> ([1, 5], [20, 1]). A value without weight has weight 1
+	values = []
+	weights = []
+	for entry in textureMix.split(","):
+		value, weight = (entry.split(":") + ["1"])[:2]
+		value = int(value)
+		if value <= 0 or value > 255 or value == MAP_DOOR_CELL_TYPE:
+			raise ValueError("Texture mix {}: {} is not a wall map value".format(textureMix, value))
+		values.append(value)
+		weights.append(float(weight))
+	if not values or sum(weights) <= 0:
+		raise ValueError("Texture mix {} has no textures".format(textureMix))
+	return values, weights
+
+def generateMaze(size, rng):
+	# Perfect maze (recursive backtracker): corridors on odd cells, walls on even ones
+	cells = bytearray(b"\x01") * (size * size)
+	last = size - 2 if size % 2 == 0 else size - 1	# Corridors on the odd cells before this (the border stays)
+	cells[1 * size + 1] = 0
+	stack = [(1, 1)]
+	while stack:
+		x, y = stack[-1]
+		neighbours = []
+		for dx, dy in ((2, 0), (-2, 0), (0, 2), (0, -2)):
+			nx = x + dx
+			ny = y + dy
+			if 0 < nx < last and 0 < ny < last and cells[ny * size + nx]:
+				neighbours.append((nx, ny))
+		if not neighbours:
+			stack.pop()
+			continue
+		nx, ny = rng.choice(neighbours)
+		cells[((y + ny) // 2) * size + (x + nx) // 2] = 0
+		cells[ny * size + nx] = 0
+		stack.append((nx, ny))
+	return cells
+
+def carveCorridor(cells, size, x1, y1, x2, y2, rng):
+	# L shaped 1 cell wide corridor, horizontal or vertical first
+	if rng.random() < 0.5:
+		cornerX, cornerY = x2, y1
+	else:
+		cornerX, cornerY = x1, y2
+	for x in range(min(x1, cornerX), max(x1, cornerX) + 1):
+		cells[y1 * size + x] = 0
+	for y in range(min(y1, cornerY), max(y1, cornerY) + 1):
+		cells[y * size + cornerX] = 0
+	for x in range(min(cornerX, x2), max(cornerX, x2) + 1):
+		cells[cornerY * size + x] = 0
+	for y in range(min(cornerY, y2), max(cornerY, y2) + 1):
+		cells[y * size + x2] = 0
+
+def placeRooms(cells, size, x, y, width, height, rng):
+	# Binary space partitioning of a part of the map: splits it in two across its longer side,
+	# until the parts are small, places a room in every part, then joins the two halves of every
+	# split with a corridor between one of their rooms. Returns the center of one of the rooms
+	minPart = WORLDGEN_ROOM_MIN + 2	# Room and its walls
+	maxPart = WORLDGEN_ROOM_MAX + 2
+	canSplitX = width >= 2 * minPart
+	canSplitY = height >= 2 * minPart
+	if (width <= maxPart and height <= maxPart) or not (canSplitX or canSplitY):
+		# A room of random size and position, keeping a wall inside the part
+		roomWidth = rng.randint(min(WORLDGEN_ROOM_MIN, width - 2), min(WORLDGEN_ROOM_MAX, width - 2))
+		roomHeight = rng.randint(min(WORLDGEN_ROOM_MIN, height - 2), min(WORLDGEN_ROOM_MAX, height - 2))
+		roomX = x + 1 + rng.randint(0, width - 2 - roomWidth)
+		roomY = y + 1 + rng.randint(0, height - 2 - roomHeight)
+		for row in range(roomY, roomY + roomHeight):
+			cells[row * size + roomX:row * size + roomX + roomWidth] = bytes(roomWidth)
+		return roomX + roomWidth // 2, roomY + roomHeight // 2
+
+	if canSplitX and (not canSplitY or width > height or (width == height and rng.random() < 0.5)):
+		split = rng.randint(minPart, width - minPart)
+		first = placeRooms(cells, size, x, y, split, height, rng)
+		second = placeRooms(cells, size, x + split, y, width - split, height, rng)
+	else:
+		split = rng.randint(minPart, height - minPart)
+		first = placeRooms(cells, size, x, y, width, split, rng)
+		second = placeRooms(cells, size, x, y + split, width, height - split, rng)
+	carveCorridor(cells, size, first[0], first[1], second[0], second[1], rng)
+	return first if rng.random() < 0.5 else second
+
+def generateRooms(size, rng):
+	cells = bytearray(b"\x01") * (size * size)
+	# The border is part of the walls around the outer rooms
+	room = placeRooms(cells, size, 0, 0, size, size, rng)
+	carveCorridor(cells, size, 1, 1, room[0], room[1], rng)	# Reach the spawn cell
+	return cells
+
+def generateArena(size, rng):
+	# Open hall inside the border, with single cell and 2x2 pillars
+	cells = bytearray(size * size)
+	for i in range(size):
+		cells[i] = cells[(size - 1) * size + i] = cells[i * size] = cells[i * size + size - 1] = 1
+	for pillar in range(int((size - 2) * (size - 2) * WORLDGEN_ARENA_PILLARS)):
+		x = rng.randint(1, size - 3)
+		y = rng.randint(1, size - 3)
+		if x <= 3 and y <= 3:
+			continue	# Keep the spawn area clear
+		if rng.random() < 0.5:
+			cells[y * size + x] = 1
+		else:
+			cells[y * size + x] = cells[y * size + x + 1] = cells[(y + 1) * size + x] = cells[(y + 1) * size + x + 1] = 1
+	return cells
+
+def placeDoors(cells, size, density, rng):
+	# Puts a door in density of the 1 cell wide gaps between two plain walls (both sides of
+	# the door get the door frame textures). Returns the number of doors
+	if density <= 0:
+		return 0
+	doors = 0
+	for y in range(1, size - 1):
+		row = y * size
+		for x in range(1, size - 1):
+			position = row + x
+			if cells[position] != 0 or (x == 1 and y == 1):
+				continue
+			left = cells[position - 1]
+			right = cells[position + 1]
+			up = cells[position - size]
+			down = cells[position + size]
+			if left == 1 and right == 1 and up == 0 and down == 0:
+				# Passage along y: door frame on the left and right
+				frameFirst, frameSecond = position - 1, position + 1
+			elif up == 1 and down == 1 and left == 0 and right == 0:
+				frameFirst, frameSecond = position - size, position + size
+			else:
+				continue
+			if rng.random() >= density:
+				continue
+			cells[position] = MAP_DOOR_CELL_TYPE
+			cells[frameFirst] = DOOR_FRAME_LEFT
+			cells[frameSecond] = DOOR_FRAME_RIGHT
+			doors = doors + 1
+	return doors
+
+def applyTextures(cells, textureMix, rng):
+	# Plain walls (value 1) get a texture from the mix
+	values, weights = parseTextureMix(textureMix)
+	if values == [1]:
+		return
+	positions = [position for position, cell in enumerate(cells) if cell == 1]
+	for position, value in zip(positions, rng.choices(values, weights, k=len(positions))):
+		cells[position] = value
+
+def generateWorld(kind, size, seed, doorDensity=WORLDGEN_DOOR_DENSITY, textureMix=WORLDGEN_TEXTURES):
+	# Returns (TileMap, doors count)
+	if kind not in WORLDGEN_KINDS:
+		raise ValueError("Unknown world kind {}, should be one of {}".format(kind, ", ".join(WORLDGEN_KINDS)))
+	if size < 2 * WORLDGEN_ROOM_MIN + 6:
+		raise ValueError("World size {} is too small, should be at least {}".format(size, 2 * WORLDGEN_ROOM_MIN + 6))
+	if doorDensity < 0 or doorDensity > 1:
+		raise ValueError("Door density {} should be between 0 and 1".format(doorDensity))
+	rng = random.Random("{}:{}:{}".format(kind, size, seed))
+	if kind == "maze":
+		cells = generateMaze(size, rng)
+	elif kind == "rooms":
+		cells = generateRooms(size, rng)
+	else:
+		cells = generateArena(size, rng)
+	doors = placeDoors(cells, size, doorDensity, rng)
+	applyTextures(cells, textureMix, rng)
+	return TileMap(cells, size), doors
+
+def writeWorld(levelFilePath, kind, size, seed, doorDensity=WORLDGEN_DOOR_DENSITY, textureMix=WORLDGEN_TEXTURES):
+	# Generates a world and saves it as a level file. Returns (doors count, empty cells count)
+	tileMap, doors = generateWorld(kind, size, seed, doorDensity, textureMix)
+	emptyCells = tileMap.cells.count(0)
+	saveLevel(levelFilePath, tileMap, [
+		"Generated by worldgen.py: {} {}x{}, seed {}, door density {}, textures {}".format(kind, size, size, seed, doorDensity, textureMix),
+		"{} doors, {} empty cells".format(doors, emptyCells)])
+	return doors, emptyCells
+
+def writeCorpus(outputDir, sizes=WORLDGEN_CORPUS_SIZES, seed=WORLDGEN_CORPUS_SEED):
+	# Writes every kind at every size, with the default door density and texture mix, and the manifest
+	os.makedirs(outputDir, exist_ok=True)
+	rows = []
+	for size in sizes:
+		for kind in WORLDGEN_KINDS:
+			fileName = "{}_{}.txt".format(kind, size)
+			startTime = time.perf_counter()
+			doors, emptyCells = writeWorld(os.path.join(outputDir, fileName), kind, size, seed)
+			print("{}: {} doors, {} empty cells ({:.1f} s)".format(fileName, doors, emptyCells, time.perf_counter() - startTime))
+			rows.append((fileName, kind, size, seed, WORLDGEN_DOOR_DENSITY, WORLDGEN_TEXTURES, doors, emptyCells))
+	with open(os.path.join(outputDir, WORLDGEN_CORPUS_MANIFEST), "w", newline="") as manifestFile:
+		writer = csv.writer(manifestFile)
+		writer.writerow(("file", "kind", "size", "seed", "door_density", "textures", "doors", "empty_cells"))
+		writer.writerows(rows)
+
+def main():
+	parser = argparse.ArgumentParser(description="Generates random levels, or the standard corpus of levels for benchmarks")
+	parser.add_argument("kind", nargs="?", choices=WORLDGEN_KINDS, help="kind of world to generate")
+	parser.add_argument("-s", "--size", type=int, default=64, help="map size, in cells (default: 64)")
+	parser.add_argument("--seed", type=int, default=0, help="random seed (default: 0)")
+	parser.add_argument("--doors", type=float, default=WORLDGEN_DOOR_DENSITY, help="fraction of the gaps between walls that get a door (default: {})".format(WORLDGEN_DOOR_DENSITY))
+	parser.add_argument("--textures", default=WORLDGEN_TEXTURES, help="wall texture mix, as map value:weight pairs (default: {})".format(WORLDGEN_TEXTURES))
+	parser.add_argument("-o", "--output", help="level file to write")
+	parser.add_argument("--corpus", metavar="DIR", help="instead, write the standard corpus and its manifest into DIR")
+	parser.add_argument("--max-size", type=int, help="with --corpus, skip the sizes bigger than this")
+	args = parser.parse_args()
+
+	if args.corpus:
+		sizes = [size for size in WORLDGEN_CORPUS_SIZES if args.max_size is None or size <= args.max_size]
+		writeCorpus(args.corpus, sizes)
+		return 0
+	if args.kind is None or args.output is None:
+		parser.error("a kind and an output file are required, unless writing the corpus")
+	doors, emptyCells = writeWorld(args.output, args.kind, args.size, args.seed, args.doors, args.textures)
+	print("{}: {} doors, {} empty cells".format(args.output, doors, emptyCells))
+	return 0
+
+if __name__ == '__main__':
+	try:
+		sys.exit(main())
+	except KeyboardInterrupt:
+		exit(0)